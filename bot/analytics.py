@@ -0,0 +1,178 @@
+# bot/analytics.py
+# Аналитика потребления для поиска утечек и ошибочных показаний (/stats).
+# История показаний читается одним запросом по колонкам, дальше всё считается
+# векторно в NumPy: интервалы между соседними показаниями счётчика, потребление
+# в пересчёте на месяц, скользящее среднее, изменение к прошлому интервалу и флаги.
+# Счётчик — пара (услуга, участник); в Python остаётся только разбор строк запроса в массивы.
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from .catalog import get_utilities
+from .models import MeterReading
+
+DAYS_PER_MONTH = 30.4375
+# Скользящее среднее — по стольким предыдущим интервалам того же счётчика
+ROLLING_WINDOW = 3
+# Всплеск: потребление больше скользящего среднего во столько раз
+SPIKE_FACTOR = 3.0
+# Выброс среди счётчиков услуги: робастный z-score (по медиане и MAD) больше порога
+OUTLIER_Z = 3.5
+MAX_ANOMALIES = 10
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise ValueError("Для аналитики нужен пакет numpy") from exc
+    return numpy
+
+
+def load_readings(utility_id=None):
+    """Подтверждённые показания одним запросом: (utility_id, telegram_id, timestamp, value)."""
+    qs = MeterReading.objects.filter(is_confirmed=True)
+    if utility_id is not None:
+        qs = qs.filter(utility_id=utility_id)
+    return list(qs.values_list('utility_id', 'user__telegram_id', 'timestamp', 'value'))
+
+
+class Intervals:
+    """Интервалы между соседними показаниями счётчиков: по массиву на колонку.
+
+    Интервалы отсортированы по (услуга, участник, время); first/last отмечают
+    первый и последний интервал каждого счётчика.
+    """
+
+    def __init__(self, rows):
+        np = _numpy()
+        n = len(rows)
+        utility = np.fromiter((r[0] for r in rows), np.int64, n)
+        user = np.fromiter((r[1] for r in rows), np.int64, n)
+        ts = np.fromiter((r[2].timestamp() for r in rows), np.float64, n)
+        value = np.fromiter((r[3] for r in rows), np.float64, n)
+        order = np.lexsort((ts, user, utility))
+        utility, user, ts, value = utility[order], user[order], ts[order], value[order]
+
+        same_meter = (utility[1:] == utility[:-1]) & (user[1:] == user[:-1])
+        days = (ts[1:] - ts[:-1]) / 86400
+        keep = same_meter & (days > 0)
+        self.utility = utility[1:][keep]
+        self.user = user[1:][keep]
+        self.end = ts[1:][keep]
+        self.delta = (value[1:] - value[:-1])[keep]
+        self.monthly = self.delta / days[keep] * DAYS_PER_MONTH
+
+        count = len(self.monthly)
+        index = np.arange(count)
+        self.first = np.ones(count, dtype=bool)
+        self.first[1:] = (self.utility[1:] != self.utility[:-1]) | (self.user[1:] != self.user[:-1])
+        self.last = np.ones(count, dtype=bool)
+        self.last[:-1] = self.first[1:]
+        meter_start = np.maximum.accumulate(np.where(self.first, index, 0))
+
+        # Скользящее среднее предыдущих ROLLING_WINDOW интервалов счётчика (без текущего)
+        cumulative = np.concatenate(([0.0], np.cumsum(self.monthly)))
+        window_start = np.maximum(meter_start, index - ROLLING_WINDOW)
+        window = index - window_start
+        self.rolling = np.full(count, np.nan)
+        has_window = window > 0
+        self.rolling[has_window] = (
+            (cumulative[index[has_window]] - cumulative[window_start[has_window]]) / window[has_window]
+        )
+
+        # Изменение к предыдущему интервалу того же счётчика
+        self.change = np.full(count, np.nan)
+        previous = np.roll(self.monthly, 1)
+        comparable = ~self.first & (previous > 0)
+        self.change[comparable] = self.monthly[comparable] / previous[comparable] - 1
+
+        self.decreased = self.delta < 0
+        self.spike = has_window & (self.rolling > 0) & (self.monthly > SPIKE_FACTOR * self.rolling)
+        self.outlier = np.zeros(count, dtype=bool)
+        for utility_id in np.unique(self.utility):
+            # Последние интервалы счётчиков услуги сравниваются между собой
+            current = (self.utility == utility_id) & self.last
+            values = self.monthly[current]
+            median = np.median(values)
+            deviation = np.abs(values - median)
+            # Оценка σ по MAD; если больше половины счётчиков совпадают с медианой — по среднему отклонению
+            scale = np.median(deviation) / 0.6745 or np.mean(deviation) * 1.2533
+            if scale > 0:
+                self.outlier[current] = (values - median) / scale > OUTLIER_Z
+
+
+class UtilityStats:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.meters = 0
+        self.intervals = 0
+        self.median_monthly = 0.0
+        self.total = 0.0
+        # (telegram_id, конец интервала, в месяц, скользящее среднее, изменение, причины)
+        self.anomalies = []
+        self.anomaly_count = 0
+
+    def summary(self):
+        lines = [
+            f"📈 {self.name}: счётчиков {self.meters}, интервалов {self.intervals}, "
+            f"медиана {self.median_monthly:.2f} {self.unit}/мес, всего {self.total:.2f} {self.unit}"
+        ]
+        if not self.anomaly_count:
+            lines.append("Аномалий нет.")
+            return "\n".join(lines)
+        lines.append(f"⚠️ Аномалий: {self.anomaly_count}")
+        for telegram_id, end, monthly, rolling, change, reasons in self.anomalies:
+            details = f"{monthly:.2f} {self.unit}/мес"
+            if not math.isnan(rolling):
+                details += f", среднее {rolling:.2f}"
+            if not math.isnan(change):
+                details += f", {change:+.0%} к прошлому"
+            lines.append(f"• {telegram_id} ({end:%Y-%m-%d}): {details} — {', '.join(reasons)}")
+        if self.anomaly_count > len(self.anomalies):
+            lines.append(f"… и ещё {self.anomaly_count - len(self.anomalies)}")
+        return "\n".join(lines)
+
+
+def compute_stats(utility_id=None):
+    """Статистика и аномалии последних интервалов по каждой услуге (или одной)."""
+    np = _numpy()
+    utilities = {u.id: u for u in get_utilities()}
+    data = Intervals(load_readings(utility_id))
+    results = []
+    for uid in np.unique(data.utility):
+        utility = utilities.get(int(uid))
+        if utility is None:
+            continue
+        mask = data.utility == uid
+        current = mask & data.last
+        stats = UtilityStats(utility.name, utility.unit)
+        stats.meters = int(current.sum())
+        stats.intervals = int(mask.sum())
+        stats.median_monthly = float(np.median(data.monthly[current]))
+        stats.total = float(data.delta[mask & ~data.decreased].sum())
+
+        flagged = current & (data.decreased | data.spike | data.outlier)
+        stats.anomaly_count = int(flagged.sum())
+        # Сначала самые сильные отклонения от собственного среднего
+        indexes = np.flatnonzero(flagged)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.nan_to_num(data.monthly[indexes] / data.rolling[indexes], nan=0.0, posinf=0.0)
+        for i in indexes[np.argsort(-ratio, kind='stable')][:MAX_ANOMALIES]:
+            reasons = []
+            if data.decreased[i]:
+                reasons.append("показания уменьшились")
+            if data.spike[i]:
+                reasons.append(f"в {data.monthly[i] / data.rolling[i]:.1f} раза выше среднего")
+            if data.outlier[i]:
+                reasons.append("намного выше, чем у других")
+            stats.anomalies.append((
+                int(data.user[i]),
+                datetime.fromtimestamp(data.end[i], tz=dt_timezone.utc),
+                float(data.monthly[i]),
+                float(data.rolling[i]),
+                float(data.change[i]),
+                reasons,
+            ))
+        results.append(stats)
+    return results
@@ -0,0 +1,175 @@
+# bot/application.py
+# Сборка telegram.ext.Application: обработчики, фоновые задачи и хуки запуска.
+# Используется и командой manage.py telegram_bot (встроенный сервер PTB),
+# и ASGI-приложением communal_bot/asgi.py (вебхук в общем HTTP-сервере).
+import hashlib
+import logging
+from datetime import time
+
+from django.conf import settings
+from telegram import Update
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters
+
+from .handlers import (
+    start, submit_reading, add_payment, balance, statement,
+    add_utility, set_tariff, delete_utility, delete_tariff,
+    list_utilities, list_tariffs,
+    list_users, user_balance, billing_report,
+    admin_submit_reading, admin_add_payment, broadcast, remind, export, stats,
+    handle_callback, handle_message, handle_document
+)
+from .dispatch import PerUserUpdateProcessor
+from .billing import close_period, current_month_start
+from .broadcast import LEASE_SECONDS, run_broadcast, unfinished_broadcast_ids
+from .dedup import skip_duplicate_update, purge_processed_updates_job
+from .db import run_in_db
+from .fsm import purge_expired_states_job
+from .metrics import instrument_handlers
+from .outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/webhook/'
+
+
+def webhook_secret():
+    """Секрет для заголовка X-Telegram-Bot-Api-Secret-Token.
+
+    Если TELEGRAM_WEBHOOK_SECRET не задан, выводится из токена бота — одинаково во всех процессах.
+    """
+    return settings.TELEGRAM_WEBHOOK_SECRET or hashlib.sha256(settings.TELEGRAM_BOT_TOKEN.encode()).hexdigest()
+
+
+def webhook_url():
+    if not settings.WEBHOOK_BASE_URL:
+        raise ValueError("RENDER_EXTERNAL_URL must be set")
+    return settings.WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH
+
+
+async def close_billing_period_job(context):
+    # Ежемесячное закрытие периода: конец периода — начало текущего месяца
+    end = current_month_start()
+    period = await run_in_db(close_period, end)
+    if period is None:
+        logger.info(f"Billing period ending {end:%Y-%m-%d} is already closed")
+    else:
+        logger.info(f"Closed billing period ending {end:%Y-%m-%d}")
+
+
+async def resume_broadcasts(app):
+    # Рассылки, прерванные перезапуском, продолжаются с сохранённого курсора.
+    # Рассылку, арендованную другим процессом, run_broadcast сразу пропускает
+    for broadcast_id in await run_in_db(unfinished_broadcast_ids):
+        app.create_task(run_broadcast(app.bot, broadcast_id), name=f"broadcast-{broadcast_id}")
+
+
+async def resume_broadcasts_job(context):
+    await resume_broadcasts(context.application)
+
+
+async def on_startup(app):
+    outbox.start()
+    await resume_broadcasts(app)
+
+
+async def on_shutdown(app):
+    await outbox.stop()
+
+
+def build_application(updater=True):
+    """Application со всеми обработчиками.
+
+    updater=False — без встроенного Updater: апдейты кладёт в app.update_queue внешний сервер.
+    """
+    builder = Application.builder().token(settings.TELEGRAM_BOT_TOKEN)
+    builder = builder.post_init(on_startup).post_shutdown(on_shutdown)
+    if not updater:
+        builder = builder.updater(None)
+    if settings.BOT_CONCURRENT_UPDATES > 0 or settings.UPDATE_USER_LEASE:
+        # Апдейты разных пользователей — параллельно, одного пользователя — по очереди
+        # (с UPDATE_USER_LEASE — по очереди и между процессами)
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(
+            max(settings.BOT_CONCURRENT_UPDATES, 1), shared=settings.UPDATE_USER_LEASE
+        ))
+    app = builder.build()
+
+    if settings.UPDATE_DEDUP:
+        # Повторно доставленные апдейты отбрасываются до всех обработчиков
+        app.add_handler(TypeHandler(Update, skip_duplicate_update), group=-1)
+
+    # Регистрация всех обработчиков
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("submit_reading", submit_reading))
+    app.add_handler(CommandHandler("add_payment", add_payment))
+    app.add_handler(CommandHandler("balance", balance))
+    app.add_handler(CommandHandler("statement", statement))
+    app.add_handler(CommandHandler("add_utility", add_utility))
+    app.add_handler(CommandHandler("set_tariff", set_tariff))
+    app.add_handler(CommandHandler("delete_utility", delete_utility))
+    app.add_handler(CommandHandler("delete_tariff", delete_tariff))
+    app.add_handler(CommandHandler("list_utilities", list_utilities))
+    app.add_handler(CommandHandler("list_tariffs", list_tariffs))
+    app.add_handler(CommandHandler("list_users", list_users))
+    app.add_handler(CommandHandler("user_balance", user_balance))
+    app.add_handler(CommandHandler("billing_report", billing_report))
+    app.add_handler(CommandHandler("admin_submit_reading", admin_submit_reading))
+    app.add_handler(CommandHandler("admin_add_payment", admin_add_payment))
+    app.add_handler(CommandHandler("broadcast", broadcast))
+    app.add_handler(CommandHandler("remind", remind))
+    app.add_handler(CommandHandler("export", export))
+    app.add_handler(CommandHandler("stats", stats))
+
+    app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    # Время, ошибки и запросы к БД каждого обработчика — на /metrics
+    instrument_handlers(app)
+
+    if settings.BILLING_AUTO_CLOSE:
+        if app.job_queue is None:
+            logger.warning("JobQueue is unavailable (install python-telegram-bot[job-queue]); "
+                           "close billing periods with 'manage.py close_billing_period'")
+        else:
+            app.job_queue.run_monthly(close_billing_period_job, when=time(0, 5), day=1)
+            # Период мог не закрыться, пока бот был остановлен
+            app.job_queue.run_once(close_billing_period_job, when=0)
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(purge_processed_updates_job, interval=3600, first=60)
+        app.job_queue.run_repeating(purge_expired_states_job, interval=3600, first=120)
+        # Рассылки, брошенные остановленным процессом, подхватываются после истечения аренды
+        app.job_queue.run_repeating(resume_broadcasts_job, interval=LEASE_SECONDS, first=LEASE_SECONDS)
+    return app
+
+
+# =============== ВЕБХУК ВО ВНЕШНЕМ СЕРВЕРЕ ===============
+# Хуки post_init/post_shutdown вызывает только app.run_*, поэтому здесь — явно
+
+async def start_webhook_application(app):
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+    await ensure_webhook(app.bot)
+
+
+async def ensure_webhook(bot, force=False):
+    """Устанавливает вебхук, если он ещё не указывает на этот сервис.
+
+    При нескольких процессах вебхук ставит первый запущенный, остальные только проверяют.
+    После смены TELEGRAM_WEBHOOK_SECRET вебхук переустанавливается командой manage.py set_webhook.
+    """
+    url = webhook_url()
+    if not force:
+        info = await bot.get_webhook_info()
+        if info.url == url:
+            logger.info(f"Webhook is already set to {url}")
+            return False
+    await bot.set_webhook(url, secret_token=webhook_secret(), allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook set to {url}")
+    return True
+
+
+async def stop_webhook_application(app):
+    if app.running:
+        await app.stop()
+    await on_shutdown(app)
+    await app.shutdown()
@@ -0,0 +1,143 @@
+# bot/archive.py
+# Перенос показаний и начислений закрытых расчётных периодов в архивные таблицы
+# (MeterReadingArchive, ChargeArchive). На PostgreSQL архив секционирован по годам,
+# так что горячие MeterReading/Charge содержат только текущие данные.
+# Итоги UserBalance при переносе не меняются: пересборка и проверка балансов
+# учитывают архивные начисления (bot/ledger.py).
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+
+from .models import BillingPeriod, MeterReading, Charge, MeterReadingArchive, ChargeArchive
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Горячая модель -> (архивная модель, колонка секционирования)
+ARCHIVES = {
+    MeterReading: (MeterReadingArchive, 'timestamp'),
+    Charge: (ChargeArchive, 'period_end'),
+}
+
+
+class ArchiveReport:
+    def __init__(self, cutoff, dry_run):
+        self.cutoff = cutoff
+        self.dry_run = dry_run
+        self.readings = 0
+        self.charges = 0
+        self.periods = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def summary(self):
+        if self.cutoff is None:
+            return "Нет закрытых периодов для архивации"
+        mode = " (проверка, без записи)" if self.dry_run else ""
+        return (
+            f"Архивация периодов до {self.cutoff:%Y-%m-%d %H:%M}{mode}:\n"
+            f"Периодов: {self.periods}, показаний: {self.readings}, начислений: {self.charges}\n"
+            f"Время: {self.elapsed:.2f} с"
+        )
+
+
+def current_year_start(now=None):
+    """Начало текущего года (UTC) — граница архивации по умолчанию."""
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    return datetime(now.year, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archived_until():
+    """Конец последнего архивированного периода или None.
+
+    Начисления с period_end не позже этой даты лежат в ChargeArchive.
+    """
+    return BillingPeriod.objects.filter(archived_at__isnull=False).aggregate(end=Max('end'))['end']
+
+
+def archive_cutoff(before=None):
+    """Конец последнего закрытого периода, заканчивающегося не позже before (по умолчанию — начала года)."""
+    before = before or current_year_start()
+    return BillingPeriod.objects.filter(end__lte=before).aggregate(end=Max('end'))['end']
+
+
+def ensure_partitions(model, key, since, until):
+    """Создаёт годовые секции архивной таблицы для дат [since, until] (только PostgreSQL)."""
+    if connection.vendor != 'postgresql':
+        return
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        for year in range(since.year, until.year + 1):
+            # Строки этого года могли попасть в секцию DEFAULT, пока годовой секции не было:
+            # PostgreSQL откажется создавать секцию поверх них
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM "{table}_default" '
+                f'WHERE "{key}" >= %s AND "{key}" < %s)',
+                [datetime(year, 1, 1, tzinfo=dt_timezone.utc), datetime(year + 1, 1, 1, tzinfo=dt_timezone.utc)],
+            )
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}_y{year}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+            )
+
+
+def _archivable(model, cutoff):
+    if model is Charge:
+        return Charge.objects.filter(period_end__lte=cutoff)
+    # Последнее подтверждённое показание счётчика до границы остаётся в MeterReading:
+    # от него считается потребление следующего показания и пересчёт (bot/recalc.py)
+    newer = MeterReading.objects.filter(
+        user_id=OuterRef('user_id'),
+        utility_id=OuterRef('utility_id'),
+        is_confirmed=True,
+        timestamp__gt=OuterRef('timestamp'),
+        timestamp__lte=cutoff,
+    )
+    return MeterReading.objects.filter(timestamp__lte=cutoff).filter(Exists(newer))
+
+
+def _move(model, cutoff, batch_size):
+    # Пачками: копия в архив и удаление из горячей таблицы в одной транзакции
+    archive, key = ARCHIVES[model]
+    fields = [field.attname for field in model._meta.concrete_fields]
+    queryset = _archivable(model, cutoff)
+    bounds = queryset.aggregate(since=Min(key), until=Max(key))
+    if bounds['since'] is None:
+        return 0
+    ensure_partitions(archive, key, bounds['since'], bounds['until'])
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return moved
+            rows = model.objects.filter(pk__in=ids).values(*fields)
+            archive.objects.bulk_create([archive(**row) for row in rows])
+            model.objects.filter(pk__in=ids).delete()
+        moved += len(ids)
+
+
+def archive_periods(before=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Переносит показания и начисления закрытых периодов, заканчивающихся не позже before, в архив.
+
+    Возвращает ArchiveReport. При dry_run строки только подсчитываются.
+    """
+    cutoff = archive_cutoff(before)
+    report = ArchiveReport(cutoff, dry_run)
+    if cutoff is None:
+        return report
+    periods = BillingPeriod.objects.filter(end__lte=cutoff, archived_at__isnull=True)
+    if dry_run:
+        report.readings = _archivable(MeterReading, cutoff).count()
+        report.charges = _archivable(Charge, cutoff).count()
+        report.periods = periods.count()
+    else:
+        report.readings = _move(MeterReading, cutoff, batch_size)
+        report.charges = _move(Charge, cutoff, batch_size)
+        report.periods = periods.update(archived_at=timezone.now())
+    report.elapsed = time.monotonic() - report.started
+    return report
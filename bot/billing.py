@@ -0,0 +1,102 @@
+# bot/billing.py
+# Закрытие расчётного периода: итоги каждого пользователя за период считаются
+# несколькими агрегирующими запросами и сохраняются снимками Statement.
+# Отчёты за закрытые периоды читаются из снимков, а не из сырых строк.
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import BillingPeriod, Statement, Charge, Payment, User
+
+ZERO = Decimal('0')
+
+
+def current_month_start(now=None):
+    """Начало текущего месяца (UTC) — конец периода, закрываемого по расписанию."""
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    return datetime(now.year, now.month, 1, tzinfo=dt_timezone.utc)
+
+
+def closed_until(lock=False):
+    """Конец последнего закрытого периода или None.
+
+    Начисления и платежи не позже этой даты уже вошли в снимки Statement и меняться не должны.
+    С lock=True период блокируется до конца транзакции: закрытие следующего ждёт её записи.
+    """
+    periods = BillingPeriod.objects.order_by('-end')
+    if lock:
+        periods = periods.select_for_update()
+    return periods.values_list('end', flat=True).first()
+
+
+def _totals(queryset):
+    return dict(queryset.values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'))
+
+
+def close_period(end):
+    """Закрывает период от конца предыдущего до end и создаёт Statement по всем пользователям.
+
+    Возвращает BillingPeriod или None, если период с таким концом уже закрыт.
+    """
+    try:
+        return _close_period(end)
+    except IntegrityError:
+        # Тот же период одновременно закрыл другой процесс бота (уникальность BillingPeriod.end)
+        return None
+
+
+def _close_period(end):
+    with transaction.atomic():
+        previous = BillingPeriod.objects.select_for_update().order_by('-end').first()
+        if previous is not None and previous.end >= end:
+            return None
+        start = previous.end if previous else None
+
+        charges = Charge.objects.filter(period_end__lte=end)
+        payments = Payment.objects.filter(timestamp__lte=end)
+        if start is not None:
+            charges = charges.filter(period_end__gt=start)
+            payments = payments.filter(timestamp__gt=start)
+        charge_totals = _totals(charges)
+        payment_totals = _totals(payments)
+        opening = {}
+        if previous is not None:
+            opening = dict(previous.statements.values_list('user_id', 'closing_balance'))
+
+        period = BillingPeriod.objects.create(start=start, end=end)
+        statements = []
+        for user_id in User.objects.values_list('id', flat=True):
+            opening_balance = opening.get(user_id, ZERO)
+            total_charges = charge_totals.get(user_id) or ZERO
+            total_payments = payment_totals.get(user_id) or ZERO
+            statements.append(Statement(
+                period=period,
+                user_id=user_id,
+                opening_balance=opening_balance,
+                total_charges=total_charges,
+                total_payments=total_payments,
+                closing_balance=opening_balance + total_payments - total_charges,
+            ))
+        Statement.objects.bulk_create(statements, batch_size=1000)
+    return period
+
+
+def last_statement(user):
+    return Statement.objects.select_related('period').filter(user=user).order_by('-period__end').first()
+
+
+def period_report(period=None):
+    """Сводка по закрытому периоду (последнему, если не указан) из снимков Statement."""
+    period = period or BillingPeriod.objects.order_by('-end').first()
+    if period is None:
+        return None, None
+    totals = period.statements.aggregate(
+        users=Count('id'),
+        charges=Sum('total_charges'),
+        payments=Sum('total_payments'),
+        closing=Sum('closing_balance'),
+    )
+    return period, totals
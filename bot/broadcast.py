@@ -0,0 +1,140 @@
+# bot/broadcast.py
+# Рассылка сообщения всем участникам.
+# Получатели читаются из таблицы User пачками по курсору User.id, отправка идёт
+# через общий token bucket (глобальный лимит Telegram) с ограниченным числом
+# одновременных запросов, а курсор и счётчики сохраняются после каждой пачки —
+# после перезапуска рассылка продолжается с места остановки.
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from .db import run_in_db
+from .models import Broadcast, User
+from .ratelimit import PerChatLimiter, get_bucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+# Аренда рассылки процессом: продлевается после каждой пачки
+LEASE_SECONDS = 300
+
+REMINDER_TEXT = (
+    "🔔 Напоминание: пора передать показания счётчиков.\n"
+    "Отправьте /submit_reading"
+)
+
+_chat_limiter = PerChatLimiter()
+
+
+def _recipient_batch(broadcast_id, after_id):
+    broadcast = Broadcast.objects.get(id=broadcast_id)
+    qs = User.objects.filter(id__gt=after_id).order_by('id')
+    if broadcast.created_by_id:
+        qs = qs.exclude(id=broadcast.created_by_id)
+    return list(qs.values_list('id', 'telegram_id')[:BATCH_SIZE])
+
+
+async def iter_recipients(broadcast_id, after_id):
+    """Асинхронный итератор пачек (user_id, telegram_id) после курсора after_id."""
+    while True:
+        batch = await run_in_db(_recipient_batch, broadcast_id, after_id)
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1][0]
+
+
+async def send_with_limits(bot, chat_id, text):
+    """Отправляет сообщение с учётом лимитов Telegram. True — доставлено, False — чат недоступен."""
+    for attempt in range(MAX_ATTEMPTS):
+        await _chat_limiter.acquire(chat_id)
+        await get_bucket().acquire()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return True
+        except RetryAfter as e:
+            get_bucket().pause(retry_after_seconds(e))
+        except (Forbidden, BadRequest):
+            # Бот заблокирован или чат не существует — повторять бессмысленно
+            return False
+        except (TimedOut, NetworkError):
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+
+def _lease_until():
+    return timezone.now() + timedelta(seconds=LEASE_SECONDS)
+
+
+def _claim(broadcast_id):
+    # Атомарно: рассылку продолжает только один процесс
+    return Broadcast.objects.filter(
+        Q(lease_until__isnull=True) | Q(lease_until__lt=timezone.now()),
+        id=broadcast_id, finished_at__isnull=True,
+    ).update(lease_until=_lease_until()) == 1
+
+
+def _renew(broadcast_id):
+    Broadcast.objects.filter(id=broadcast_id).update(lease_until=_lease_until())
+
+
+def _save_progress(broadcast_id, last_user_id, sent, failed):
+    Broadcast.objects.filter(id=broadcast_id).update(
+        last_user_id=last_user_id, sent=F('sent') + sent, failed=F('failed') + failed,
+        lease_until=_lease_until(),
+    )
+
+
+def _finish(broadcast_id):
+    Broadcast.objects.filter(id=broadcast_id).update(finished_at=timezone.now())
+    return Broadcast.objects.select_related('created_by').get(id=broadcast_id)
+
+
+async def run_broadcast(bot, broadcast_id):
+    """Выполняет (или продолжает) рассылку и отправляет отчёт её автору."""
+    if not await run_in_db(_claim, broadcast_id):
+        return
+    broadcast = await run_in_db(Broadcast.objects.get, id=broadcast_id)
+    logger.info(f"Running broadcast {broadcast_id} from user id > {broadcast.last_user_id}")
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(settings.BROADCAST_CONCURRENCY)
+
+    async def deliver(telegram_id):
+        async with semaphore:
+            return await send_with_limits(bot, telegram_id, broadcast.text)
+
+    sent_now = 0
+    async for batch in iter_recipients(broadcast_id, broadcast.last_user_id):
+        await run_in_db(_renew, broadcast_id)
+        results = await asyncio.gather(*(deliver(telegram_id) for _, telegram_id in batch))
+        sent = sum(results)
+        sent_now += sent
+        await run_in_db(_save_progress, broadcast_id, batch[-1][0], sent, len(results) - sent)
+
+    broadcast = await run_in_db(_finish, broadcast_id)
+    elapsed = time.monotonic() - started
+    rate = sent_now / elapsed if elapsed else 0.0
+    logger.info(f"Broadcast {broadcast_id} finished: sent={broadcast.sent}, failed={broadcast.failed}, "
+                f"{rate:.1f} msg/s")
+    if broadcast.created_by:
+        await send_with_limits(
+            bot, broadcast.created_by.telegram_id,
+            f"📣 Рассылка #{broadcast_id} завершена.\n"
+            f"Доставлено: {broadcast.sent}, не доставлено: {broadcast.failed}\n"
+            f"Время: {elapsed:.1f} с ({rate:.1f} сообщ./с)"
+        )
+
+
+def create_broadcast(text, created_by):
+    return Broadcast.objects.create(text=text, created_by=created_by)
+
+
+def unfinished_broadcast_ids():
+    return list(Broadcast.objects.filter(finished_at__isnull=True).order_by('id').values_list('id', flat=True))
@@ -0,0 +1,110 @@
+# bot/catalog.py
+# Каталог услуг в памяти процесса и готовые inline-клавиатуры по префиксу callback.
+# Каталог версионируется: любое изменение Utility (bot/signals.py) увеличивает
+# версию, и все ранее построенные клавиатуры становятся недействительными.
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .db import run_in_db
+from .models import Utility
+
+# Клавиатуры с id пользователя в префиксе (admin_read_util:<id>:) уникальны,
+# поэтому их число ограничено
+KEYBOARD_CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_utilities = None
+_by_id = {}
+_loaded_at = 0.0
+_version = 0
+_keyboards = OrderedDict()
+
+
+def _is_fresh():
+    return _utilities is not None and time.monotonic() - _loaded_at < settings.CATALOG_CACHE_TTL
+
+
+def get_utilities():
+    """Список всех услуг (по id). Из БД загружается только при пустом кэше."""
+    global _utilities, _by_id, _loaded_at
+    if _is_fresh():
+        return _utilities
+    with _lock:
+        version = _version
+        utilities = list(Utility.objects.order_by('id'))
+        if version == _version:
+            _utilities = utilities
+            _by_id = {u.id: u for u in utilities}
+            _loaded_at = time.monotonic()
+            _keyboards.clear()
+    return utilities
+
+
+def get_utility(utility_id):
+    """Услуга по id; Utility.DoesNotExist, если такой нет."""
+    utilities = get_utilities()
+    by_id = _by_id if utilities is _utilities else {u.id: u for u in utilities}
+    utility = by_id.get(utility_id)
+    if utility is None:
+        raise Utility.DoesNotExist(f"Utility {utility_id} does not exist")
+    return utility
+
+
+def utility_keyboard(prefix, utility_ids=None):
+    """Клавиатура из услуг с callback_data=f"{prefix}{utility.id}" или None, если услуг нет.
+
+    utility_ids ограничивает набор услуг; такие клавиатуры не кэшируются.
+    """
+    utilities = get_utilities()
+    if utility_ids is not None:
+        return _build_keyboard(prefix, [u for u in utilities if u.id in utility_ids])
+    with _lock:
+        markup = _keyboards.get(prefix)
+        if markup is not None:
+            _keyboards.move_to_end(prefix)
+            return markup
+    markup = _build_keyboard(prefix, utilities)
+    with _lock:
+        _keyboards[prefix] = markup
+        if len(_keyboards) > KEYBOARD_CACHE_SIZE:
+            _keyboards.popitem(last=False)
+    return markup
+
+
+def _build_keyboard(prefix, utilities):
+    if not utilities:
+        return None
+    # InlineKeyboardMarkup неизменяем, поэтому один объект можно отдавать всем обработчикам
+    return InlineKeyboardMarkup([[InlineKeyboardButton(u.name, callback_data=f"{prefix}{u.id}")] for u in utilities])
+
+
+def invalidate():
+    global _utilities, _by_id, _version
+    with _lock:
+        _utilities = None
+        _by_id = {}
+        _version += 1
+        _keyboards.clear()
+
+
+# Асинхронные варианты: при тёплом кэше обходятся без пула БД
+async def aget_utilities():
+    if _is_fresh():
+        return _utilities
+    return await run_in_db(get_utilities)
+
+
+async def aget_utility(utility_id):
+    if _is_fresh():
+        return get_utility(utility_id)
+    return await run_in_db(get_utility, utility_id)
+
+
+async def autility_keyboard(prefix, utility_ids=None):
+    if _is_fresh():
+        return utility_keyboard(prefix, utility_ids)
+    return await run_in_db(utility_keyboard, prefix, utility_ids)
@@ -0,0 +1,112 @@
+# bot/db.py
+# Доступ к ORM из асинхронных обработчиков.
+# Синхронные запросы Django выполняются в отдельном ограниченном пуле потоков,
+# чтобы медленный запрос к БД не блокировал event loop бота.
+# Соединения потоков постоянные (DB_CONN_MAX_AGE) или берутся из пула psycopg (DB_POOL);
+# загрузка пула потоков и пула соединений видна в /metrics.
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+
+from .metrics import Gauge, Histogram, query_stats
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_THREAD_POOL_SIZE,
+    thread_name_prefix='bot-db',
+)
+
+# Вызовы, отправленные в пул потоков и ещё не завершённые (выполняются или ждут потока)
+_lock = threading.Lock()
+_in_flight = 0
+
+
+def pool_stats():
+    """Статистика пула соединений psycopg (ConnectionPool.get_stats) или {}, если пул не настроен."""
+    pool = getattr(connections[DEFAULT_DB_ALIAS], 'pool', None)
+    return pool.get_stats() if pool is not None else {}
+
+
+# =============== МЕТРИКИ ===============
+
+DB_CONNECT_SECONDS = Histogram(
+    'bot_db_connect_seconds', "Time to open a DB connection or check one out of the pool"
+)
+DB_THREADS_BUSY = Gauge(
+    'bot_db_threads_busy', "DB calls running in the DB thread pool",
+    lambda: min(_in_flight, settings.DB_THREAD_POOL_SIZE),
+)
+DB_CALLS_WAITING = Gauge(
+    'bot_db_calls_waiting', "DB calls waiting for a free thread in the DB thread pool",
+    lambda: max(_in_flight - settings.DB_THREAD_POOL_SIZE, 0),
+)
+if settings.DATABASES[DEFAULT_DB_ALIAS].get('OPTIONS', {}).get('pool'):
+    DB_POOL_SIZE = Gauge(
+        'bot_db_pool_size', "Connections in the pool, busy and idle", lambda: pool_stats().get('pool_size', 0)
+    )
+    DB_POOL_AVAILABLE = Gauge(
+        'bot_db_pool_available', "Idle connections in the pool", lambda: pool_stats().get('pool_available', 0)
+    )
+    DB_POOL_WAITING = Gauge(
+        'bot_db_pool_requests_waiting', "Threads waiting for a connection from the pool",
+        lambda: pool_stats().get('requests_waiting', 0),
+    )
+
+
+def _with_connection(func):
+    # Соединения Django привязаны к потоку: перед и после вызова закрываем
+    # устаревшие/сломанные, как это делает Django между HTTP-запросами.
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        if connection.connection is None:
+            # Новое соединение или соединение из пула: время подключения — в метрики
+            started = time.perf_counter()
+            connection.ensure_connection()
+            DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            stats = query_stats.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            # Вызов из инструментированного обработчика: считаем его запросы (bot/metrics.py)
+            with connection.execute_wrapper(stats):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return inner
+
+
+async def run_in_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию с ORM-запросами в пуле потоков БД."""
+    global _in_flight
+    runner = sync_to_async(_with_connection(func), thread_sensitive=False, executor=_executor)
+    with _lock:
+        _in_flight += 1
+    try:
+        return await runner(*args, **kwargs)
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+def db_call(func):
+    """Декоратор: превращает синхронную ORM-функцию в awaitable-вызов через пул БД.
+
+    Исходная синхронная функция доступна как ``wrapper.sync``.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db(func, *args, **kwargs)
+
+    wrapper.sync = func
+    return wrapper
+
+
+@db_call
+def fetch(queryset):
+    """Вычисляет QuerySet в пуле БД и возвращает список объектов."""
+    return list(queryset)
@@ -0,0 +1,52 @@
+# bot/dedup.py
+# Защита от повторной обработки апдейтов при нескольких процессах бота.
+# Telegram повторяет доставку вебхука, если не получил ответ вовремя, а за
+# балансировщиком повтор может попасть в другой процесс. Каждый update_id
+# «занимается» вставкой строки ProcessedUpdate: первичный ключ в общей БД
+# гарантирует, что апдейт обработает ровно один процесс.
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from telegram.ext import ApplicationHandlerStop
+
+from .db import run_in_db
+from .metrics import Counter
+from .models import ProcessedUpdate
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_UPDATES = Counter('bot_duplicate_updates_total', "Redelivered updates skipped by update_id")
+
+
+def claim_update(update_id):
+    """True, если апдейт ещё не обрабатывался (и теперь закреплён за текущим процессом)."""
+    try:
+        with transaction.atomic():
+            ProcessedUpdate.objects.create(update_id=update_id)
+    except IntegrityError:
+        return False
+    return True
+
+
+def purge_processed_updates():
+    """Удаляет записи старше UPDATE_DEDUP_TTL — Telegram столько повторы уже не присылает."""
+    cutoff = timezone.now() - timedelta(seconds=settings.UPDATE_DEDUP_TTL)
+    deleted, _ = ProcessedUpdate.objects.filter(received_at__lt=cutoff).delete()
+    return deleted
+
+
+async def skip_duplicate_update(update, context):
+    # Обработчик группы -1: выполняется до всех остальных
+    if not await run_in_db(claim_update, update.update_id):
+        logger.info(f"Skipping duplicate update {update.update_id}")
+        DUPLICATE_UPDATES.inc()
+        raise ApplicationHandlerStop
+
+
+async def purge_processed_updates_job(context):
+    deleted = await run_in_db(purge_processed_updates)
+    if deleted:
+        logger.info(f"Purged {deleted} processed update id(s)")
@@ -0,0 +1,110 @@
+# bot/dispatch.py
+import asyncio
+import sys
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from .db import run_in_db
+from .models import UserUpdateLease
+
+# Аренда снимается сразу после обработки апдейта; срок нужен, только если процесс упал
+UPDATE_LEASE_SECONDS = 300
+LEASE_POLL_SECONDS = 0.05
+
+
+def _update_key(update):
+    # Очередь строится по telegram_id пользователя: именно к нему привязано состояние FSM
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+# =============== АРЕНДА МЕЖДУ ПРОЦЕССАМИ ===============
+
+def acquire_user_lease(telegram_id, token):
+    """True, если очередь апдейтов telegram_id теперь закреплена за token."""
+    lease_until = timezone.now() + timedelta(seconds=UPDATE_LEASE_SECONDS)
+    try:
+        with transaction.atomic():
+            UserUpdateLease.objects.create(telegram_id=telegram_id, token=token, lease_until=lease_until)
+    except IntegrityError:
+        # Аренда занята; перехватывается, только если владелец не снял её вовремя (процесс упал)
+        return UserUpdateLease.objects.filter(
+            telegram_id=telegram_id, lease_until__lt=timezone.now()
+        ).update(token=token, lease_until=lease_until) == 1
+    return True
+
+
+def release_user_lease(telegram_id, token):
+    UserUpdateLease.objects.filter(telegram_id=telegram_id, token=token).delete()
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов от разных пользователей.
+
+    Апдейты одного telegram_id выполняются строго по очереди, поэтому переходы
+    FSMState не гоняются друг с другом. Общее число одновременно обрабатываемых
+    апдейтов ограничено limit, чтобы не исчерпать пул БД.
+
+    Слот лимита берётся только под замком пользователя: апдейты, ждущие своей
+    очереди, слотов не занимают, и очередь одного пользователя не задерживает других.
+    Семафор базового класса (он берётся до do_process_update) поэтому не ограничивает.
+
+    С shared=True очередь пользователя общая для всех процессов бота: под замком
+    процесса апдейт ещё ждёт аренду UserUpdateLease в общей БД.
+    """
+
+    def __init__(self, limit, shared=False):
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+        super().__init__(sys.maxsize)
+        self.limit = limit
+        self.shared = shared
+        self._slots = asyncio.BoundedSemaphore(limit)
+        # telegram_id -> [lock, число апдейтов, ожидающих или держащих lock]
+        self._locks = {}
+
+    async def _acquire_lease(self, key):
+        token = uuid.uuid4().hex
+        while not await run_in_db(acquire_user_lease, key, token):
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+        return token
+
+    async def do_process_update(self, update, coroutine):
+        key = _update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                token = await self._acquire_lease(key) if self.shared else None
+                try:
+                    async with self._slots:
+                        await coroutine
+                finally:
+                    if token is not None:
+                        await run_in_db(release_user_lease, key, token)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._locks.clear()
@@ -0,0 +1,153 @@
+# bot/export.py
+# Выгрузка начислений, оплат и показаний в сжатый CSV или JSON Lines.
+# Строки читаются из БД потоком (.iterator(chunk_size): серверный курсор на PostgreSQL)
+# и сразу пишутся в gzip, поэтому память не зависит от размера таблиц.
+import csv
+import gzip
+import json
+import time
+from decimal import Decimal
+
+from .catalog import get_utilities
+from .importer import parse_timestamp
+from .models import Charge, Payment, MeterReading, ChargeArchive, MeterReadingArchive
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 2000
+
+# Вид выгрузки -> (модель, поле даты для фильтра, колонки: (заголовок, поле values_list))
+EXPORTS = {
+    'charges': (Charge, 'period_end', [
+        ('id', 'id'),
+        ('telegram_id', 'user__telegram_id'),
+        ('utility', 'utility__name'),
+        ('period_start', 'period_start'),
+        ('period_end', 'period_end'),
+        ('consumption', 'consumption'),
+        ('amount', 'amount'),
+        ('calculated_at', 'calculated_at'),
+    ]),
+    'payments': (Payment, 'timestamp', [
+        ('id', 'id'),
+        ('telegram_id', 'user__telegram_id'),
+        ('amount', 'amount'),
+        ('timestamp', 'timestamp'),
+        ('comment', 'comment'),
+    ]),
+    'readings': (MeterReading, 'timestamp', [
+        ('id', 'id'),
+        ('telegram_id', 'user__telegram_id'),
+        ('utility', 'utility__name'),
+        ('value', 'value'),
+        ('timestamp', 'timestamp'),
+        ('is_confirmed', 'is_confirmed'),
+    ]),
+}
+# Архив закрытых периодов (bot/archive.py) — те же колонки
+EXPORTS['archived_charges'] = (ChargeArchive,) + EXPORTS['charges'][1:]
+EXPORTS['archived_readings'] = (MeterReadingArchive,) + EXPORTS['readings'][1:]
+
+
+class ExportReport:
+    def __init__(self, kind, fmt):
+        self.kind = kind
+        self.format = fmt
+        self.rows = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def summary(self):
+        return f"Выгрузка {self.kind} ({self.format}.gz): строк {self.rows}, {self.elapsed:.1f} с"
+
+
+def find_utility(value):
+    """Услуга по названию (без учёта регистра) или id; ValueError, если такой нет."""
+    value = str(value).strip()
+    for utility in get_utilities():
+        if utility.name.lower() == value.lower() or str(utility.id) == value:
+            return utility
+    raise ValueError(f"услуга «{value}» не найдена")
+
+
+def export_queryset(kind, since=None, until=None, utility=None, telegram_id=None):
+    """values_list выбранного вида с фильтрами: [since, until) по дате, услуга, участник."""
+    if kind not in EXPORTS:
+        raise ValueError(f"неизвестный вид выгрузки «{kind}»: {', '.join(EXPORTS)}")
+    model, date_field, columns = EXPORTS[kind]
+    qs = model.objects.all()
+    if since is not None:
+        qs = qs.filter(**{f'{date_field}__gte': since})
+    if until is not None:
+        qs = qs.filter(**{f'{date_field}__lt': until})
+    if utility is not None:
+        if model is Payment:
+            raise ValueError("оплаты не привязаны к услуге")
+        qs = qs.filter(utility=utility)
+    if telegram_id is not None:
+        qs = qs.filter(user__telegram_id=telegram_id)
+    # Порядок по первичному ключу — индекс, без сортировки всей выборки
+    return qs.order_by('pk').values_list(*[field for _, field in columns])
+
+
+def parse_export_args(args):
+    """Аргументы команды /export: вид [формат] [from=ДАТА] [to=ДАТА] [utility=УСЛУГА] [user=TELEGRAM_ID].
+
+    Возвращает kwargs для export_ledger; ValueError при ошибке.
+    """
+    if not args:
+        raise ValueError("не указан вид выгрузки")
+    options = {'kind': args[0].lower(), 'fmt': 'csv'}
+    for arg in args[1:]:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            if arg.lower() not in FORMATS:
+                raise ValueError(f"неизвестный параметр «{arg}»")
+            options['fmt'] = arg.lower()
+        elif key == 'from':
+            options['since'] = parse_timestamp(value)
+        elif key == 'to':
+            options['until'] = parse_timestamp(value)
+        elif key == 'utility':
+            options['utility'] = find_utility(value)
+        elif key == 'user':
+            try:
+                options['telegram_id'] = int(value)
+            except ValueError:
+                raise ValueError(f"некорректный telegram_id «{value}»")
+        else:
+            raise ValueError(f"неизвестный параметр «{key}»")
+    return options
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def export_ledger(path, kind, fmt='csv', since=None, until=None, utility=None, telegram_id=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """Пишет выгрузку в файл path (gzip) и возвращает ExportReport."""
+    if fmt not in FORMATS:
+        raise ValueError(f"неизвестный формат «{fmt}»: {', '.join(FORMATS)}")
+    rows = export_queryset(kind, since, until, utility, telegram_id)
+    headers = [name for name, _ in EXPORTS[kind][2]]
+    report = ExportReport(kind, fmt)
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            for row in rows.iterator(chunk_size=chunk_size):
+                writer.writerow(row)
+                report.rows += 1
+        else:
+            for row in rows.iterator(chunk_size=chunk_size):
+                f.write(json.dumps(
+                    {name: _json_value(value) for name, value in zip(headers, row)}, ensure_ascii=False
+                ))
+                f.write('\n')
+                report.rows += 1
+    report.elapsed = time.monotonic() - report.started
+    return report
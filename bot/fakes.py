@@ -0,0 +1,178 @@
+# bot/fakes.py
+# Поддельные Update/Context/Bot для прогона обработчиков без Telegram:
+# проверка числа запросов (bot/tests.py) и нагрузочные прогоны.
+# Реализованы только атрибуты и методы, которыми пользуются bot/handlers.py
+# и bot/outbox.py; ответы бота складываются в FakeBot.sent.
+import itertools
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .billing import close_period, current_month_start
+from .ledger import rebuild_balances
+from .models import User, Utility, Tariff, MeterReading, Charge, Payment
+from .tariffs import load_tariff_table, price_consumption
+
+_ids = itertools.count(1)
+
+
+class FakeBot:
+    def __init__(self, files=None):
+        self.sent = []
+        # file_id -> содержимое документа для handle_document
+        self.files = files or {}
+
+    def record(self, method, chat_id, text=None, **kwargs):
+        self.sent.append((method, chat_id, text, kwargs))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.record('send_message', chat_id, text, **kwargs)
+
+    async def get_file(self, file_id):
+        return FakeFile(self.files[file_id])
+
+
+class FakeFile:
+    def __init__(self, content):
+        self.content = content
+
+    async def download_to_drive(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.content)
+
+
+class FakeDocument:
+    def __init__(self, file_name, file_id):
+        self.file_name = file_name
+        self.file_id = file_id
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, text=None, document=None, caption=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = next(_ids)
+        self.text = text
+        self.document = document
+        self.caption = caption
+        self.date = timezone.now()
+
+    async def reply_text(self, text, **kwargs):
+        self.bot.record('reply_text', self.chat_id, text, **kwargs)
+
+    async def reply_document(self, document, filename=None, **kwargs):
+        self.bot.record('reply_document', self.chat_id, filename, content=document, **kwargs)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot, chat_id, data):
+        self.bot = bot
+        self.data = data
+        self.from_user = FakeTelegramUser(chat_id)
+        self.message = FakeMessage(bot, chat_id)
+
+    async def answer(self, text=None, **kwargs):
+        self.bot.record('answer', self.message.chat_id, text, **kwargs)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.bot.record('edit_message_text', self.message.chat_id, text, **kwargs)
+
+
+class FakeTelegramUser:
+    def __init__(self, telegram_id):
+        self.id = telegram_id
+
+
+class FakeUpdate:
+    def __init__(self, bot, telegram_id, text=None, data=None, document=None, caption=None):
+        self.update_id = next(_ids)
+        self.effective_user = FakeTelegramUser(telegram_id)
+        self.message = None
+        self.callback_query = None
+        if data is not None:
+            self.callback_query = FakeCallbackQuery(bot, telegram_id, data)
+        else:
+            self.message = FakeMessage(bot, telegram_id, text, document, caption)
+
+
+class FakeApplication:
+    def __init__(self):
+        self.tasks = []
+
+    def create_task(self, coroutine, name=None, **kwargs):
+        # Фоновые задачи (рассылки) не запускаются: проверяется только путь обработчика
+        self.tasks.append(name)
+        coroutine.close()
+
+
+class FakeContext:
+    def __init__(self, bot, args=None):
+        self.bot = bot
+        self.args = args or []
+        self.application = FakeApplication()
+        self.bot_data = {}
+        self.user_data = {}
+        self.chat_data = {}
+
+
+# =============== ТЕСТОВЫЕ ДАННЫЕ ===============
+
+def seed_dataset(users, utilities, readings, admin_telegram_id=1, first_telegram_id=1000):
+    """Заполняет пустую БД: админ, users участников, utilities услуг с двумя тарифами,
+    readings ежемесячных показаний на счётчик с начислениями, ежемесячные оплаты,
+    итоги и закрытый период.
+
+    Возвращает словарь с id объектов для сценариев.
+    """
+    now = timezone.now()
+    start = now - timedelta(days=30 * (readings + 1))
+    admin = User.objects.create(telegram_id=admin_telegram_id, is_admin=True)
+    User.objects.bulk_create([User(telegram_id=first_telegram_id + i) for i in range(users)])
+    members = list(User.objects.filter(telegram_id__gte=first_telegram_id).order_by('id'))
+    Utility.objects.bulk_create([Utility(name=f"Услуга {i + 1}", unit="ед.") for i in range(utilities)])
+    utility_objs = list(Utility.objects.order_by('id'))
+    Tariff.objects.bulk_create(
+        [Tariff(utility=u, rate=Decimal('5.00'), valid_from=start - timedelta(days=1)) for u in utility_objs]
+        + [Tariff(utility=u, rate=Decimal('6.00'), valid_from=start + timedelta(days=45)) for u in utility_objs]
+    )
+    table = load_tariff_table()
+
+    reading_objs, charge_objs, payment_objs = [], [], []
+    for n, member in enumerate(members):
+        for utility in utility_objs:
+            previous = None
+            for k in range(readings):
+                timestamp = start + timedelta(days=30 * k)
+                value = Decimal(100 * k + n)
+                reading_objs.append(MeterReading(
+                    user=member, utility=utility, value=value, timestamp=timestamp, is_confirmed=True
+                ))
+                if previous is not None:
+                    consumption = value - previous[1]
+                    charge_objs.append(Charge(
+                        user=member, utility=utility, period_start=previous[0], period_end=timestamp,
+                        consumption=consumption,
+                        amount=price_consumption(utility.id, consumption, previous[0], timestamp, table),
+                    ))
+                previous = (timestamp, value)
+        for k in range(readings):
+            payment_objs.append(Payment(
+                user=member, amount=Decimal('500.00'), timestamp=start + timedelta(days=30 * k + 5)
+            ))
+    MeterReading.objects.bulk_create(reading_objs, batch_size=1000)
+    Charge.objects.bulk_create(charge_objs, batch_size=1000)
+    Payment.objects.bulk_create(payment_objs, batch_size=1000)
+    rebuild_balances()
+    close_period(current_month_start())
+
+    tariffs = list(Tariff.objects.filter(utility=utility_objs[0]).order_by('valid_from').values_list('id', flat=True))
+    return {
+        'admin': admin.telegram_id,
+        'member': members[0].telegram_id,
+        'member_pk': members[0].pk,
+        'middle_pk': members[len(members) // 2].pk,
+        'utility': utility_objs[0].id,
+        'tariff': tariffs[-1],
+        'since': start,
+    }
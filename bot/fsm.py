@@ -1,21 +1,230 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
 from .models import FSMState
+from .db import run_in_db
+
+logger = logging.getLogger(__name__)
+
+
+# =============== ХРАНИЛИЩА СОСТОЯНИЙ ===============
+# Состояние диалога хранится по User.pk. Брошенные диалоги истекают через FSM_TTL секунд.
+
+class BaseFSMStorage:
+    # blocking=True — операции ходят в сеть/БД и из асинхронного кода выполняются в пуле БД
+    blocking = True
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def set(self, user_id, state_name, context):
+        raise NotImplementedError
+
+    def clear(self, user_id):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Удаляет истёкшие состояния, если хранилище не делает этого само. Возвращает их число."""
+        return 0
+
+
+class DjangoFSMStorage(BaseFSMStorage):
+    """Таблица FSMState в основной БД."""
+
+    def _cutoff(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def get(self, user_id):
+        record = FSMState.objects.filter(
+            user_id=user_id, updated_at__gte=self._cutoff()
+        ).values_list('state_name', 'context').first()
+        return record if record else (None, {})
+
+    def state_from_record(self, record):
+        # Для FSMState, загруженного вместе с пользователем (select_related)
+        if record.updated_at < self._cutoff():
+            return None, {}
+        return record.state_name, record.context
+
+    def set(self, user_id, state_name, context):
+        # Один UPDATE вместо update_or_create (SELECT FOR UPDATE + запись);
+        # INSERT — только при первом состоянии пользователя
+        values = {'state_name': state_name, 'context': context, 'updated_at': timezone.now()}
+        if FSMState.objects.filter(user_id=user_id).update(**values):
+            return
+        try:
+            with transaction.atomic():
+                FSMState.objects.create(user_id=user_id, **values)
+        except IntegrityError:
+            # Строку успел создать параллельный апдейт
+            FSMState.objects.filter(user_id=user_id).update(**values)
+
+    def clear(self, user_id):
+        FSMState.objects.filter(user_id=user_id).delete()
+
+    def purge_expired(self):
+        deleted, _ = FSMState.objects.filter(updated_at__lt=self._cutoff()).delete()
+        return deleted
+
+
+class MemoryFSMStorage(BaseFSMStorage):
+    """LRU-словарь в памяти процесса с истечением по TTL.
+
+    Подходит только для одного процесса: состояние теряется при перезапуске.
+    """
+    blocking = False
+
+    def __init__(self, ttl, maxsize=10000):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                return None, {}
+            state_name, context, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[user_id]
+                return None, {}
+            self._data.move_to_end(user_id)
+            return state_name, dict(context)
+
+    def set(self, user_id, state_name, context):
+        with self._lock:
+            self._data[user_id] = (state_name, dict(context), time.monotonic() + self.ttl)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, item in self._data.items() if item[2] <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class RedisFSMStorage(BaseFSMStorage):
+    """Key-value хранилище с протоколом Redis (Redis, Valkey, KeyDB и т.п.).
+
+    Требует пакет ``redis``; истечение — средствами сервера (SET ... EX).
+    """
+
+    def __init__(self, ttl, url, prefix='communal_bot:fsm:'):
+        super().__init__(ttl)
+        try:
+            import redis
+        except ImportError as exc:
+            raise ImproperlyConfigured("FSM_BACKEND='redis' requires the 'redis' package") from exc
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id):
+        raw = self.client.get(self._key(user_id))
+        if raw is None:
+            return None, {}
+        data = json.loads(raw)
+        return data['state'], data['context']
+
+    def set(self, user_id, state_name, context):
+        payload = json.dumps({'state': state_name, 'context': context})
+        self.client.set(self._key(user_id), payload, ex=self.ttl)
+
+    def clear(self, user_id):
+        self.client.delete(self._key(user_id))
+
+
+FSM_BACKENDS = {
+    'django': lambda: DjangoFSMStorage(settings.FSM_TTL),
+    'memory': lambda: MemoryFSMStorage(settings.FSM_TTL, settings.FSM_MEMORY_MAXSIZE),
+    'redis': lambda: RedisFSMStorage(settings.FSM_TTL, settings.FSM_REDIS_URL),
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Хранилище, выбранное в settings.FSM_BACKEND: имя из FSM_BACKENDS или путь к классу."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = settings.FSM_BACKEND
+                if backend in FSM_BACKENDS:
+                    _storage = FSM_BACKENDS[backend]()
+                else:
+                    _storage = import_string(backend)(settings.FSM_TTL)
+    return _storage
+
+
+# =============== FSM ===============
 
 class FSM:
     @staticmethod
     def get_state(user):
-        try:
-            record = FSMState.objects.get(user=user)
-            return record.state_name, record.context
-        except FSMState.DoesNotExist:
-            return None, {}
+        return get_storage().get(user.pk)
 
     @staticmethod
     def set_state(user, state_name, context=None):
-        FSMState.objects.update_or_create(
-            user=user,
-            defaults={'state_name': state_name, 'context': context or {}}
-        )
+        get_storage().set(user.pk, state_name, context or {})
 
     @staticmethod
     def clear_state(user):
-        FSMState.objects.filter(user=user).delete()
\ No newline at end of file
+        get_storage().clear(user.pk)
+
+    # Асинхронные варианты для обработчиков бота: блокирующие хранилища — через пул БД
+    @staticmethod
+    async def aget_state(user):
+        storage = get_storage()
+        if storage.blocking:
+            return await run_in_db(storage.get, user.pk)
+        return storage.get(user.pk)
+
+    @staticmethod
+    async def aset_state(user, state_name, context=None):
+        storage = get_storage()
+        if storage.blocking:
+            await run_in_db(storage.set, user.pk, state_name, context or {})
+        else:
+            storage.set(user.pk, state_name, context or {})
+
+    @staticmethod
+    async def aclear_state(user):
+        storage = get_storage()
+        if storage.blocking:
+            await run_in_db(storage.clear, user.pk)
+        else:
+            storage.clear(user.pk)
+
+
+async def purge_expired_states_job(context):
+    # Брошенные диалоги удаляются по расписанию, а не копятся до ручного purge_fsm_states
+    storage = get_storage()
+    deleted = await run_in_db(storage.purge_expired) if storage.blocking else storage.purge_expired()
+    if deleted:
+        logger.info(f"Purged {deleted} expired dialog state(s)")
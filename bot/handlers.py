@@ -1,21 +1,44 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from .models import User, Utility, Tariff, MeterReading, Charge, Payment
+from .models import User, Utility, Tariff, MeterReading, Charge, MeterReadingArchive, ChargeArchive
 from .fsm import FSM
-from .logic import calculate_and_create_charge
+from .logic import acalculate_and_create_charge, acreate_payment, reading_source_key
+from .ledger import get_balance
+from .tariffs import get_tariff_table, latest_tariffs
+from .users import aget_or_create_user, aload_user_and_state, remember_user
+from .importer import import_readings, iter_file, parse_timestamp
+from .recalc import recalculate_charges
+from .billing import last_statement, period_report
+from .broadcast import REMINDER_TEXT, create_broadcast, run_broadcast
+from .export import export_ledger, find_utility, parse_export_args
+from .analytics import compute_stats
+from .catalog import get_utilities, utility_keyboard, aget_utilities, aget_utility, autility_keyboard
+from .db import db_call, run_in_db, fetch
+from .outbox import reply, reply_document, edit, answer
+from .router import CallbackRouter, StateRouter, pack, pack_prefix
 from django.conf import settings
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
+from datetime import datetime, timezone as dt_timezone
 from decimal import Decimal, InvalidOperation
 import logging
+import os
+import tempfile
 
 logger = logging.getLogger(__name__)
 
+# Размер страницы в списках участников (keyset-пагинация по User.id)
+USERS_PAGE_SIZE = 30
+
+# Выбор участника админом: вид списка -> префикс callback для выбранного участника
+USER_PICKERS = {
+    'read': ("Выберите пользователя:", "admin_read_user"),
+    'pay': ("Выберите пользователя для оплаты:", "admin_pay_user"),
+}
+
 
 async def _get_or_create_user(telegram_id):
-    user, _ = User.objects.get_or_create(
-        telegram_id=telegram_id,
-        defaults={'is_admin': telegram_id in settings.ADMIN_TELEGRAM_IDS}
-    )
-    return user
+    return await aget_or_create_user(telegram_id)
 
 
 # =============== ОСНОВНЫЕ КОМАНДЫ ПОЛЬЗОВАТЕЛЕЙ ===============
@@ -39,48 +62,64 @@ async def _get_or_create_user(telegram_id):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         logger.info(f"✅ START received from Telegram ID: {update.effective_user.id}")
-        user, created = User.objects.get_or_create(
+        user, created = await run_in_db(
+            User.objects.get_or_create,
             telegram_id=update.effective_user.id,
             defaults={'is_admin': update.effective_user.id in settings.ADMIN_TELEGRAM_IDS}
         )
+        remember_user(user)
         logger.info(f"✅ User {'created' if created else 'fetched'}: ID={user.telegram_id}, is_admin={user.is_admin}")
 
         msg = "Привет! Вы — администратор." if user.is_admin else "Привет! Вы — участник."
-        await update.message.reply_text(msg)
+        await reply(update.message, msg)
         logger.info("✅ Reply sent successfully")
 
     except Exception as e:
         logger.exception("🔥 START handler FAILED with exception:")
         try:
-            await update.message.reply_text("Ошибка при запуске.")
+            await reply(update.message, "Ошибка при запуске.")
         except:
             pass
 
 
 async def submit_reading(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
-    utilities = Utility.objects.all()
-    if not utilities.exists():
-        await update.message.reply_text("Услуги не настроены. Обратитесь к администратору.")
+    markup = await autility_keyboard(pack_prefix("util"))
+    if not markup:
+        await reply(update.message, "Услуги не настроены. Обратитесь к администратору.")
         return
-    buttons = [[InlineKeyboardButton(u.name, callback_data=f"util:{u.id}")] for u in utilities]
-    await update.message.reply_text("Выберите услугу:", reply_markup=InlineKeyboardMarkup(buttons))
-    FSM.set_state(user, "awaiting_utility_choice")
+    await reply(update.message, "Выберите услугу:", reply_markup=markup)
+    await FSM.aset_state(user, "awaiting_utility_choice")
 
 
 async def add_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
-    await update.message.reply_text("Введите сумму оплаты (только число, например: 1500.50):")
-    FSM.set_state(user, "awaiting_payment_amount")
+    await reply(update.message, "Введите сумму оплаты (только число, например: 1500.50):")
+    await FSM.aset_state(user, "awaiting_payment_amount")
 
 
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
-    total_charges = sum(c.amount for c in user.charge_set.all())
-    total_payments = sum(p.amount for p in user.payment_set.all())
-    balance = total_payments - total_charges
+    balance = await run_in_db(get_balance, user)
     sign = "Переплата" if balance > 0 else "Долг" if balance < 0 else "Баланс нулевой"
-    await update.message.reply_text(f"{sign}: {abs(balance):.2f} руб.")
+    await reply(update.message, f"{sign}: {abs(balance):.2f} руб.")
+
+
+async def statement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await _get_or_create_user(update.effective_user.id)
+    record = await run_in_db(last_statement, user)
+    if not record:
+        await reply(update.message, "Закрытых расчётных периодов пока нет.")
+        return
+    period = record.period
+    start = period.start.strftime('%Y-%m-%d') if period.start else "начала учёта"
+    await reply(update.message, 
+        f"🧾 Выписка за период с {start} по {period.end.strftime('%Y-%m-%d')}:\n\n"
+        f"Входящий баланс: {record.opening_balance:+.2f} руб.\n"
+        f"Начислено: {record.total_charges:.2f} руб.\n"
+        f"Оплачено: {record.total_payments:.2f} руб.\n"
+        f"Исходящий баланс: {record.closing_balance:+.2f} руб."
+    )
 
 
 # =============== АДМИН: УПРАВЛЕНИЕ УСЛУГАМИ И ТАРИФАМИ ===============
@@ -88,425 +127,722 @@ async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def add_utility(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Эта команда доступна только администратору.")
+        await reply(update.message, "Эта команда доступна только администратору.")
         return
-    await update.message.reply_text("Введите название услуги (например: «Электричество»):")
-    FSM.set_state(user, "admin_add_utility_name")
+    await reply(update.message, "Введите название услуги (например: «Электричество»):")
+    await FSM.aset_state(user, "admin_add_utility_name")
 
 
 async def set_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Эта команда доступна только администратору.")
+        await reply(update.message, "Эта команда доступна только администратору.")
         return
-    utilities = Utility.objects.all()
-    if not utilities.exists():
-        await update.message.reply_text("Нет услуг. Сначала добавьте через /add_utility.")
+    markup = await autility_keyboard(pack_prefix("tariff_util"))
+    if not markup:
+        await reply(update.message, "Нет услуг. Сначала добавьте через /add_utility.")
         return
-    buttons = [[InlineKeyboardButton(u.name, callback_data=f"tariff_util:{u.id}")] for u in utilities]
-    await update.message.reply_text("Выберите услугу:", reply_markup=InlineKeyboardMarkup(buttons))
-    FSM.set_state(user, "admin_awaiting_utility_for_tariff")
+    await reply(update.message, "Выберите услугу:", reply_markup=markup)
+    await FSM.aset_state(user, "admin_awaiting_utility_for_tariff")
 
 
 async def delete_utility(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    utilities = Utility.objects.all()
-    if not utilities:
-        await update.message.reply_text("Нет услуг для удаления.")
+    markup = await autility_keyboard(pack_prefix("del_util"))
+    if not markup:
+        await reply(update.message, "Нет услуг для удаления.")
         return
-    buttons = [[InlineKeyboardButton(u.name, callback_data=f"del_util:{u.id}")] for u in utilities]
-    await update.message.reply_text(
+    await reply(update.message, 
         "Выберите услугу для удаления.\n⚠️ Удаление невозможно, если есть показания или начисления.",
-        reply_markup=InlineKeyboardMarkup(buttons)
+        reply_markup=markup
     )
 
 
+@db_call
+def _tariffed_utilities_keyboard():
+    # Услуги, у которых есть тарифы, — по кэшам каталога и тарифов, без запросов
+    return utility_keyboard(pack_prefix("del_t_util"), set(get_tariff_table()))
+
+
 async def delete_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    utilities = Utility.objects.filter(tariff__isnull=False).distinct()
-    if not utilities:
-        await update.message.reply_text("Нет тарифов для удаления.")
+    markup = await _tariffed_utilities_keyboard()
+    if not markup:
+        await reply(update.message, "Нет тарифов для удаления.")
         return
-    buttons = [[InlineKeyboardButton(u.name, callback_data=f"del_t_util:{u.id}")] for u in utilities]
-    await update.message.reply_text("Выберите услугу:", reply_markup=InlineKeyboardMarkup(buttons))
+    await reply(update.message, "Выберите услугу:", reply_markup=markup)
 
 
 async def list_utilities(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    utilities = Utility.objects.all().order_by('name')
+    utilities = sorted(await aget_utilities(), key=lambda u: u.name)
     if not utilities:
-        await update.message.reply_text("Нет зарегистрированных услуг.")
+        await reply(update.message, "Нет зарегистрированных услуг.")
         return
     text = "📋 Список услуг:\n\n"
     for u in utilities:
         text += f"• {u.name} (единица: {u.unit}, ID: {u.id})\n"
-    await update.message.reply_text(text)
+    await reply(update.message, text)
+
+
+@db_call
+def _get_latest_tariffs():
+    latest = latest_tariffs()
+    return [(utility, latest.get(utility.id)) for utility in sorted(get_utilities(), key=lambda u: u.name)]
 
 
 async def list_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    utilities = Utility.objects.all().order_by('name')
-    if not utilities:
-        await update.message.reply_text("Нет услуг → тарифы отсутствуют.")
+    utility_tariffs = await _get_latest_tariffs()
+    if not utility_tariffs:
+        await reply(update.message, "Нет услуг → тарифы отсутствуют.")
         return
     text = "💰 Активные тарифы (последние):\n\n"
     any_tariff = False
-    for utility in utilities:
-        latest_tariff = Tariff.objects.filter(utility=utility).order_by('-valid_from').first()
+    for utility, latest_tariff in utility_tariffs:
         if latest_tariff:
             any_tariff = True
-            from_date = latest_tariff.valid_from.strftime('%Y-%m-%d %H:%M')
-            text += f"• {utility.name}: {latest_tariff.rate} руб./{utility.unit} (с {from_date})\n"
+            valid_from, rate = latest_tariff
+            from_date = valid_from.strftime('%Y-%m-%d %H:%M')
+            text += f"• {utility.name}: {rate} руб./{utility.unit} (с {from_date})\n"
         else:
             text += f"• {utility.name}: тариф не задан\n"
     if not any_tariff:
         text = "Ни для одной услуги тариф не установлен."
-    await update.message.reply_text(text)
+    await reply(update.message, text)
 
 
 # =============== АДМИН: ПРОСМОТР ДАННЫХ И ВВОД ОТ ИМЕНИ ===============
 
+@db_call
+def _get_users_page(after_id, exclude_telegram_id=None, with_summary=False):
+    # Одна страница участников после after_id; баланс считается в SQL по UserBalance
+    qs = User.objects.filter(id__gt=after_id).order_by('id')
+    if exclude_telegram_id is not None:
+        qs = qs.exclude(telegram_id=exclude_telegram_id)
+    qs = qs.annotate(balance_value=Coalesce(
+        F('balance__total_payments') - F('balance__total_charges'),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    ))
+    page = list(qs[:USERS_PAGE_SIZE + 1])
+    summary = None
+    if with_summary:
+        summary = User.objects.aggregate(
+            count=Count('id'),
+            charges=Sum('balance__total_charges'),
+            payments=Sum('balance__total_payments'),
+        )
+    return page[:USERS_PAGE_SIZE], len(page) > USERS_PAGE_SIZE, summary
+
+
+async def _render_users_page(after_id):
+    users, has_next, summary = await _get_users_page(after_id, with_summary=not after_id)
+    if not users:
+        return None, None
+    text = "👥 Участники:\n\n"
+    if summary:
+        total = (summary['payments'] or 0) - (summary['charges'] or 0)
+        text += f"Всего: {summary['count']} | Общий баланс: {total:+.2f} руб.\n\n"
+    for u in users:
+        status = "🟢" if u.balance_value >= 0 else "🔴"
+        text += f"{status} ID: {u.telegram_id} | Баланс: {u.balance_value:+.2f} руб.\n"
+    buttons = []
+    if after_id:
+        buttons.append(InlineKeyboardButton("⏮ В начало", callback_data=pack("users_page", 0)))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далее →", callback_data=pack("users_page", users[-1].id)))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def _render_user_picker(admin, kind, after_id):
+    title, prefix = USER_PICKERS[kind]
+    users, has_next, _ = await _get_users_page(after_id, exclude_telegram_id=admin.telegram_id)
+    if not users:
+        return None, None
+    buttons = [[InlineKeyboardButton(f"ID: {u.telegram_id}", callback_data=pack(prefix, u.telegram_id))] for u in users]
+    nav = []
+    if after_id:
+        nav.append(InlineKeyboardButton("⏮ В начало", callback_data=pack("users_pick", kind, 0)))
+    if has_next:
+        nav.append(InlineKeyboardButton("Далее →", callback_data=pack("users_pick", kind, users[-1].id)))
+    if nav:
+        buttons.append(nav)
+    return title, InlineKeyboardMarkup(buttons)
+
+
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    users = User.objects.prefetch_related('charge_set', 'payment_set').all()
-    if not users:
-        await update.message.reply_text("Нет зарегистрированных пользователей.")
+    text, markup = await _render_users_page(0)
+    if not text:
+        await reply(update.message, "Нет зарегистрированных пользователей.")
         return
-    text = "👥 Участники:\n\n"
-    for u in users:
-        total_charges = sum(c.amount for c in u.charge_set.all())
-        total_payments = sum(p.amount for p in u.payment_set.all())
-        balance = total_payments - total_charges
-        status = "🟢" if balance >= 0 else "🔴"
-        text += f"{status} ID: {u.telegram_id} | Баланс: {balance:+.2f} руб.\n"
-    await update.message.reply_text(text)
+    await reply(update.message, text, reply_markup=markup)
+
+
+@db_call
+def _get_user_report(target_id):
+    target_user = User.objects.get(telegram_id=target_id)
+    charges = list(target_user.charge_set.select_related('utility').order_by('-period_end')[:5])
+    payments = list(target_user.payment_set.order_by('-timestamp')[:5])
+    # Итоги по услугам вместе с архивом закрытых периодов — одним запросом (UNION ALL)
+    hot = target_user.charge_set.values('utility__name').annotate(total=Sum('amount'))
+    archived = target_user.chargearchive_set.values('utility__name').annotate(total=Sum('amount'))
+    totals = {}
+    for name, total in hot.values_list('utility__name', 'total').union(
+        archived.values_list('utility__name', 'total'), all=True
+    ):
+        totals[name] = totals.get(name, 0) + total
+    by_utility = [{'utility__name': name, 'total': totals[name]} for name in sorted(totals)]
+    return charges, payments, by_utility, get_balance(target_user)
 
 
 async def user_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
     if not context.args:
-        await update.message.reply_text("Укажите Telegram ID: /user_balance 123456789")
+        await reply(update.message, "Укажите Telegram ID: /user_balance 123456789")
         return
     try:
         target_id = int(context.args[0])
-        target_user = User.objects.get(telegram_id=target_id)
+        charges, payments, by_utility, balance = await _get_user_report(target_id)
     except (ValueError, User.DoesNotExist):
-        await update.message.reply_text("Пользователь не найден.")
+        await reply(update.message, "Пользователь не найден.")
         return
-    charges = target_user.charge_set.select_related('utility').order_by('-period_end')
-    payments = target_user.payment_set.order_by('-timestamp')
     text = f"📊 Баланс пользователя {target_id}:\n\n"
     text += "Начисления:\n"
-    for c in charges[:5]:
+    for c in charges:
         text += f"  • {c.utility.name}: {c.amount} руб. ({c.period_end.strftime('%Y-%m-%d')})\n"
     if not charges:
         text += "  — нет начислений\n"
     text += "\nОплаты:\n"
-    for p in payments[:5]:
+    for p in payments:
         text += f"  • {p.amount} руб. ({p.timestamp.strftime('%Y-%m-%d %H:%M')})\n"
     if not payments:
         text += "  — нет оплат\n"
-    total_charges = sum(c.amount for c in charges)
-    total_payments = sum(p.amount for p in payments)
-    balance = total_payments - total_charges
+    if by_utility:
+        text += "\nВсего начислено по услугам:\n"
+        for row in by_utility:
+            text += f"  • {row['utility__name']}: {row['total']:.2f} руб.\n"
     text += f"\nИтого: {balance:+.2f} руб."
-    await update.message.reply_text(text)
+    await reply(update.message, text)
+
+
+async def billing_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await _get_or_create_user(update.effective_user.id)
+    if not user.is_admin:
+        await reply(update.message, "Только для админа.")
+        return
+    period, totals = await run_in_db(period_report)
+    if not period:
+        await reply(update.message, "Закрытых расчётных периодов пока нет.")
+        return
+    start = period.start.strftime('%Y-%m-%d') if period.start else "начала учёта"
+    await reply(update.message, 
+        f"📅 Период с {start} по {period.end.strftime('%Y-%m-%d')}:\n\n"
+        f"Участников: {totals['users']}\n"
+        f"Начислено: {totals['charges'] or 0:.2f} руб.\n"
+        f"Оплачено: {totals['payments'] or 0:.2f} руб.\n"
+        f"Общий баланс на конец периода: {totals['closing'] or 0:+.2f} руб."
+    )
 
 
 async def admin_submit_reading(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    users = User.objects.exclude(telegram_id=user.telegram_id)
-    if not users:
-        await update.message.reply_text("Нет других участников.")
+    title, markup = await _render_user_picker(user, 'read', 0)
+    if not title:
+        await reply(update.message, "Нет других участников.")
         return
-    buttons = [[InlineKeyboardButton(f"ID: {u.telegram_id}", callback_data=f"admin_read_user:{u.telegram_id}")] for u in users]
-    await update.message.reply_text("Выберите пользователя:", reply_markup=InlineKeyboardMarkup(buttons))
-    FSM.set_state(user, "admin_choosing_user_for_reading")
+    await reply(update.message, title, reply_markup=markup)
+    await FSM.aset_state(user, "admin_choosing_user_for_reading")
 
 
 async def admin_add_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await _get_or_create_user(update.effective_user.id)
     if not user.is_admin:
-        await update.message.reply_text("Только для админа.")
+        await reply(update.message, "Только для админа.")
         return
-    users = User.objects.exclude(telegram_id=user.telegram_id)
-    if not users:
-        await update.message.reply_text("Нет других участников.")
+    title, markup = await _render_user_picker(user, 'pay', 0)
+    if not title:
+        await reply(update.message, "Нет других участников.")
         return
-    buttons = [[InlineKeyboardButton(f"ID: {u.telegram_id}", callback_data=f"admin_pay_user:{u.telegram_id}")] for u in users]
-    await update.message.reply_text("Выберите пользователя для оплаты:", reply_markup=InlineKeyboardMarkup(buttons))
-    FSM.set_state(user, "admin_choosing_user_for_payment")
+    await reply(update.message, title, reply_markup=markup)
+    await FSM.aset_state(user, "admin_choosing_user_for_payment")
 
 
-# =============== ОБРАБОТКА CALLBACK-ЗАПРОСОВ ===============
+# =============== АДМИН: РАССЫЛКИ ===============
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+async def _start_broadcast(update, context, text):
     user = await _get_or_create_user(update.effective_user.id)
+    if not user.is_admin:
+        await reply(update.message, "Только для админа.")
+        return
+    broadcast = await run_in_db(create_broadcast, text, user)
+    # Рассылка идёт в фоне: обработчик сразу освобождается
+    context.application.create_task(
+        run_broadcast(context.bot, broadcast.id), name=f"broadcast-{broadcast.id}"
+    )
+    await reply(update.message, f"📣 Рассылка #{broadcast.id} запущена. По завершении пришлю отчёт.")
 
-    # Удаление услуги
-    if query.data.startswith("del_util:"):
-        if not user.is_admin:
-            await query.edit_message_text("Недоступно.")
-            return
-        utility_id = int(query.data.split(":")[1])
-        try:
-            utility = Utility.objects.get(id=utility_id)
-            if MeterReading.objects.filter(utility=utility).exists() or Charge.objects.filter(utility=utility).exists():
-                await query.edit_message_text(f"❌ Невозможно удалить «{utility.name}»: есть привязанные данные.")
-            else:
-                utility.delete()
-                await query.edit_message_text(f"✅ Услуга «{utility.name}» удалена.")
-        except Utility.DoesNotExist:
-            await query.edit_message_text("Услуга не найдена.")
-        return
-
-    # Удаление тарифа: выбор услуги
-    if query.data.startswith("del_t_util:"):
-        if not user.is_admin:
-            await query.edit_message_text("Недоступно.")
-            return
-        utility_id = int(query.data.split(":")[1])
-        try:
-            utility = Utility.objects.get(id=utility_id)
-            tariffs = Tariff.objects.filter(utility=utility).order_by('-valid_from')
-            if not tariffs:
-                await query.edit_message_text(f"У услуги «{utility.name}» нет тарифов.")
-                return
-            buttons = []
-            for t in tariffs:
-                label = f"{t.rate} руб. (с {t.valid_from.strftime('%Y-%m-%d')})"
-                buttons.append([InlineKeyboardButton(label, callback_data=f"del_t:{t.id}")])
-            buttons.append([InlineKeyboardButton("← Назад", callback_data="back_to_del_tariff_util")])
-            await query.edit_message_text(
-                f"Выберите тариф для удаления из «{utility.name}»:",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            FSM.set_state(user, "admin_deleting_tariff", {"utility_id": utility_id})
-        except Utility.DoesNotExist:
-            await query.edit_message_text("Услуга не найдена.")
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await reply(update.message, "Использование: /broadcast <текст сообщения>")
         return
+    await _start_broadcast(update, context, text)
 
-    # Удаление тарифа: выбор конкретного
-    if query.data.startswith("del_t:"):
-        if not user.is_admin:
-            await query.edit_message_text("Недоступно.")
-            return
-        tariff_id = int(query.data.split(":")[1])
-        try:
-            tariff = Tariff.objects.select_related('utility').get(id=tariff_id)
-            utility = tariff.utility
-            remaining_count = Tariff.objects.filter(utility=utility).count()
-            warning = "\n\n⚠️ Это последний тариф для услуги!" if remaining_count == 1 else ""
-            tariff.delete()
-            await query.edit_message_text(
-                f"✅ Тариф {tariff.rate} руб./{utility.unit} (с {tariff.valid_from.strftime('%Y-%m-%d')}) удалён.{warning}"
-            )
-        except Tariff.DoesNotExist:
-            await query.edit_message_text("Тариф не найден.")
+
+async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.partition(' ')[2].strip()
+    await _start_broadcast(update, context, text or REMINDER_TEXT)
+
+
+# =============== АДМИН: АНАЛИТИКА ПОТРЕБЛЕНИЯ ===============
+
+# Ограничение Telegram на длину сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+def _get_stats(args):
+    utility_id = find_utility(" ".join(args)).id if args else None
+    return compute_stats(utility_id)
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await _get_or_create_user(update.effective_user.id)
+    if not user.is_admin:
+        await reply(update.message, "Только для админа.")
+        return
+    try:
+        results = await run_in_db(_get_stats, context.args)
+    except ValueError as e:
+        await reply(update.message, f"Ошибка: {e}")
         return
+    if not results:
+        await reply(update.message, "Недостаточно показаний для статистики.")
+        return
+    text = "\n\n".join(s.summary() for s in results)
+    if len(text) > MAX_MESSAGE_LENGTH:
+        text = text[:MAX_MESSAGE_LENGTH - 1] + "…"
+    await reply(update.message, text)
 
-    # Назад к выбору услуги при удалении тарифа
-    if query.data == "back_to_del_tariff_util":
-        if not user.is_admin:
-            await query.edit_message_text("Недоступно.")
-            return
-        utilities = Utility.objects.filter(tariff__isnull=False).distinct()
-        if not utilities:
-            await query.edit_message_text("Нет тарифов для удаления.")
-            return
-        buttons = [[InlineKeyboardButton(u.name, callback_data=f"del_t_util:{u.id}")] for u in utilities]
-        await query.edit_message_text("Выберите услугу:", reply_markup=InlineKeyboardMarkup(buttons))
-        FSM.clear_state(user)
+
+# =============== АДМИН: ВЫГРУЗКА ДАННЫХ ===============
+
+EXPORT_USAGE = (
+    "Использование: /export charges|payments|readings|archived_charges|archived_readings [csv|jsonl] "
+    "[from=2025-01-01] [to=2025-02-01] [utility=ID или название] [user=TELEGRAM_ID]"
+)
+# Ограничение Telegram на размер документа от бота
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+
+def _export_to_file(path, args):
+    options = parse_export_args(args)
+    return export_ledger(path, **options)
+
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await _get_or_create_user(update.effective_user.id)
+    if not user.is_admin:
+        await reply(update.message, "Только для админа.")
+        return
+    if not context.args:
+        await reply(update.message, EXPORT_USAGE)
         return
+    await reply(update.message, "Готовлю выгрузку…")
+    fd, path = tempfile.mkstemp(suffix=".gz")
+    os.close(fd)
+    try:
+        report = await run_in_db(_export_to_file, path, context.args)
+        if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await reply(
+                update.message,
+                "Файл больше 50 МБ. Сузьте фильтры (from=, to=, utility=, user=) "
+                "или выгрузите на сервере: python manage.py export_ledger"
+            )
+            return
+        filename = f"{report.kind}-{update.message.date:%Y%m%d-%H%M}.{report.format}.gz"
+        # Через очередь исходящих, как и остальные ответы: порядок в чате и пауза после RetryAfter.
+        # Файл читается в память (не больше MAX_DOCUMENT_SIZE) и удаляется до отправки
+        with open(path, 'rb') as f:
+            content = f.read()
+        await reply_document(update.message, content, filename=filename, caption=report.summary())
+    except ValueError as e:
+        await reply(update.message, f"Ошибка выгрузки: {e}\n\n{EXPORT_USAGE}")
+    except Exception:
+        logger.exception("Ошибка при выгрузке данных")
+        await reply(update.message, "Ошибка выгрузки. Подробности в логах.")
+    finally:
+        os.remove(path)
+
+
+# =============== ОБРАБОТКА CALLBACK-ЗАПРОСОВ ===============
+
+@db_call
+def _delete_utility(utility_id):
+    utility = Utility.objects.get(id=utility_id)
+    for model in (MeterReading, Charge, MeterReadingArchive, ChargeArchive):
+        if model.objects.filter(utility=utility).exists():
+            return utility, False
+    utility.delete()
+    return utility, True
+
+
+@db_call
+def _delete_tariff(tariff_id):
+    tariff = Tariff.objects.select_related('utility').get(id=tariff_id)
+    remaining_count = Tariff.objects.filter(utility=tariff.utility).count()
+    tariff.delete()
+    return tariff, remaining_count
+
 
-    # Выбор услуги для тарифа (установка)
-    if query.data.startswith("tariff_util:"):
-        if not user.is_admin:
-            await query.edit_message_text("Недоступно.")
+def _recalc_markup(utility_id, since):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(
+        "🔄 Пересчитать начисления", callback_data=pack("recalc", utility_id, int(since.timestamp()))
+    )]])
+
+
+callbacks = CallbackRouter()
+states = StateRouter()
+
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await answer(query)
+    user = await _get_or_create_user(update.effective_user.id)
+    await callbacks.dispatch(query, user, edit)
+
+
+# Удаление услуги
+@callbacks.route("del_util", int, admin=True, deny="Недоступно.")
+async def _on_delete_utility(query, user, utility_id):
+    try:
+        utility, deleted = await _delete_utility(utility_id)
+        if not deleted:
+            await edit(query, f"❌ Невозможно удалить «{utility.name}»: есть привязанные данные.")
+        else:
+            await edit(query, f"✅ Услуга «{utility.name}» удалена.")
+    except Utility.DoesNotExist:
+        await edit(query, "Услуга не найдена.")
+
+
+# Удаление тарифа: выбор услуги
+@callbacks.route("del_t_util", int, admin=True, deny="Недоступно.")
+async def _on_delete_tariff_utility(query, user, utility_id):
+    try:
+        utility = await aget_utility(utility_id)
+        tariffs = await fetch(Tariff.objects.filter(utility=utility).order_by('-valid_from'))
+        if not tariffs:
+            await edit(query, f"У услуги «{utility.name}» нет тарифов.")
             return
-        utility_id = int(query.data.split(":")[1])
-        FSM.set_state(user, "admin_awaiting_tariff_value", {"utility_id": utility_id})
-        await query.edit_message_text("Введите тариф (руб. за единицу, например: 6.50):")
+        buttons = []
+        for t in tariffs:
+            label = f"{t.rate} руб. (с {t.valid_from.strftime('%Y-%m-%d')})"
+            buttons.append([InlineKeyboardButton(label, callback_data=pack("del_t", t.id))])
+        buttons.append([InlineKeyboardButton("← Назад", callback_data=pack("back_to_del_tariff_util"))])
+        await edit(query, 
+            f"Выберите тариф для удаления из «{utility.name}»:",
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
+        await FSM.aset_state(user, "admin_deleting_tariff", {"utility_id": utility_id})
+    except Utility.DoesNotExist:
+        await edit(query, "Услуга не найдена.")
+
+
+# Удаление тарифа: выбор конкретного
+@callbacks.route("del_t", int, admin=True, deny="Недоступно.")
+async def _on_delete_tariff(query, user, tariff_id):
+    try:
+        tariff, remaining_count = await _delete_tariff(tariff_id)
+        utility = tariff.utility
+        warning = "\n\n⚠️ Это последний тариф для услуги!" if remaining_count == 1 else ""
+        await edit(query, 
+            f"✅ Тариф {tariff.rate} руб./{utility.unit} (с {tariff.valid_from.strftime('%Y-%m-%d')}) удалён.{warning}",
+            reply_markup=_recalc_markup(utility.id, tariff.valid_from)
+        )
+    except Tariff.DoesNotExist:
+        await edit(query, "Тариф не найден.")
+
+
+# Пересчёт начислений после изменения тарифов задним числом
+@callbacks.route("recalc", int, int, admin=True, deny="Недоступно.")
+async def _on_recalc(query, user, utility_id, since):
+    try:
+        utility = await aget_utility(utility_id)
+    except Utility.DoesNotExist:
+        await edit(query, "Услуга не найдена.")
         return
+    await edit(query, f"Пересчитываю начисления «{utility.name}»…")
+    report = await run_in_db(
+        recalculate_charges, utility, since=datetime.fromtimestamp(since, tz=dt_timezone.utc)
+    )
+    await edit(query, report.summary())
 
-    # Выбор пользователя для ввода показаний
-    if query.data.startswith("admin_read_user:"):
-        if not user.is_admin:
-            return
-        target_id = int(query.data.split(":")[1])
-        utilities = Utility.objects.all()
-        if not utilities:
-            await query.edit_message_text("Нет услуг.")
-            return
-        buttons = [[InlineKeyboardButton(u.name, callback_data=f"admin_read_util:{target_id}:{u.id}")] for u in utilities]
-        await query.edit_message_text("Выберите услугу:", reply_markup=InlineKeyboardMarkup(buttons))
+
+# Список участников: следующая страница
+@callbacks.route("users_page", int, admin=True, deny="Недоступно.")
+async def _on_users_page(query, user, after_id):
+    text, markup = await _render_users_page(after_id)
+    if not text:
+        await edit(query, "Больше участников нет.")
         return
+    await edit(query, text, reply_markup=markup)
 
-    # Выбор услуги для показаний (админ от имени)
-    if query.data.startswith("admin_read_util:"):
-        if not user.is_admin:
-            return
-        _, target_id, util_id = query.data.split(":")
-        target_id, util_id = int(target_id), int(util_id)
-        FSM.set_state(user, "admin_awaiting_reading_value", {"target_user_id": target_id, "utility_id": util_id})
-        await query.edit_message_text("Введите показания (число):")
+
+# Выбор участника админом: следующая страница
+@callbacks.route("users_pick", str, int, admin=True)
+async def _on_users_pick(query, user, kind, after_id):
+    if kind not in USER_PICKERS:
+        return
+    title, markup = await _render_user_picker(user, kind, after_id)
+    if not title:
+        await edit(query, "Больше участников нет.")
         return
+    await edit(query, title, reply_markup=markup)
 
-    # Выбор пользователя для оплаты (админ от имени)
-    if query.data.startswith("admin_pay_user:"):
-        if not user.is_admin:
-            return
-        target_id = int(query.data.split(":")[1])
-        FSM.set_state(user, "admin_awaiting_payment_value", {"target_user_id": target_id})
-        await query.edit_message_text("Введите сумму оплаты (число):")
+
+# Назад к выбору услуги при удалении тарифа
+@callbacks.route("back_to_del_tariff_util", admin=True, deny="Недоступно.")
+async def _on_back_to_delete_tariff(query, user):
+    markup = await _tariffed_utilities_keyboard()
+    if not markup:
+        await edit(query, "Нет тарифов для удаления.")
         return
+    await edit(query, "Выберите услугу:", reply_markup=markup)
+    await FSM.aclear_state(user)
+
 
-    # Выбор услуги для показаний (обычный пользователь)
-    if query.data.startswith("util:"):
-        utility_id = int(query.data.split(":")[1])
-        FSM.set_state(user, "awaiting_reading_value", {"utility_id": utility_id})
-        await query.edit_message_text("Введите показания (только число):")
+# Выбор услуги для тарифа (установка)
+@callbacks.route("tariff_util", int, admin=True, deny="Недоступно.")
+async def _on_tariff_utility(query, user, utility_id):
+    await FSM.aset_state(user, "admin_awaiting_tariff_value", {"utility_id": utility_id})
+    await edit(query, 
+        "Введите тариф (руб. за единицу, например: 6.50).\n"
+        "Для тарифа задним числом добавьте дату начала: 6.50 2025-01-01"
+    )
+
+
+# Выбор пользователя для ввода показаний
+@callbacks.route("admin_read_user", int, admin=True)
+async def _on_admin_read_user(query, user, target_id):
+    markup = await autility_keyboard(pack_prefix("admin_read_util", target_id))
+    if not markup:
+        await edit(query, "Нет услуг.")
         return
+    await edit(query, "Выберите услугу:", reply_markup=markup)
+
+
+# Выбор услуги для показаний (админ от имени)
+@callbacks.route("admin_read_util", int, int, admin=True)
+async def _on_admin_read_utility(query, user, target_id, util_id):
+    await FSM.aset_state(user, "admin_awaiting_reading_value", {"target_user_id": target_id, "utility_id": util_id})
+    await edit(query, "Введите показания (число):")
+
+
+# Выбор пользователя для оплаты (админ от имени)
+@callbacks.route("admin_pay_user", int, admin=True)
+async def _on_admin_pay_user(query, user, target_id):
+    await FSM.aset_state(user, "admin_awaiting_payment_value", {"target_user_id": target_id})
+    await edit(query, "Введите сумму оплаты (число):")
+
+
+# Выбор услуги для показаний (обычный пользователь)
+@callbacks.route("util", int)
+async def _on_utility(query, user, utility_id):
+    await FSM.aset_state(user, "awaiting_reading_value", {"utility_id": utility_id})
+    await edit(query, "Введите показания (только число):")
 
 
 # =============== ОБРАБОТКА ТЕКСТОВЫХ СООБЩЕНИЙ (FSM) ===============
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = await _get_or_create_user(update.effective_user.id)
-    state, ctx = FSM.get_state(user)
+    user, (state, ctx) = await aload_user_and_state(update.effective_user.id)
+    route = states.resolve(state)
+    if route is None:
+        # === НЕИЗВЕСТНОЕ СОСТОЯНИЕ ===
+        base_msg = (
+            "Используйте команды:\n"
+            "/submit_reading — ввести показания\n"
+            "/add_payment — внести оплату\n"
+            "/balance — узнать баланс"
+        )
+        if user.is_admin:
+            base_msg += "\n\nДля админа: /add_utility, /list_users и др."
+        await reply(update.message, base_msg)
+        return
+    if route.admin and not user.is_admin:
+        await FSM.aclear_state(user)
+        return
+    await route.callback(update, user, ctx)
 
-    # === АДМИН: добавление услуги ===
-    if state == "admin_add_utility_name":
-        name = update.message.text.strip()
-        if not name:
-            await update.message.reply_text("Название не может быть пустым. Попробуйте снова:")
-            return
-        if Utility.objects.filter(name=name).exists():
-            await update.message.reply_text(f"Услуга «{name}» уже существует.")
-        else:
-            utility = Utility.objects.create(name=name, unit="ед.")
-            await update.message.reply_text(f"Услуга «{utility.name}» добавлена.")
-        FSM.clear_state(user)
+
+# === АДМИН: добавление услуги ===
+@states.state("admin_add_utility_name")
+async def _on_utility_name(update, user, ctx):
+    name = update.message.text.strip()
+    if not name:
+        await reply(update.message, "Название не может быть пустым. Попробуйте снова:")
         return
+    utility, created = await run_in_db(Utility.objects.get_or_create, name=name, defaults={'unit': "ед."})
+    if not created:
+        await reply(update.message, f"Услуга «{name}» уже существует.")
+    else:
+        await reply(update.message, f"Услуга «{utility.name}» добавлена.")
+    await FSM.aclear_state(user)
 
-    # === АДМИН: ввод тарифа ===
-    if state == "admin_awaiting_tariff_value":
-        try:
-            rate = Decimal(update.message.text.replace(',', '.'))
-            if rate <= 0:
-                raise ValueError()
-            utility_id = ctx.get("utility_id")
-            utility = Utility.objects.get(id=utility_id)
-            Tariff.objects.create(utility=utility, rate=rate, valid_from=update.message.date)
-            await update.message.reply_text(f"Тариф для «{utility.name}» установлен: {rate} руб./{utility.unit}")
-            FSM.clear_state(user)
-            return
-        except (InvalidOperation, ValueError, Utility.DoesNotExist):
-            await update.message.reply_text("Некорректное значение. Введите положительное число (например: 7.50):")
-            return
 
-    # === АДМИН: ввод показаний от имени ===
-    if state == "admin_awaiting_reading_value":
-        if not user.is_admin:
-            FSM.clear_state(user)
-            return
-        try:
-            value = Decimal(update.message.text.replace(',', '.'))
-            if value < 0:
-                raise ValueError()
-            target_user = User.objects.get(telegram_id=ctx["target_user_id"])
-            utility = Utility.objects.get(id=ctx["utility_id"])
-            success = calculate_and_create_charge(target_user, utility, value, update.message.date)
-            if success:
-                msg = f"✅ Показания за {target_user.telegram_id} приняты. Начисление создано."
-            else:
-                msg = f"✅ Показания за {target_user.telegram_id} сохранены."
-            await update.message.reply_text(msg)
-            FSM.clear_state(user)
-        except Exception as e:
-            logger.exception("Ошибка при вводе показаний админом")
-            await update.message.reply_text("Ошибка. Убедитесь, что услуга и пользователь существуют.")
-            FSM.clear_state(user)
-        return
-
-    # === АДМИН: ввод оплаты от имени ===
-    if state == "admin_awaiting_payment_value":
-        if not user.is_admin:
-            FSM.clear_state(user)
-            return
-        try:
-            amount = Decimal(update.message.text.replace(',', '.'))
-            if amount <= 0:
-                raise ValueError()
-            target_user = User.objects.get(telegram_id=ctx["target_user_id"])
-            Payment.objects.create(user=target_user, amount=amount, timestamp=update.message.date)
-            await update.message.reply_text(f"✅ Оплата {amount} руб. учтена за пользователя {target_user.telegram_id}.")
-            FSM.clear_state(user)
-        except Exception as e:
-            await update.message.reply_text("Ошибка. Сумма должна быть > 0.")
-            FSM.clear_state(user)
-        return
-
-    # === ОБЫЧНЫЙ ПОЛЬЗОВАТЕЛЬ: ввод показаний ===
-    if state == "awaiting_reading_value":
-        try:
-            value = Decimal(update.message.text.replace(',', '.'))
-            if value < 0:
-                raise ValueError()
-            utility = Utility.objects.get(id=ctx["utility_id"])
-            success = calculate_and_create_charge(user, utility, value, update.message.date)
-            if success:
-                await update.message.reply_text(f"Начисление создано.")
-            else:
-                await update.message.reply_text("Показания приняты, но начисление не требуется.")
-            FSM.clear_state(user)
-        except Exception as e:
-            await update.message.reply_text("Некорректное значение. Попробуйте снова (только число ≥ 0):")
-        return
-
-    # === ОБЫЧНЫЙ ПОЛЬЗОВАТЕЛЬ: ввод оплаты ===
-    if state == "awaiting_payment_amount":
-        try:
-            amount = Decimal(update.message.text.replace(',', '.'))
-            if amount <= 0:
-                raise ValueError()
-            Payment.objects.create(user=user, amount=amount, timestamp=update.message.date)
-            await update.message.reply_text(f"Оплата на {amount} руб. учтена.")
-            FSM.clear_state(user)
-        except (InvalidOperation, ValueError):
-            await update.message.reply_text("Введите корректную сумму (> 0):")
-        return
-
-    # === НЕИЗВЕСТНОЕ СОСТОЯНИЕ ===
-    base_msg = (
-        "Используйте команды:\n"
-        "/submit_reading — ввести показания\n"
-        "/add_payment — внести оплату\n"
-        "/balance — узнать баланс"
-    )
-    if user.is_admin:
-        base_msg += "\n\nДля админа: /add_utility, /list_users и др."
-    await update.message.reply_text(base_msg)
\ No newline at end of file
+# === АДМИН: ввод тарифа ===
+@states.state("admin_awaiting_tariff_value")
+async def _on_tariff_value(update, user, ctx):
+    try:
+        parts = update.message.text.split()
+        if not 1 <= len(parts) <= 2:
+            raise ValueError()
+        rate = Decimal(parts[0].replace(',', '.'))
+        if rate <= 0:
+            raise ValueError()
+        valid_from = parse_timestamp(parts[1]) if len(parts) == 2 else update.message.date
+        retroactive = valid_from < update.message.date
+        utility_id = ctx.get("utility_id")
+        utility = await aget_utility(utility_id)
+        await run_in_db(Tariff.objects.create, utility=utility, rate=rate, valid_from=valid_from)
+        text = f"Тариф для «{utility.name}» установлен: {rate} руб./{utility.unit}"
+        markup = None
+        if retroactive:
+            text += f" (с {valid_from.strftime('%Y-%m-%d')})"
+            markup = _recalc_markup(utility.id, valid_from)
+        await reply(update.message, text, reply_markup=markup)
+        await FSM.aclear_state(user)
+    except (InvalidOperation, ValueError, Utility.DoesNotExist):
+        await reply(update.message, "Некорректное значение. Введите положительное число (например: 7.50):")
+
+
+# === АДМИН: ввод показаний от имени ===
+@states.state("admin_awaiting_reading_value", admin=True)
+async def _on_admin_reading_value(update, user, ctx):
+    try:
+        value = Decimal(update.message.text.replace(',', '.'))
+        if value < 0:
+            raise ValueError()
+        target_user = await run_in_db(User.objects.get, telegram_id=ctx["target_user_id"])
+        utility = await aget_utility(ctx["utility_id"])
+        success = await acalculate_and_create_charge(
+            target_user, utility, value, update.message.date, reading_source_key(update.message)
+        )
+        if success:
+            msg = f"✅ Показания за {target_user.telegram_id} приняты. Начисление создано."
+        else:
+            msg = f"✅ Показания за {target_user.telegram_id} сохранены."
+        await reply(update.message, msg)
+        await FSM.aclear_state(user)
+    except Exception as e:
+        logger.exception("Ошибка при вводе показаний админом")
+        await reply(update.message, "Ошибка. Убедитесь, что услуга и пользователь существуют.")
+        await FSM.aclear_state(user)
+
+
+# === АДМИН: ввод оплаты от имени ===
+@states.state("admin_awaiting_payment_value", admin=True)
+async def _on_admin_payment_value(update, user, ctx):
+    try:
+        amount = Decimal(update.message.text.replace(',', '.'))
+        if amount <= 0:
+            raise ValueError()
+        target_user = await run_in_db(User.objects.get, telegram_id=ctx["target_user_id"])
+        await acreate_payment(target_user, amount, update.message.date)
+        await reply(update.message, f"✅ Оплата {amount} руб. учтена за пользователя {target_user.telegram_id}.")
+        await FSM.aclear_state(user)
+    except Exception as e:
+        await reply(update.message, "Ошибка. Сумма должна быть > 0.")
+        await FSM.aclear_state(user)
+
+
+# === ОБЫЧНЫЙ ПОЛЬЗОВАТЕЛЬ: ввод показаний ===
+@states.state("awaiting_reading_value")
+async def _on_reading_value(update, user, ctx):
+    try:
+        value = Decimal(update.message.text.replace(',', '.'))
+        if value < 0:
+            raise ValueError()
+        utility = await aget_utility(ctx["utility_id"])
+        success = await acalculate_and_create_charge(
+            user, utility, value, update.message.date, reading_source_key(update.message)
+        )
+        if success:
+            await reply(update.message, f"Начисление создано.")
+        else:
+            await reply(update.message, "Показания приняты, но начисление не требуется.")
+        await FSM.aclear_state(user)
+    except Exception as e:
+        await reply(update.message, "Некорректное значение. Попробуйте снова (только число ≥ 0):")
+
+
+# === ОБЫЧНЫЙ ПОЛЬЗОВАТЕЛЬ: ввод оплаты ===
+@states.state("awaiting_payment_amount")
+async def _on_payment_amount(update, user, ctx):
+    try:
+        amount = Decimal(update.message.text.replace(',', '.'))
+        if amount <= 0:
+            raise ValueError()
+        await acreate_payment(user, amount, update.message.date)
+        await reply(update.message, f"Оплата на {amount} руб. учтена.")
+        await FSM.aclear_state(user)
+    except (InvalidOperation, ValueError):
+        await reply(update.message, "Введите корректную сумму (> 0):")
+
+
+# =============== АДМИН: ИМПОРТ ПОКАЗАНИЙ ИЗ ФАЙЛА ===============
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await _get_or_create_user(update.effective_user.id)
+    if not user.is_admin:
+        await reply(update.message, "Загрузка файлов доступна только администратору.")
+        return
+    document = update.message.document
+    extension = (document.file_name or '').rsplit('.', 1)[-1].lower()
+    if extension not in ('csv', 'xlsx'):
+        await reply(update.message, 
+            "Пришлите ведомость .csv или .xlsx с колонками telegram_id, utility, value, timestamp.\n"
+            "Подпись «проверка» — только проверить файл без записи."
+        )
+        return
+    dry_run = (update.message.caption or '').strip().lower() in ('проверка', 'dry-run', 'dry_run')
+    await reply(update.message, "Файл получен, импортирую…")
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(fd)
+    try:
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_drive(path)
+        report = await run_in_db(lambda: import_readings(iter_file(path, extension), dry_run=dry_run))
+    except ValueError as e:
+        await reply(update.message, f"Ошибка импорта: {e}")
+        return
+    except Exception:
+        logger.exception("Ошибка при импорте показаний")
+        await reply(update.message, "Ошибка импорта. Подробности в логах.")
+        return
+    finally:
+        os.remove(path)
+    await reply(update.message, report.summary())
\ No newline at end of file
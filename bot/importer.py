@@ -0,0 +1,331 @@
+# bot/importer.py
+# Массовый импорт показаний из CSV/XLSX-ведомостей.
+# Строки читаются потоком и обрабатываются пачками: пользователи и последние
+# показания загружаются одним запросом на пачку, тарифы берутся из кэша
+# (bot/tariffs.py), а MeterReading/Charge создаются через bulk_create
+# в отдельной транзакции на каждую пачку. Пользователи пачки блокируются
+# в этой транзакции до чтения последних показаний.
+import csv
+import io
+import time
+from datetime import datetime, date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from .billing import closed_until
+from .catalog import get_utilities
+from .ledger import add_charges_to_balances
+from .models import User, MeterReading, Charge
+from .tariffs import price_consumption
+
+COLUMNS = ('telegram_id', 'utility', 'value', 'timestamp')
+MAX_REPORTED_ERRORS = 50
+
+
+class ImportReport:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.readings = 0
+        self.charges = 0
+        self.amount = Decimal('0')
+        self.errors = []
+        self.error_count = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        mode = " (проверка, без записи)" if self.dry_run else ""
+        text = (
+            f"Импорт показаний{mode}:\n"
+            f"Строк: {self.rows}, показаний: {self.readings}, начислений: {self.charges} "
+            f"на {self.amount:.2f} руб.\n"
+            f"Ошибок: {self.error_count}\n"
+            f"Время: {self.elapsed:.2f} с ({self.rows_per_second:.0f} строк/с)"
+        )
+        for line, message in self.errors:
+            text += f"\n  • строка {line}: {message}"
+        if self.error_count > len(self.errors):
+            text += f"\n  … и ещё {self.error_count - len(self.errors)}"
+        return text
+
+
+# =============== ЧТЕНИЕ ФАЙЛОВ ===============
+
+def _normalize_header(header):
+    columns = [str(h or '').strip().lower() for h in header]
+    missing = [c for c in COLUMNS if c not in columns]
+    if missing:
+        raise ValueError(f"Нет обязательных колонок: {', '.join(missing)}")
+    return columns
+
+
+def iter_csv(stream):
+    """Строки CSV как (номер строки, dict). Разделитель определяется автоматически."""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.StringIO(stream.decode('utf-8-sig'))
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(stream, dialect)
+    columns = _normalize_header(next(reader, []))
+    for line, row in enumerate(reader, start=2):
+        if any(cell.strip() for cell in row):
+            yield line, dict(zip(columns, row))
+
+
+def iter_xlsx(path):
+    """Строки первого листа XLSX как (номер строки, dict). Требует пакет openpyxl."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError as exc:
+        raise ValueError("Для импорта XLSX нужен пакет openpyxl") from exc
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = _normalize_header(next(rows, []))
+        for line, row in enumerate(rows, start=2):
+            if any(cell not in (None, '') for cell in row):
+                yield line, dict(zip(columns, row))
+    finally:
+        workbook.close()
+
+
+def iter_file(path, fmt=None):
+    fmt = (fmt or str(path).rsplit('.', 1)[-1]).lower()
+    if fmt == 'xlsx':
+        yield from iter_xlsx(path)
+    elif fmt == 'csv':
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            yield from iter_csv(stream)
+    else:
+        raise ValueError(f"Неподдерживаемый формат: {fmt} (нужен csv или xlsx)")
+
+
+# =============== РАЗБОР СТРОК ===============
+
+def parse_timestamp(raw):
+    """Дата/время из ячейки: datetime, date, ISO-строка или ДД.ММ.ГГГГ (в текущем часовом поясе)."""
+    if isinstance(raw, datetime):
+        value = raw
+    elif isinstance(raw, date):
+        value = datetime(raw.year, raw.month, raw.day)
+    else:
+        raw = str(raw or '').strip()
+        value = parse_datetime(raw)
+        if value is None:
+            day = parse_date(raw)
+            if day is None:
+                try:
+                    day = datetime.strptime(raw, '%d.%m.%Y').date()
+                except ValueError:
+                    raise ValueError(f"некорректная дата «{raw}»")
+            value = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def _fits(value, model, field_name):
+    """Помещается ли конечное Decimal в DecimalField модели без округления."""
+    field = model._meta.get_field(field_name)
+    try:
+        exact = value.quantize(Decimal(1).scaleb(-field.decimal_places)) == value
+    except InvalidOperation:
+        return False
+    return exact and abs(value) < 10 ** (field.max_digits - field.decimal_places)
+
+
+def _parse_row(row, utilities):
+    try:
+        telegram_id = int(str(row['telegram_id']).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректный telegram_id «{row['telegram_id']}»")
+    utility_key = str(row['utility'] or '').strip()
+    utility = utilities.get(utility_key.lower())
+    if utility is None:
+        raise ValueError(f"неизвестная услуга «{utility_key}»")
+    try:
+        value = Decimal(str(row['value']).replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"некорректное показание «{row['value']}»")
+    if not value.is_finite():
+        raise ValueError(f"некорректное показание «{row['value']}»")
+    if value < 0:
+        raise ValueError("показание не может быть отрицательным")
+    if not _fits(value, MeterReading, 'value'):
+        field = MeterReading._meta.get_field('value')
+        raise ValueError(
+            f"показание «{row['value']}» вне допустимого диапазона "
+            f"(до {field.max_digits - field.decimal_places} цифр и {field.decimal_places} знаков после запятой)"
+        )
+    return telegram_id, utility, value, parse_timestamp(row['timestamp'])
+
+
+def _last_readings(user_ids, utility_ids):
+    # Последнее подтверждённое показание по каждой паре (user, utility) — два запроса на пачку
+    latest = (
+        MeterReading.objects
+        .filter(is_confirmed=True, user_id__in=user_ids, utility_id__in=utility_ids)
+        .values('user_id', 'utility_id')
+        .annotate(last_ts=Max('timestamp'))
+    )
+    wanted = {(r['user_id'], r['utility_id']): r['last_ts'] for r in latest}
+    if not wanted:
+        return {}
+    readings = MeterReading.objects.filter(
+        is_confirmed=True, user_id__in=user_ids, utility_id__in=utility_ids,
+        timestamp__in=set(wanted.values()),
+    ).only('user_id', 'utility_id', 'value', 'timestamp')
+    return {
+        (r.user_id, r.utility_id): (r.timestamp, r.value)
+        for r in readings
+        if wanted.get((r.user_id, r.utility_id)) == r.timestamp
+    }
+
+
+# =============== ИМПОРТ ===============
+
+def _build_chunk(parsed, users, baselines, closed, report):
+    """Показания и начисления пачки от базовых показаний baselines (изменяется на месте).
+
+    Строки, датированные не позже closed (конец последнего закрытого периода), отклоняются.
+
+    Ошибки строк пишутся в report; возвращает (строки, показания, начисления, дельты балансов, сумма).
+    """
+    lines, readings, charges = [], [], []
+    balance_deltas = {}
+    amount_total = Decimal('0')
+    parsed.sort(key=lambda p: (p[1], p[2].id, p[4]))
+    for line, telegram_id, utility, value, timestamp in parsed:
+        user = users.get(telegram_id)
+        if user is None:
+            report.error(line, f"пользователь {telegram_id} не зарегистрирован")
+            continue
+        if closed is not None and timestamp <= closed:
+            report.error(line, f"дата в закрытом расчётном периоде (закрыт по {closed:%Y-%m-%d})")
+            continue
+        key = (user.id, utility.id)
+        previous = baselines.get(key)
+        if previous is not None:
+            prev_ts, prev_value = previous
+            if timestamp <= prev_ts:
+                report.error(line, "показание не новее последнего сохранённого")
+                continue
+            if value < prev_value:
+                report.error(line, "показания не могут уменьшаться")
+                continue
+            consumption = value - prev_value
+            if consumption:
+                amount = price_consumption(utility.id, consumption, prev_ts, timestamp)
+                if amount is None:
+                    report.error(line, f"тариф для «{utility.name}» не задан")
+                    continue
+                if not _fits(amount, Charge, 'amount'):
+                    report.error(line, f"начисление {amount} вне допустимого диапазона")
+                    continue
+                charges.append(Charge(
+                    user=user, utility=utility, period_start=prev_ts, period_end=timestamp,
+                    consumption=consumption, amount=amount,
+                ))
+                balance_deltas[user.id] = balance_deltas.get(user.id, Decimal('0')) + amount
+                amount_total += amount
+        lines.append(line)
+        readings.append(MeterReading(
+            user=user, utility=utility, value=value, timestamp=timestamp, is_confirmed=True
+        ))
+        baselines[key] = (timestamp, value)
+    return lines, readings, charges, balance_deltas, amount_total
+
+
+def import_readings(rows, dry_run=False, chunk_size=1000, create_users=False):
+    """Импортирует показания из итератора (номер строки, dict) и возвращает ImportReport.
+
+    Показания одного счётчика должны идти по возрастанию времени. Первое
+    показание счётчика без предыдущего становится базовым (без начисления).
+    """
+    report = ImportReport(dry_run)
+    utilities = {}
+    for u in get_utilities():
+        utilities[u.name.lower()] = u
+        utilities[str(u.id)] = u
+    # При проверке без записи показания прошлых пачек есть только в памяти:
+    # (timestamp, value) по паре (user_id, utility_id)
+    simulated = {}
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        report.rows += len(chunk)
+
+        parsed = []
+        for line, row in chunk:
+            try:
+                parsed.append((line,) + _parse_row(row, utilities))
+            except (KeyError, ValueError) as exc:
+                report.error(line, str(exc))
+
+        telegram_ids = {p[1] for p in parsed}
+        users = User.objects.in_bulk(telegram_ids, field_name='telegram_id')
+        if create_users and not dry_run:
+            missing = telegram_ids - users.keys()
+            if missing:
+                User.objects.bulk_create([User(telegram_id=t) for t in missing], ignore_conflicts=True)
+                users = User.objects.in_bulk(telegram_ids, field_name='telegram_id')
+
+        pairs = {(users[p[1]].id, p[2].id) for p in parsed if p[1] in users}
+        user_ids = sorted({u for u, _ in pairs})
+        lines = []
+        try:
+            with transaction.atomic():
+                # Строки закрытых периодов отклоняются: их снимки Statement уже сохранены.
+                # Период блокируется раньше пользователей — в том же порядке, что и при пересчёте
+                closed = closed_until(lock=not dry_run)
+                if not dry_run and user_ids:
+                    # Блокировка пользователей пачки, как при вводе показания в боте (bot/logic.py):
+                    # базовые показания читаются и начисления пишутся без параллельной записи
+                    list(
+                        User.objects.select_for_update().filter(id__in=user_ids)
+                        .order_by('id').values_list('id', flat=True)
+                    )
+                baselines = _last_readings(user_ids, {ut for _, ut in pairs}) if pairs else {}
+                for key in pairs & simulated.keys():
+                    if key not in baselines or simulated[key][0] > baselines[key][0]:
+                        baselines[key] = simulated[key]
+                lines, readings, charges, balance_deltas, amount = _build_chunk(parsed, users, baselines, closed, report)
+                if not dry_run and readings:
+                    MeterReading.objects.bulk_create(readings, batch_size=500)
+                    Charge.objects.bulk_create(charges, batch_size=500)
+                    add_charges_to_balances(balance_deltas)
+        except IntegrityError as exc:
+            # Пачка откатывается целиком: например, в БД уже есть неподтверждённое показание с тем же временем
+            for line in lines:
+                report.error(line, f"пачка не записана: {exc}")
+            continue
+        if dry_run:
+            simulated.update(baselines)
+        report.readings += len(readings)
+        report.charges += len(charges)
+        report.amount += amount
+
+    report.elapsed = time.monotonic() - report.started
+    return report
@@ -0,0 +1,151 @@
+# bot/ledger.py
+# Материализованный баланс пользователей (таблица UserBalance).
+# Итоги меняются в той же транзакции, что и вставка Charge/Payment,
+# поэтому чтение баланса — один запрос вне зависимости от длины истории.
+# Начисления архивированных периодов (ChargeArchive) входят в итоги наравне с Charge.
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+
+from .models import User, Charge, ChargeArchive, Payment, UserBalance
+
+ZERO = Decimal('0')
+
+
+def _totals_by_user(model, user_ids=None):
+    qs = model.objects.all()
+    if user_ids is not None:
+        qs = qs.filter(user_id__in=user_ids)
+    return dict(qs.values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'))
+
+
+def _charge_totals(user_ids=None):
+    # Сумма начислений: горячая таблица плюс архив закрытых периодов
+    totals = _totals_by_user(Charge, user_ids)
+    for user_id, total in _totals_by_user(ChargeArchive, user_ids).items():
+        totals[user_id] = (totals.get(user_id) or ZERO) + total
+    return totals
+
+
+def add_to_balance(user, charges=ZERO, payments=ZERO):
+    """Прибавляет суммы к итогам пользователя.
+
+    Вызывается внутри transaction.atomic() вместе с созданием Charge/Payment,
+    после блокировки строки пользователя (select_for_update).
+    """
+    updated = UserBalance.objects.filter(user=user).update(
+        total_charges=F('total_charges') + charges,
+        total_payments=F('total_payments') + payments,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # Первая операция пользователя: итоги считаются по уже вставленным строкам.
+        # Если строку итогов одновременно создала транзакция без блокировки пользователя
+        # (импорт, пересчёт), наших строк в её итогах нет — прибавляем суммы к ней
+        try:
+            with transaction.atomic():
+                UserBalance.objects.create(
+                    user=user,
+                    total_charges=_charge_totals([user.pk]).get(user.pk) or ZERO,
+                    total_payments=_totals_by_user(Payment, [user.pk]).get(user.pk) or ZERO,
+                )
+        except IntegrityError:
+            add_to_balance(user, charges, payments)
+
+
+def add_charges_to_balances(charges_by_user):
+    """Прибавляет начисления к итогам нескольких пользователей одним UPDATE.
+
+    charges_by_user — словарь user_id -> сумма. Вызывается внутри transaction.atomic()
+    вместе с массовой вставкой Charge (импорт ведомости) или пересчётом начислений.
+    """
+    if not charges_by_user:
+        return
+    amount = Case(
+        *[When(user_id=user_id, then=Value(value)) for user_id, value in charges_by_user.items()],
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    updated = UserBalance.objects.filter(user_id__in=charges_by_user).update(
+        total_charges=F('total_charges') + amount,
+        updated_at=timezone.now(),
+    )
+    if updated < len(charges_by_user):
+        existing = set(UserBalance.objects.filter(user_id__in=charges_by_user).values_list('user_id', flat=True))
+        missing = [user_id for user_id in charges_by_user if user_id not in existing]
+        charges = _charge_totals(missing)
+        payments = _totals_by_user(Payment, missing)
+        try:
+            with transaction.atomic():
+                UserBalance.objects.bulk_create([
+                    UserBalance(
+                        user_id=user_id,
+                        total_charges=charges.get(user_id) or ZERO,
+                        total_payments=payments.get(user_id) or ZERO,
+                    )
+                    for user_id in missing
+                ])
+        except IntegrityError:
+            # Часть строк итогов успела создать другая транзакция: повторяем для недостающих
+            add_charges_to_balances({user_id: charges_by_user[user_id] for user_id in missing})
+
+
+def get_balance(user):
+    """Баланс пользователя: сумма оплат минус сумма начислений."""
+    record = UserBalance.objects.filter(user=user).first()
+    return record.balance if record else ZERO
+
+
+def compute_balances():
+    """Пересчитывает итоги всех пользователей по сырым строкам Charge/ChargeArchive/Payment.
+
+    Возвращает словарь user_id -> (total_charges, total_payments).
+    """
+    charges = _charge_totals()
+    payments = _totals_by_user(Payment)
+    return {
+        user_id: (charges.get(user_id) or ZERO, payments.get(user_id) or ZERO)
+        for user_id in User.objects.values_list('id', flat=True)
+    }
+
+
+def verify_balances():
+    """Список расхождений (user_id, ожидаемые итоги, сохранённые итоги)."""
+    stored = {
+        b.user_id: (b.total_charges, b.total_payments)
+        for b in UserBalance.objects.all()
+    }
+    mismatches = []
+    for user_id, expected in compute_balances().items():
+        actual = stored.get(user_id, (ZERO, ZERO))
+        if actual != expected:
+            mismatches.append((user_id, expected, actual))
+    return mismatches
+
+
+def rebuild_balances():
+    """Перестраивает таблицу UserBalance. Возвращает число пользователей."""
+    with transaction.atomic():
+        # Сначала блокируем итоги, затем считаем: параллельные add_to_balance
+        # дождутся коммита и применят свои суммы поверх пересчитанных значений
+        stored = {b.user_id: b for b in UserBalance.objects.select_for_update()}
+        expected = compute_balances()
+        to_create, to_update = [], []
+        now = timezone.now()
+        for user_id, (total_charges, total_payments) in expected.items():
+            record = stored.get(user_id)
+            if record is None:
+                to_create.append(UserBalance(
+                    user_id=user_id, total_charges=total_charges, total_payments=total_payments
+                ))
+            else:
+                record.total_charges = total_charges
+                record.total_payments = total_payments
+                record.updated_at = now
+                to_update.append(record)
+        UserBalance.objects.bulk_create(to_create, batch_size=1000)
+        UserBalance.objects.bulk_update(
+            to_update, ['total_charges', 'total_payments', 'updated_at'], batch_size=1000
+        )
+    return len(expected)
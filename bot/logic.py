@@ -1,31 +1,85 @@
-from django.db import transaction
-from decimal import Decimal
-from .models import MeterReading, Charge, Tariff
+from django.db import IntegrityError, transaction
+from .models import User, MeterReading, Charge, Payment
+from .db import db_call
+from .ledger import add_to_balance
+from .tariffs import price_consumption
 
-def calculate_and_create_charge(user, utility, new_reading_value, new_timestamp):
-    last_reading = MeterReading.objects.filter(
-        user=user, utility=utility, is_confirmed=True
-    ).order_by('-timestamp').first()
+def reading_source_key(message):
+    """Ключ идемпотентности показания: чат и номер сообщения Telegram."""
+    return f"tg:{message.chat_id}:{message.message_id}"
 
-    if not last_reading:
-        return None
-    if new_reading_value < last_reading.value:
-        raise ValueError("Показания не могут уменьшаться")
 
-    consumption = new_reading_value - last_reading.value
-    if consumption == 0:
-        return None
+_MISSING = object()
 
-    tariff = Tariff.objects.filter(
-        utility=utility, valid_from__lte=new_timestamp
-    ).order_by('-valid_from').first()
 
-    if not tariff:
-        raise ValueError("Тариф не задан")
+def _duplicate_result(source_key):
+    # Результат уже обработанного показания с тем же ключом: True — было начисление,
+    # None — показание сохранено без начисления; _MISSING — такого показания нет
+    reading = MeterReading.objects.filter(source_key=source_key).first()
+    if reading is None:
+        return _MISSING
+    charged = Charge.objects.filter(
+        user_id=reading.user_id, utility_id=reading.utility_id, period_end=reading.timestamp
+    ).exists()
+    return True if charged else None
 
-    amount = (consumption * tariff.rate).quantize(Decimal('0.01'))
 
+def calculate_and_create_charge(user, utility, new_reading_value, new_timestamp, source_key=None):
+    """Сохраняет показание и создаёт начисление за расход с предыдущего.
+
+    Возвращает True, если создано начисление, и None, если показание сохранено без
+    начисления (первое показание счётчика или нулевой расход). Повтор с тем же
+    source_key ничего не создаёт и возвращает результат первой обработки.
+    """
+    try:
+        return _calculate_and_create_charge(user, utility, new_reading_value, new_timestamp, source_key)
+    except IntegrityError:
+        # Уникальность source_key или (user, utility, timestamp): показание уже сохранено
+        if source_key:
+            result = _duplicate_result(source_key)
+            if result is not _MISSING:
+                return result
+        raise ValueError("Показание на это время уже сохранено")
+
+
+def _calculate_and_create_charge(user, utility, new_reading_value, new_timestamp, source_key):
     with transaction.atomic():
+        # Блокировка строки пользователя сериализует показания пользователя по всем
+        # счётчикам. Блокировать само последнее показание нельзя: после ожидания
+        # запрос с ORDER BY ... LIMIT 1 вернул бы ту же строку, не увидев новую
+        User.objects.select_for_update().only('id').get(pk=user.pk)
+        if source_key:
+            result = _duplicate_result(source_key)
+            if result is not _MISSING:
+                return result
+
+        last_reading = MeterReading.objects.filter(
+            user=user, utility=utility, is_confirmed=True
+        ).order_by('-timestamp').first()
+
+        amount = None
+        if last_reading:
+            if new_reading_value < last_reading.value:
+                raise ValueError("Показания не могут уменьшаться")
+            if new_timestamp <= last_reading.timestamp:
+                raise ValueError("Показание не новее последнего сохранённого")
+            consumption = new_reading_value - last_reading.value
+            if consumption:
+                amount = price_consumption(utility.id, consumption, last_reading.timestamp, new_timestamp)
+                if amount is None:
+                    raise ValueError("Тариф не задан")
+
+        # Первое показание счётчика сохраняется как базовое — от него считается следующий расход
+        MeterReading.objects.create(
+            user=user,
+            utility=utility,
+            value=new_reading_value,
+            timestamp=new_timestamp,
+            is_confirmed=True,
+            source_key=source_key,
+        )
+        if amount is None:
+            return None
         Charge.objects.create(
             user=user,
             utility=utility,
@@ -34,11 +88,20 @@ def calculate_and_create_charge(user, utility, new_reading_value, new_timestamp)
             consumption=consumption,
             amount=amount
         )
-        MeterReading.objects.create(
-            user=user,
-            utility=utility,
-            value=new_reading_value,
-            timestamp=new_timestamp,
-            is_confirmed=True
-        )
-    return True
\ No newline at end of file
+        add_to_balance(user, charges=amount)
+    return True
+
+
+def create_payment(user, amount, timestamp, comment=''):
+    with transaction.atomic():
+        # Как и для показаний: операции пользователя с балансом идут по очереди,
+        # и первая из них создаёт строку UserBalance без гонки
+        User.objects.select_for_update().only('id').get(pk=user.pk)
+        payment = Payment.objects.create(user=user, amount=amount, timestamp=timestamp, comment=comment)
+        add_to_balance(user, payments=amount)
+    return payment
+
+
+# Асинхронные варианты для обработчиков бота
+acalculate_and_create_charge = db_call(calculate_and_create_charge)
+acreate_payment = db_call(create_payment)
\ No newline at end of file
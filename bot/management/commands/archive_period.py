@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.archive import DEFAULT_BATCH_SIZE, archive_periods
+from bot.importer import parse_timestamp
+
+
+class Command(BaseCommand):
+    help = (
+        "Move readings and charges of closed billing periods into the archive tables "
+        "(yearly partitions on PostgreSQL); user balances are kept intact"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            help="Archive closed periods ending on or before this date (YYYY-MM-DD); "
+                 "default: start of the current year (UTC)",
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help=f"Rows moved per transaction (default: {DEFAULT_BATCH_SIZE})")
+        parser.add_argument('--dry-run', action='store_true', help="Count rows to archive without moving them")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            before = parse_timestamp(options['before']) if options['before'] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        report = archive_periods(before, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        self.stdout.write(report.summary())
@@ -0,0 +1,194 @@
+import asyncio
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bot import handlers
+from bot.db import run_in_db
+from bot.fakes import FakeBot, FakeContext, FakeUpdate, seed_dataset
+from bot.metrics import QueryStats, query_stats
+from bot.models import User, Utility, MeterReading, Charge, Payment
+
+
+class Actor:
+    """Участник бенчмарка: свои счётчики с растущими показаниями."""
+
+    def __init__(self, telegram_id, utility_ids, rng):
+        self.telegram_id = telegram_id
+        self.utility_ids = utility_ids
+        self.rng = rng
+        self.values = {}
+
+    def next_reading(self):
+        utility_id = self.rng.choice(self.utility_ids)
+        # Выше любых показаний seed_dataset
+        value = self.values.get(utility_id, 10 ** 6) + self.rng.randint(1, 50)
+        self.values[utility_id] = value
+        return utility_id, value
+
+
+# Сценарии диалогов: функция (участник, админ) -> шаги (название, обработчик, кто отправляет, апдейт)
+def reading_dialog(actor, admin):
+    utility_id, value = actor.next_reading()
+    return [
+        ("/submit_reading", handlers.submit_reading, actor, {'text': "/submit_reading"}),
+        ("util:", handlers.handle_callback, actor, {'data': f"util:{utility_id}"}),
+        ("text: reading", handlers.handle_message, actor, {'text': str(value)}),
+    ]
+
+
+def payment_dialog(actor, admin):
+    return [
+        ("/add_payment", handlers.add_payment, actor, {'text': "/add_payment"}),
+        ("text: payment", handlers.handle_message, actor, {'text': str(actor.rng.randint(100, 3000))}),
+    ]
+
+
+def balance_dialog(actor, admin):
+    return [
+        ("/balance", handlers.balance, actor, {'text': "/balance"}),
+        ("/statement", handlers.statement, actor, {'text': "/statement"}),
+    ]
+
+
+def admin_report_dialog(actor, admin):
+    return [
+        ("/billing_report", handlers.billing_report, admin, {'text': "/billing_report"}),
+        ("/list_users", handlers.list_users, admin, {'text': "/list_users"}),
+        ("/user_balance", handlers.user_balance, admin, {'text': f"/user_balance {actor.telegram_id}"}),
+    ]
+
+
+# Сценарий и его доля в нагрузке
+DIALOGS = [
+    (reading_dialog, 4),
+    (payment_dialog, 2),
+    (balance_dialog, 3),
+    (admin_report_dialog, 1),
+]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+def _prepare(users, utilities, readings):
+    started = time.monotonic()
+    ids = seed_dataset(users, utilities, readings)
+    return {
+        'admin': ids['admin'],
+        'members': list(User.objects.filter(is_admin=False).order_by('id').values_list('telegram_id', flat=True)),
+        'utilities': list(Utility.objects.order_by('id').values_list('id', flat=True)),
+        'rows': (MeterReading.objects.count(), Charge.objects.count(), Payment.objects.count()),
+        'seconds': time.monotonic() - started,
+    }
+
+
+async def run_step(bot, samples, errors, name, handler, actor, update_kwargs):
+    update = FakeUpdate(bot, actor.telegram_id, **update_kwargs)
+    text = update_kwargs.get('text') or ''
+    context = FakeContext(bot, args=text.split()[1:])
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    started = time.perf_counter()
+    try:
+        await handler(update, context)
+    except Exception as exc:
+        errors.setdefault(name, []).append(exc)
+        return
+    finally:
+        query_stats.reset(token)
+    samples.append((name, time.perf_counter() - started, stats.count))
+
+
+async def run_worker(dialogs, actors, admin, bot, samples, errors):
+    # Участники закреплены за воркером: диалоги одного участника идут последовательно
+    while dialogs:
+        dialog = dialogs.pop()
+        actor = actors[len(dialogs) % len(actors)]
+        for name, handler, sender, update_kwargs in dialog(actor, admin):
+            await run_step(bot, samples, errors, name, handler, sender, update_kwargs)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test DB with a synthetic dataset and replay scripted dialogs through "
+        "the bot handlers with a stubbed Telegram API; report updates/sec, latency and queries per update"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Members in the dataset (default: 200)")
+        parser.add_argument('--utilities', type=int, default=4, help="Utilities in the dataset (default: 4)")
+        parser.add_argument('--years', type=int, default=2, help="Years of monthly readings and payments (default: 2)")
+        parser.add_argument('--dialogs', type=int, default=500, help="Scripted dialogs to replay (default: 500)")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Dialogs replayed concurrently, each by its own group of members (default: 1)")
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for the dialog mix (default: 1)")
+
+    def handle(self, *args, **options):
+        if options['users'] < options['concurrency']:
+            raise CommandError("--users must be at least --concurrency")
+        if min(options['users'], options['utilities'], options['years'], options['dialogs']) < 1:
+            raise CommandError("--users, --utilities, --years and --dialogs must be positive")
+        if options['concurrency'] > 1 and connection.vendor == 'sqlite':
+            # Тестовая БД SQLite в памяти блокирует таблицы целиком: параллельные записи падают
+            raise CommandError("--concurrency > 1 needs PostgreSQL (DATABASE_URL); SQLite serialises writers")
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            data = asyncio.run(run_in_db(_prepare, options['users'], options['utilities'], options['years'] * 12))
+            readings, charges, payments = data['rows']
+            self.stdout.write(
+                f"Dataset: {options['users']} users x {options['utilities']} utilities x {options['years']} years "
+                f"({readings} readings, {charges} charges, {payments} payments), seeded in {data['seconds']:.1f} s"
+            )
+            samples, errors, elapsed = asyncio.run(self.replay(data, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(samples, errors, elapsed, options)
+
+    async def replay(self, data, options):
+        rng = random.Random(options['seed'])
+        concurrency = options['concurrency']
+        members = [Actor(t, data['utilities'], rng) for t in data['members']]
+        admin = Actor(data['admin'], data['utilities'], rng)
+        weights = [weight for _, weight in DIALOGS]
+        bot = FakeBot()
+        samples, errors = [], {}
+
+        workers = []
+        for i in range(concurrency):
+            count = options['dialogs'] // concurrency + (i < options['dialogs'] % concurrency)
+            dialogs = rng.choices([dialog for dialog, _ in DIALOGS], weights, k=count)
+            workers.append(run_worker(dialogs, members[i::concurrency], admin, bot, samples, errors))
+        started = time.perf_counter()
+        await asyncio.gather(*workers)
+        return samples, errors, time.perf_counter() - started
+
+    def report(self, samples, errors, elapsed, options):
+        total = len(samples) + sum(len(e) for e in errors.values())
+        self.stdout.write(
+            f"Replayed {options['dialogs']} dialogs ({total} updates, concurrency {options['concurrency']}) "
+            f"in {elapsed:.2f} s: {total / elapsed:.1f} updates/s"
+        )
+        self.stdout.write(f"{'step':<18} {'count':>6} {'p50 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        by_step = {}
+        for name, seconds, queries in samples:
+            by_step.setdefault(name, []).append((seconds, queries))
+        rows = sorted(by_step.items()) + [('total', [(s, q) for _, s, q in samples])]
+        for name, values in rows:
+            latencies = [s * 1000 for s, _ in values]
+            queries = sum(q for _, q in values) / len(values)
+            self.stdout.write(
+                f"{name:<18} {len(values):>6} {percentile(latencies, 0.5):>8.2f} "
+                f"{percentile(latencies, 0.99):>8.2f} {queries:>8.1f}"
+            )
+        if errors:
+            for name, exceptions in sorted(errors.items()):
+                self.stderr.write(f"{name}: {len(exceptions)} failed, last error: {exceptions[-1]!r}")
+            raise CommandError("Some handlers raised exceptions")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.billing import close_period, current_month_start
+from bot.importer import parse_timestamp
+
+
+class Command(BaseCommand):
+    help = "Close the billing period and write per-user Statement snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--end', help="Period end (YYYY-MM-DD, exclusive day start); default: start of the current month (UTC)"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            end = parse_timestamp(options['end']) if options['end'] else current_month_start()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        period = close_period(end)
+        if period is None:
+            self.stdout.write(f"Period ending {end:%Y-%m-%d %H:%M} is already closed")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Closed period ending {period.end:%Y-%m-%d %H:%M}: {period.statements.count()} statement(s)"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bot.export import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, export_ledger, find_utility
+from bot.importer import parse_timestamp
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream charges, payments or meter readings into a gzip-compressed CSV or JSON Lines file "
+        "with constant memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS), help="What to export")
+        parser.add_argument('--format', choices=FORMATS, default='csv', help="Output format (default: csv)")
+        parser.add_argument('--from', dest='since', help="Only rows dated on or after this date")
+        parser.add_argument('--to', dest='until', help="Only rows dated before this date")
+        parser.add_argument('--utility', help="Utility name or id (charges and readings)")
+        parser.add_argument('--user', type=int, help="Telegram ID of a single member")
+        parser.add_argument('--output', help="Output path (default: <kind>-<date>.<format>.gz)")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f"Rows fetched per round trip (default: {DEFAULT_CHUNK_SIZE})")
+
+    def handle(self, *args, **options):
+        kind, fmt = options['kind'], options['format']
+        path = options['output'] or f"{kind}-{timezone.localdate():%Y%m%d}.{fmt}.gz"
+        try:
+            report = export_ledger(
+                path, kind, fmt,
+                since=parse_timestamp(options['since']) if options['since'] else None,
+                until=parse_timestamp(options['until']) if options['until'] else None,
+                utility=find_utility(options['utility']) if options['utility'] else None,
+                telegram_id=options['user'],
+                chunk_size=options['chunk_size'],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(f"{report.summary()} -> {path}")
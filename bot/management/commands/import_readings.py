@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.importer import import_readings, iter_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import meter readings from a CSV or XLSX sheet with columns "
+        "telegram_id, utility (name or id), value, timestamp"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path to the .csv or .xlsx file")
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help="File format (default: by extension)")
+        parser.add_argument('--dry-run', action='store_true', help="Validate and compute charges without writing")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows per transaction (default: 1000)")
+        parser.add_argument('--create-users', action='store_true', help="Register unknown telegram_ids")
+
+    def handle(self, *args, **options):
+        try:
+            report = import_readings(
+                iter_file(options['path'], options['format']),
+                dry_run=options['dry_run'],
+                chunk_size=options['chunk_size'],
+                create_users=options['create_users'],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(report.summary())
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from bot.fsm import get_storage
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned dialog states older than FSM_TTL"
+
+    def handle(self, *args, **options):
+        deleted = get_storage().purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired dialog state(s)"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.ledger import rebuild_balances, verify_balances
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized user balances from Charge/Payment rows (or verify them with --verify)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help="Only compare stored balances with raw rows, do not modify anything",
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = verify_balances()
+            for user_id, expected, actual in mismatches:
+                self.stdout.write(
+                    f"user_id={user_id}: expected charges/payments {expected[0]}/{expected[1]}, "
+                    f"stored {actual[0]}/{actual[1]}"
+                )
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} balance(s) out of sync")
+            self.stdout.write(self.style.SUCCESS("All balances are consistent"))
+            return
+
+        count = rebuild_balances()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt balances for {count} user(s)"))
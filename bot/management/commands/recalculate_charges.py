@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.importer import parse_timestamp
+from bot.models import Utility
+from bot.recalc import recalculate_charges
+
+
+def _parse_day(value):
+    try:
+        return parse_timestamp(value)
+    except ValueError:
+        raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+
+
+class Command(BaseCommand):
+    help = "Recalculate charges of a utility after retroactive tariff changes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('utility', help="Utility id or name")
+        parser.add_argument('--since', help="Only periods ending after this date (YYYY-MM-DD)")
+        parser.add_argument('--until', help="Only periods ending on or before this date (YYYY-MM-DD)")
+        parser.add_argument('--dry-run', action='store_true', help="Report differences without writing")
+
+    def handle(self, *args, **options):
+        key = options['utility']
+        try:
+            utility = Utility.objects.get(id=int(key)) if key.isdigit() else Utility.objects.get(name=key)
+        except Utility.DoesNotExist:
+            raise CommandError(f"Utility not found: {key}")
+        report = recalculate_charges(
+            utility,
+            since=_parse_day(options['since']) if options['since'] else None,
+            until=_parse_day(options['until']) if options['until'] else None,
+            dry_run=options['dry_run'],
+        )
+        self.stdout.write(report.summary())
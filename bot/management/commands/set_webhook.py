@@ -0,0 +1,24 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from telegram import Bot
+
+from bot.application import ensure_webhook
+
+
+class Command(BaseCommand):
+    help = "Point the Telegram webhook at RENDER_EXTERNAL_URL/webhook/ with the current secret token"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-changed', action='store_true', help="Only set the webhook if its URL differs"
+        )
+
+    def handle(self, *args, **options):
+        changed = asyncio.run(self.set_webhook(force=not options['if_changed']))
+        self.stdout.write(self.style.SUCCESS("Webhook set") if changed else "Webhook is already up to date")
+
+    async def set_webhook(self, force):
+        async with Bot(settings.TELEGRAM_BOT_TOKEN) as bot:
+            return await ensure_webhook(bot, force=force)
@@ -0,0 +1,24 @@
+# bot/management/commands/telegram_bot.py
+# Запуск бота встроенным вебхук-сервером python-telegram-bot (без ASGI).
+# В продакшене вебхук обслуживает communal_bot/asgi.py (uvicorn).
+import os
+from django.core.management.base import BaseCommand
+
+from bot.application import WEBHOOK_PATH, build_application, webhook_secret, webhook_url
+
+
+class Command(BaseCommand):
+    help = "Run Telegram bot with the built-in python-telegram-bot webhook server"
+
+    def handle(self, *args, **options):
+        app = build_application()
+        url = webhook_url()
+        self.stdout.write(f"Setting webhook to {url}")
+        # run_webhook сам управляет циклом событий
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.environ.get("PORT", 8000)),
+            url_path=WEBHOOK_PATH.strip('/'),
+            webhook_url=url,
+            secret_token=webhook_secret(),
+        )
@@ -0,0 +1,196 @@
+# bot/metrics.py
+# Метрики процесса в текстовом формате Prometheus (GET /metrics в communal_bot/asgi.py).
+# Счётчики и гистограммы хранятся в памяти процесса; при нескольких процессах
+# каждый отдаёт свои значения. Обработчики бота оборачиваются instrument():
+# время, ошибки, число и время запросов к БД — по обработчику и маршруту
+# (префиксу callback_data).
+import contextvars
+import functools
+import threading
+import time
+
+from telegram.ext import ApplicationHandlerStop
+
+from .router import unpack
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with _lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение, вычисляемое при каждом чтении /metrics."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def render(self):
+        return self._header() + [f"{self.name} {_format_value(self.func())}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        lines = self._header()
+        with _lock:
+            items = sorted((labels, (list(b), c, s)) for labels, (b, c, s) in self._values.items())
+        for labels, (bucket_counts, count, total) in items:
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                label_str = _format_labels(self.labelnames + ('le',), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{label_str} {bucket_count}")
+            label_str = _format_labels(self.labelnames + ('le',), labels + ('+Inf',))
+            lines.append(f"{self.name}_bucket{label_str} {count}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_count{label_str} {count}")
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+        return lines
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus 0.0.4."""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# =============== ЗАПРОСЫ К БД ===============
+
+class QueryStats:
+    """Число и суммарное время SQL-запросов в рамках одного апдейта."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper (см. bot/db.py)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# Контекст копируется в потоки пула БД (asgiref), поэтому запросы попадают в статистику апдейта
+query_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+# =============== ОБРАБОТЧИКИ ===============
+
+HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', "Handler latency in seconds", ('handler', 'route'))
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', "Handler calls that raised an exception", ('handler', 'route'))
+HANDLER_DB_QUERIES = Histogram(
+    'bot_handler_db_queries', "Database queries per handler call", ('handler', 'route'), QUERY_BUCKETS)
+HANDLER_DB_SECONDS = Counter(
+    'bot_handler_db_seconds_total', "Time spent in database queries", ('handler', 'route'))
+
+MAX_ROUTE_LENGTH = 32
+
+
+def route_of(update):
+    """Маршрут для меток: префикс callback_data до «:» (util, del_t, admin_read_util, …)."""
+    query = getattr(update, 'callback_query', None)
+    if query is not None and query.data:
+        return unpack(query.data)[0][:MAX_ROUTE_LENGTH]
+    return ''
+
+
+def instrument(callback, name=None):
+    """Оборачивает обработчик PTB: время, ошибки и запросы к БД по обработчику и маршруту."""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        route = route_of(update)
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name, route)
+            raise
+        finally:
+            query_stats.reset(token)
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, route)
+            HANDLER_DB_QUERIES.observe(stats.count, name, route)
+            HANDLER_DB_SECONDS.inc(name, route, amount=stats.seconds)
+
+    return wrapper
+
+
+def instrument_handlers(app):
+    """Оборачивает instrument() все зарегистрированные обработчики Application."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_balances(apps, schema_editor):
+    User = apps.get_model('bot', 'User')
+    Charge = apps.get_model('bot', 'Charge')
+    Payment = apps.get_model('bot', 'Payment')
+    UserBalance = apps.get_model('bot', 'UserBalance')
+    charges = dict(Charge.objects.values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'))
+    payments = dict(Payment.objects.values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total'))
+    UserBalance.objects.bulk_create(
+        [
+            UserBalance(user_id=user_id, total_charges=charges.get(user_id) or 0, total_payments=payments.get(user_id) or 0)
+            for user_id in User.objects.values_list('id', flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_charges', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_payments', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='bot.user')),
+            ],
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
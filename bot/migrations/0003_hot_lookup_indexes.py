@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_userbalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='charge',
+            index=models.Index(fields=['user', '-period_end'], name='charge_user_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='meterreading',
+            index=models.Index(condition=models.Q(('is_confirmed', True)), fields=['user', 'utility', '-timestamp'], name='reading_confirmed_last_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', '-timestamp'], name='payment_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tariff',
+            index=models.Index(fields=['utility', '-valid_from'], name='tariff_utility_valid_idx'),
+        ),
+    ]
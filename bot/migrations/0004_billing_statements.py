@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(blank=True, null=True)),
+                ('end', models.DateTimeField(unique=True)),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-end'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Statement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('total_charges', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('total_payments', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='bot.billingperiod')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-period'], name='statement_user_period_idx')],
+                'unique_together': {('period', 'user')},
+            },
+        ),
+    ]
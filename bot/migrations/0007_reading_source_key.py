@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_multi_worker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meterreading',
+            name='source_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Архивная модель -> колонка, по которой PostgreSQL делит таблицу на секции
+PARTITION_KEYS = {
+    'MeterReadingArchive': 'timestamp',
+    'ChargeArchive': 'period_end',
+}
+
+
+def _create_partitioned_table(model, key, schema_editor):
+    # PARTITION BY RANGE: первичный ключ обязан включать ключ секционирования.
+    # Годовые секции создаёт bot/archive.py; строки вне них попадают в секцию DEFAULT
+    qn = schema_editor.quote_name
+    table = model._meta.db_table
+    columns, constraints = [], []
+    for field in model._meta.local_fields:
+        null = '' if field.null else ' NOT NULL'
+        columns.append(f"{qn(field.column)} {field.db_type(schema_editor.connection)}{null}")
+        if field.remote_field is not None:
+            target = field.remote_field.model._meta
+            constraints.append(
+                f"FOREIGN KEY ({qn(field.column)}) REFERENCES {qn(target.db_table)} ({qn(target.pk.column)}) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+    constraints.insert(0, f"PRIMARY KEY ({qn(model._meta.pk.column)}, {qn(key)})")
+    schema_editor.execute(
+        f"CREATE TABLE {qn(table)} ({', '.join(columns + constraints)}) PARTITION BY RANGE ({qn(key)})"
+    )
+    schema_editor.execute(f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(table)} DEFAULT")
+    # Индексы на секционированной таблице создаются во всех секциях
+    for sql in schema_editor._model_indexes_sql(model):
+        schema_editor.execute(sql)
+
+
+def create_archive_tables(apps, schema_editor):
+    for name, key in PARTITION_KEYS.items():
+        model = apps.get_model('bot', name)
+        if schema_editor.connection.vendor == 'postgresql':
+            _create_partitioned_table(model, key, schema_editor)
+        else:
+            # SQLite и другие БД: обычная таблица
+            schema_editor.create_model(model)
+
+
+def drop_archive_tables(apps, schema_editor):
+    for name in PARTITION_KEYS:
+        # Секции PostgreSQL удаляются вместе с родительской таблицей
+        schema_editor.delete_model(apps.get_model('bot', name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_reading_source_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingperiod',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Модели архива в состоянии миграций; таблицы создаёт RunPython ниже,
+        # на PostgreSQL — секционированными
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ChargeArchive',
+                    fields=[
+                        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                        ('period_start', models.DateTimeField()),
+                        ('period_end', models.DateTimeField()),
+                        ('consumption', models.DecimalField(decimal_places=3, max_digits=12)),
+                        ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                        ('calculated_at', models.DateTimeField()),
+                        ('archived_at', models.DateTimeField(auto_now_add=True)),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.user')),
+                        ('utility', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.utility')),
+                    ],
+                    options={
+                        'indexes': [models.Index(fields=['user', 'period_end'], name='charge_archive_user_idx')],
+                    },
+                ),
+                migrations.CreateModel(
+                    name='MeterReadingArchive',
+                    fields=[
+                        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                        ('value', models.DecimalField(decimal_places=3, max_digits=12)),
+                        ('timestamp', models.DateTimeField()),
+                        ('is_confirmed', models.BooleanField(default=False)),
+                        ('source_key', models.CharField(blank=True, max_length=64, null=True)),
+                        ('archived_at', models.DateTimeField(auto_now_add=True)),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.user')),
+                        ('utility', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='bot.utility')),
+                    ],
+                    options={
+                        'indexes': [
+                            models.Index(fields=['user', 'utility', 'timestamp'], name='reading_archive_meter_idx'),
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive_tables, drop_archive_tables),
+    ]
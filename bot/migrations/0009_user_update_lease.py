@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserUpdateLease',
+            fields=[
+                ('telegram_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('lease_until', models.DateTimeField()),
+            ],
+        ),
+    ]
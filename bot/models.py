@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.core.validators import MinValueValidator
 
 class User(models.Model):
@@ -17,6 +18,10 @@ class Tariff(models.Model):
 
     class Meta:
         ordering = ['-valid_from']
+        indexes = [
+            # Актуальный тариф услуги: valid_from <= t ORDER BY -valid_from
+            models.Index(fields=['utility', '-valid_from'], name='tariff_utility_valid_idx'),
+        ]
 
 class MeterReading(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -24,9 +29,19 @@ class MeterReading(models.Model):
     value = models.DecimalField(max_digits=12, decimal_places=3, validators=[MinValueValidator(0)])
     timestamp = models.DateTimeField()
     is_confirmed = models.BooleanField(default=False)
+    # Ключ идемпотентности: сообщение Telegram, из которого пришло показание (см. bot/logic.py)
+    source_key = models.CharField(max_length=64, null=True, blank=True, unique=True)
 
     class Meta:
         unique_together = ('user', 'utility', 'timestamp')
+        indexes = [
+            # Последнее подтверждённое показание по (user, utility)
+            models.Index(
+                fields=['user', 'utility', '-timestamp'],
+                condition=Q(is_confirmed=True),
+                name='reading_confirmed_last_idx',
+            ),
+        ]
 
 class Charge(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -39,6 +54,9 @@ class Charge(models.Model):
 
     class Meta:
         unique_together = ('user', 'utility', 'period_end')
+        indexes = [
+            models.Index(fields=['user', '-period_end'], name='charge_user_period_idx'),
+        ]
 
 class Payment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -46,8 +64,112 @@ class Payment(models.Model):
     timestamp = models.DateTimeField()
     comment = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='payment_user_ts_idx'),
+        ]
+
+class MeterReadingArchive(models.Model):
+    # Показания закрытых расчётных периодов, перенесённые из MeterReading (см. bot/archive.py).
+    # На PostgreSQL таблица секционирована по годам timestamp (миграция 0008_archive)
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    utility = models.ForeignKey(Utility, on_delete=models.CASCADE)
+    value = models.DecimalField(max_digits=12, decimal_places=3)
+    timestamp = models.DateTimeField()
+    is_confirmed = models.BooleanField(default=False)
+    source_key = models.CharField(max_length=64, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'utility', 'timestamp'], name='reading_archive_meter_idx'),
+        ]
+
+class ChargeArchive(models.Model):
+    # Начисления закрытых расчётных периодов, перенесённые из Charge; секции — по годам period_end.
+    # Суммы входят в итоги UserBalance (см. bot/ledger.py)
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    utility = models.ForeignKey(Utility, on_delete=models.CASCADE)
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    consumption = models.DecimalField(max_digits=12, decimal_places=3)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    calculated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'period_end'], name='charge_archive_user_idx'),
+        ]
+
 class FSMState(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     state_name = models.CharField(max_length=100)
     context = models.JSONField(default=dict)
-    updated_at = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    updated_at = models.DateTimeField(auto_now=True)
+
+class UserBalance(models.Model):
+    # Материализованные итоги по пользователю: обновляются в той же транзакции,
+    # что и создание Charge/Payment (см. bot/ledger.py)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='balance')
+    total_charges = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_payments = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def balance(self):
+        return self.total_payments - self.total_charges
+
+class BillingPeriod(models.Model):
+    # Закрытый расчётный период: (start, end]. У первого периода start не задан
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(unique=True)
+    closed_at = models.DateTimeField(auto_now_add=True)
+    # Показания и начисления периода перенесены в архивные таблицы
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-end']
+
+class Statement(models.Model):
+    # Снимок итогов пользователя за закрытый период
+    period = models.ForeignKey(BillingPeriod, on_delete=models.CASCADE, related_name='statements')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    opening_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    total_charges = models.DecimalField(max_digits=14, decimal_places=2)
+    total_payments = models.DecimalField(max_digits=14, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        unique_together = ('period', 'user')
+        indexes = [
+            models.Index(fields=['user', '-period'], name='statement_user_period_idx'),
+        ]
+
+class Broadcast(models.Model):
+    # Рассылка всем участникам; last_user_id — курсор по User.id для продолжения после перезапуска
+    text = models.TextField()
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_user_id = models.BigIntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Аренда рассылки процессом бота: пока не истекла, другие процессы её не продолжают
+    lease_until = models.DateTimeField(null=True, blank=True)
+
+
+class ProcessedUpdate(models.Model):
+    # Обработанные update_id Telegram — общий для всех процессов бота фильтр повторных доставок
+    update_id = models.BigIntegerField(primary_key=True)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class UserUpdateLease(models.Model):
+    # Аренда очереди апдейтов пользователя процессом бота: пока она не снята и не истекла,
+    # апдейты этого telegram_id в других процессах ждут (bot/dispatch.py)
+    telegram_id = models.BigIntegerField(primary_key=True)
+    token = models.CharField(max_length=32)
+    lease_until = models.DateTimeField()
@@ -0,0 +1,190 @@
+# bot/outbox.py
+# Очередь исходящих сообщений.
+# Обработчики не ждут ответа Telegram API: reply/reply_document/edit/answer кладут запрос в
+# очередь и сразу возвращаются, а отправкой занимаются фоновые воркеры.
+# Очередь разбита на шарды по chat_id — сообщения одного чата уходят строго по
+# порядку одним воркером. Шарды ограничены по размеру: при переполнении
+# обработчик ждёт свободного места (backpressure). После RetryAfter отправка
+# приостанавливается через общий token bucket (bot/ratelimit.py).
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest
+
+from .metrics import Counter, Gauge, Histogram
+from .ratelimit import get_bucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+LATENCY_WINDOW = 1000
+
+
+class OutboxStats:
+    """Счётчики очереди и задержки отправки по последним LATENCY_WINDOW сообщениям."""
+
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+        self.blocked = 0
+        self.send_latency = deque(maxlen=LATENCY_WINDOW)
+        self.queue_latency = deque(maxlen=LATENCY_WINDOW)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def snapshot(self, depth):
+        return {
+            'depth': depth,
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'throttled': self.throttled,
+            'blocked': self.blocked,
+            'send_p50': self._percentile(self.send_latency, 0.5),
+            'send_p99': self._percentile(self.send_latency, 0.99),
+            'queue_p50': self._percentile(self.queue_latency, 0.5),
+            'queue_p99': self._percentile(self.queue_latency, 0.99),
+        }
+
+
+class Outbox:
+    def __init__(self, workers, maxsize):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.stats = OutboxStats()
+        self._queues = []
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def snapshot(self):
+        return self.stats.snapshot(self.depth())
+
+    def start(self):
+        if self.running or self.workers <= 0:
+            return
+        self._queues = [asyncio.Queue(self.maxsize) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(q), name=f"outbox-{i}") for i, q in enumerate(self._queues)
+        ]
+
+    async def stop(self):
+        """Дожидается отправки накопленных сообщений и останавливает воркеры."""
+        if not self.running:
+            return
+        for q in self._queues:
+            await q.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks, self._queues = [], []
+        logger.info(f"Outbox stopped: {self.snapshot()}")
+
+    async def submit(self, chat_id, func, *args, **kwargs):
+        """Ставит вызов метода Bot API в очередь чата. Без запущенных воркеров — отправляет сразу."""
+        if not self.running:
+            await func(*args, **kwargs)
+            return
+        queue = self._queues[hash(chat_id) % len(self._queues)]
+        self.stats.enqueued += 1
+        item = (func, args, kwargs, time.monotonic())
+        if queue.full():
+            self.stats.blocked += 1
+            logger.warning(f"Outbox shard is full ({self.maxsize}), handler waits for free space")
+        await queue.put(item)
+
+    async def _worker(self, queue):
+        while True:
+            func, args, kwargs, enqueued_at = await queue.get()
+            try:
+                waited = time.monotonic() - enqueued_at
+                self.stats.queue_latency.append(waited)
+                OUTBOX_QUEUE_SECONDS.observe(waited)
+                await self._send(func, args, kwargs)
+            except Exception:
+                self.stats.failed += 1
+                OUTBOX_FAILED.inc()
+                logger.exception(f"Failed to send {getattr(func, '__name__', func)}")
+            finally:
+                queue.task_done()
+
+    async def _send(self, func, args, kwargs):
+        bucket = get_bucket()
+        for attempt in range(MAX_ATTEMPTS):
+            await bucket.wait_unpaused()
+            started = time.monotonic()
+            try:
+                await func(*args, **kwargs)
+            except RetryAfter as e:
+                self.stats.throttled += 1
+                OUTBOX_THROTTLED.inc()
+                bucket.pause(retry_after_seconds(e))
+                continue
+            except BadRequest as e:
+                # Повторное редактирование тем же текстом — не ошибка
+                if 'not modified' in str(e).lower():
+                    return
+                raise
+            except (TimedOut, NetworkError):
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                self.stats.retried += 1
+                await asyncio.sleep(2 ** attempt)
+                continue
+            elapsed = time.monotonic() - started
+            self.stats.send_latency.append(elapsed)
+            OUTBOX_SEND_SECONDS.observe(elapsed)
+            self.stats.sent += 1
+            return
+        self.stats.failed += 1
+        OUTBOX_FAILED.inc()
+
+
+outbox = Outbox(settings.OUTBOX_WORKERS, settings.OUTBOX_MAXSIZE)
+
+OUTBOX_DEPTH = Gauge('bot_outbox_depth', "Messages waiting in the outbound queue", outbox.depth)
+OUTBOX_QUEUE_SECONDS = Histogram('bot_outbox_queue_seconds', "Time a message waited in the outbound queue")
+OUTBOX_SEND_SECONDS = Histogram('bot_outbox_send_seconds', "Bot API call latency for queued messages")
+OUTBOX_FAILED = Counter('bot_outbox_failed_total', "Queued messages that could not be sent")
+OUTBOX_THROTTLED = Counter('bot_outbox_throttled_total', "RetryAfter responses to queued messages")
+
+
+# =============== ОТПРАВКА ИЗ ОБРАБОТЧИКОВ ===============
+
+def _query_chat_id(query):
+    # У callback-запросов к старым сообщениям message может отсутствовать
+    return query.message.chat_id if query.message else query.from_user.id
+
+
+async def reply(message, text, **kwargs):
+    await outbox.submit(message.chat_id, message.reply_text, text, **kwargs)
+
+
+async def reply_document(message, document, **kwargs):
+    # document — байты, а не открытый файл: при повторе после RetryAfter его можно отправить ещё раз
+    await outbox.submit(message.chat_id, message.reply_document, document, **kwargs)
+
+
+async def edit(query, text, **kwargs):
+    await outbox.submit(_query_chat_id(query), query.edit_message_text, text, **kwargs)
+
+
+async def answer(query, text=None, **kwargs):
+    await outbox.submit(_query_chat_id(query), query.answer, text, **kwargs)
@@ -0,0 +1,91 @@
+# bot/ratelimit.py
+# Ограничение скорости исходящих запросов к Telegram Bot API.
+# Лимиты Telegram: около 30 сообщений в секунду суммарно и не больше
+# одного сообщения в секунду в один чат.
+import asyncio
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+
+def retry_after_seconds(error):
+    """Пауза из telegram.error.RetryAfter в секундах (int или timedelta в разных версиях PTB)."""
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # Flood control: до истечения паузы токены не выдаются никому
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def wait_unpaused(self):
+        # Для срочных сообщений (ответы в диалогах): токен не расходуется, но пауза соблюдается
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_bucket = None
+
+
+def get_bucket():
+    """Общий для процесса token bucket: пауза после RetryAfter действует на все исходящие сообщения.
+
+    Токены расходуют только рассылки (BROADCAST_RATE в секунду), оставляя запас
+    до лимита Telegram для ответов в диалогах.
+    """
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(settings.BROADCAST_RATE)
+    return _bucket
+
+
+class PerChatLimiter:
+    """Не чаще одного сообщения в interval секунд в один чат."""
+
+    def __init__(self, interval=1.0, maxsize=10000):
+        self.interval = interval
+        self.maxsize = maxsize
+        self._next_allowed = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        wait = self._next_allowed.get(chat_id, 0.0) - now
+        self._next_allowed[chat_id] = max(now, now + wait) + self.interval
+        if len(self._next_allowed) > self.maxsize:
+            # Старые записи уже не ограничивают отправку — удаляем их
+            self._next_allowed = {k: v for k, v in self._next_allowed.items() if v > now}
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -0,0 +1,169 @@
+# bot/recalc.py
+# Пересчёт начислений услуги после ретроактивного изменения тарифов.
+# Подтверждённые показания проходятся по каждому пользователю в порядке времени,
+# каждая пара соседних показаний заново оценивается по свежей таблице тарифов
+# (с делением периода на границах тарифов), а расхождения с сохранёнными
+# Charge применяются bulk_update/bulk_create/delete в одной транзакции вместе с
+# поправками UserBalance (один UPDATE на пачку пользователей). Закрытые периоды
+# (снимки Statement, архив bot/archive.py) не пересчитываются.
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max
+
+from .billing import closed_until
+from .ledger import add_charges_to_balances
+from .models import User, MeterReading, Charge
+from .tariffs import load_tariff_table, price_consumption
+
+USER_BATCH_SIZE = 500
+
+
+class RecalcReport:
+    def __init__(self, utility, dry_run):
+        self.utility = utility
+        self.dry_run = dry_run
+        self.users = 0
+        self.checked = 0
+        self.updated = 0
+        self.created = 0
+        self.deleted = 0
+        self.unpriced = 0
+        self.delta = Decimal('0')
+        # Начало пересчёта, если окно задевало закрытые периоды
+        self.closed_until = None
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def summary(self):
+        mode = " (проверка, без записи)" if self.dry_run else ""
+        text = (
+            f"Пересчёт «{self.utility.name}»{mode}:\n"
+            f"Пользователей: {self.users}, периодов: {self.checked}\n"
+            f"Изменено начислений: {self.updated}, создано: {self.created}, удалено: {self.deleted}\n"
+            f"Без тарифа: {self.unpriced}\n"
+            f"Изменение суммы: {self.delta:+.2f} руб.\n"
+            f"Время: {self.elapsed:.2f} с"
+        )
+        if self.closed_until is not None:
+            text += f"\nПериоды до {self.closed_until:%Y-%m-%d} закрыты и не пересчитаны"
+        return text
+
+
+def _baselines(utility, user_ids, since):
+    # Последнее показание каждого пользователя до начала окна — начало первого периода
+    latest = dict(
+        MeterReading.objects
+        .filter(utility=utility, is_confirmed=True, user_id__in=user_ids, timestamp__lte=since)
+        .values('user_id')
+        .annotate(last_ts=Max('timestamp'))
+        .values_list('user_id', 'last_ts')
+    )
+    if not latest:
+        return []
+    return [
+        r for r in MeterReading.objects.filter(
+            utility=utility, is_confirmed=True, user_id__in=user_ids, timestamp__in=set(latest.values())
+        ).only('user_id', 'value', 'timestamp')
+        if latest.get(r.user_id) == r.timestamp
+    ]
+
+
+def _recalculate_batch(utility, user_ids, since, until, table, report):
+    # Пользователи пачки блокируются до чтения показаний, как при вводе показания в боте
+    # (bot/logic.py): иначе новое показание с начислением, записанное между чтением
+    # показаний и блокировкой Charge, попало бы в «лишние» и было удалено
+    list(
+        User.objects.select_for_update().filter(id__in=user_ids)
+        .order_by('id').values_list('id', flat=True)
+    )
+    readings = MeterReading.objects.filter(utility=utility, is_confirmed=True, user_id__in=user_ids)
+    if since is not None:
+        readings = readings.filter(timestamp__gt=since)
+    if until is not None:
+        readings = readings.filter(timestamp__lte=until)
+    readings = list(readings.only('user_id', 'value', 'timestamp'))
+    if since is not None:
+        readings += _baselines(utility, user_ids, since)
+    readings.sort(key=lambda r: (r.user_id, r.timestamp))
+
+    charges = Charge.objects.select_for_update().filter(utility=utility, user_id__in=user_ids)
+    if since is not None:
+        charges = charges.filter(period_end__gt=since)
+    if until is not None:
+        charges = charges.filter(period_end__lte=until)
+    existing = {(c.user_id, c.period_end): c for c in charges}
+
+    to_update, to_create = [], []
+    deltas = {}
+    previous = None
+    for reading in readings:
+        if previous is None or previous.user_id != reading.user_id:
+            previous = reading
+            continue
+        consumption = reading.value - previous.value
+        period_start, period_end = previous.timestamp, reading.timestamp
+        previous = reading
+        if consumption <= 0:
+            # Начисление за такой период, если было, удаляется ниже вместе с прочими лишними
+            continue
+        report.checked += 1
+        amount = price_consumption(utility.id, consumption, period_start, period_end, table)
+        if amount is None:
+            report.unpriced += 1
+            continue
+        charge = existing.pop((reading.user_id, period_end), None)
+        if charge is None:
+            to_create.append(Charge(
+                user_id=reading.user_id, utility=utility, period_start=period_start,
+                period_end=period_end, consumption=consumption, amount=amount,
+            ))
+            delta = amount
+        elif (charge.amount, charge.consumption, charge.period_start) != (amount, consumption, period_start):
+            delta = amount - charge.amount
+            charge.amount, charge.consumption, charge.period_start = amount, consumption, period_start
+            to_update.append(charge)
+        else:
+            continue
+        if delta:
+            deltas[reading.user_id] = deltas.get(reading.user_id, Decimal('0')) + delta
+            report.delta += delta
+
+    # Оставшиеся начисления не соответствуют ни одному оплачиваемому периоду:
+    # расход стал нулевым или отрицательным, тарифа на период больше нет
+    to_delete = list(existing.values())
+    for charge in to_delete:
+        deltas[charge.user_id] = deltas.get(charge.user_id, Decimal('0')) - charge.amount
+        report.delta -= charge.amount
+
+    report.updated += len(to_update)
+    report.created += len(to_create)
+    report.deleted += len(to_delete)
+    if not report.dry_run:
+        Charge.objects.bulk_update(to_update, ['amount', 'consumption', 'period_start'], batch_size=500)
+        Charge.objects.bulk_create(to_create, batch_size=500)
+        Charge.objects.filter(pk__in=[c.pk for c in to_delete]).delete()
+        add_charges_to_balances({user_id: delta for user_id, delta in deltas.items() if delta})
+
+
+def recalculate_charges(utility, since=None, until=None, dry_run=False):
+    """Пересчитывает начисления услуги с периодами, заканчивающимися в (since, until].
+
+    Возвращает RecalcReport. При dry_run изменения только подсчитываются.
+    """
+    report = RecalcReport(utility, dry_run)
+    table = load_tariff_table()
+    user_ids = list(
+        MeterReading.objects.filter(utility=utility, is_confirmed=True)
+        .order_by('user_id').values_list('user_id', flat=True).distinct()
+    )
+    report.users = len(user_ids)
+    with transaction.atomic():
+        closed = closed_until(lock=not dry_run)
+        if closed is not None and (since is None or since < closed):
+            since = report.closed_until = closed
+        for i in range(0, len(user_ids), USER_BATCH_SIZE):
+            _recalculate_batch(utility, user_ids[i:i + USER_BATCH_SIZE], since, until, table, report)
+    report.elapsed = time.monotonic() - report.started
+    return report
@@ -0,0 +1,116 @@
+# bot/router.py
+# Таблицы маршрутизации обработчиков: callback_data -> обработчик по префиксу
+# и состояние FSM -> обработчик ввода текста. Поиск маршрута — один поиск в словаре,
+# аргументы callback_data разбираются по типам, объявленным при регистрации.
+import logging
+
+logger = logging.getLogger(__name__)
+
+# =============== ФОРМАТ CALLBACK_DATA ===============
+# «префикс:арг1:арг2». Формат совпадает с прежним, поэтому кнопки,
+# уже отправленные в чаты, продолжают работать.
+
+SEPARATOR = ':'
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_DATA = 64
+
+
+def pack(prefix, *args):
+    """callback_data для маршрута prefix с аргументами args."""
+    parts = [prefix] + [str(arg) for arg in args]
+    if any(SEPARATOR in part for part in parts):
+        raise ValueError(f"callback_data part contains {SEPARATOR!r}: {parts}")
+    data = SEPARATOR.join(parts)
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data longer than {MAX_CALLBACK_DATA} bytes: {data}")
+    return data
+
+
+def pack_prefix(prefix, *args):
+    """Начало callback_data для клавиатур услуг: последний аргумент (id услуги) дописывает catalog."""
+    return pack(prefix, *args) + SEPARATOR
+
+
+def unpack(data):
+    """(префикс, список строковых аргументов)."""
+    prefix, *args = (data or '').split(SEPARATOR)
+    return prefix, args
+
+
+# =============== МАРШРУТЫ ===============
+
+class Route:
+    def __init__(self, callback, types, admin, deny):
+        self.callback = callback
+        self.types = types
+        self.admin = admin
+        self.deny = deny
+
+    def parse(self, args):
+        if len(args) != len(self.types):
+            raise ValueError(f"expected {len(self.types)} argument(s), got {len(args)}")
+        return [cast(arg) for cast, arg in zip(self.types, args)]
+
+
+class CallbackRouter:
+    """Обработчики нажатий на кнопки по префиксу callback_data.
+
+    Обработчик вызывается как callback(query, user, *args) с аргументами,
+    приведёнными к типам из route(). Для admin=True участнику без прав
+    показывается deny (None — нажатие молча игнорируется).
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, prefix, *types, admin=False, deny=None):
+        def decorator(callback):
+            if prefix in self.routes:
+                raise ValueError(f"Callback route {prefix!r} is already registered")
+            self.routes[prefix] = Route(callback, types, admin, deny)
+            return callback
+        return decorator
+
+    def resolve(self, data):
+        """(маршрут, аргументы) или (None, None) для неизвестных и испорченных callback_data."""
+        prefix, args = unpack(data)
+        route = self.routes.get(prefix)
+        if route is None:
+            return None, None
+        try:
+            return route, route.parse(args)
+        except ValueError:
+            return None, None
+
+    async def dispatch(self, query, user, denied):
+        """Вызывает обработчик; denied(query, text) — ответ участнику без прав."""
+        route, args = self.resolve(query.data)
+        if route is None:
+            logger.warning(f"Unknown callback_data: {query.data!r}")
+            return
+        if route.admin and not user.is_admin:
+            if route.deny:
+                await denied(query, route.deny)
+            return
+        await route.callback(query, user, *args)
+
+
+class StateRouter:
+    """Обработчики текстовых сообщений по состоянию FSM: callback(update, user, ctx).
+
+    Для admin=True состояние участника без прав сбрасывается без ответа.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def state(self, name, admin=False):
+        def decorator(callback):
+            if name in self.routes:
+                raise ValueError(f"State route {name!r} is already registered")
+            self.routes[name] = Route(callback, (), admin, None)
+            return callback
+        return decorator
+
+    def resolve(self, state):
+        return self.routes.get(state)
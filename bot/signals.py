@@ -0,0 +1,22 @@
+# bot/signals.py
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import catalog, tariffs
+from .models import Tariff, Utility
+
+
+@receiver([post_save, post_delete], sender=Tariff)
+def invalidate_tariff_cache(sender, **kwargs):
+    # Сбрасываем сразу и ещё раз после коммита: между ними другой поток
+    # мог успеть загрузить в кэш старые данные
+    tariffs.invalidate()
+    transaction.on_commit(tariffs.invalidate)
+
+
+
+@receiver([post_save, post_delete], sender=Utility)
+def invalidate_utility_catalog(sender, **kwargs):
+    catalog.invalidate()
+    transaction.on_commit(catalog.invalidate)
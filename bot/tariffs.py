@@ -0,0 +1,92 @@
+# bot/tariffs.py
+# Кэш тарифов в памяти процесса: utility_id -> отсортированные (valid_from, rate).
+# Тарифы меняются несколько раз в год, поэтому поиск действующего тарифа
+# на горячем пути ввода показаний — это bisect по списку без запроса к БД.
+# Кэш сбрасывается сигналами при изменении Tariff (bot/signals.py) и по TTL,
+# чтобы подхватывать изменения, сделанные другими процессами.
+import bisect
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+
+from .models import Tariff
+
+_MICROSECOND = timedelta(microseconds=1)
+
+_lock = threading.Lock()
+_table = None
+_loaded_at = 0.0
+_generation = 0
+
+
+def load_tariff_table():
+    """Свежая таблица тарифов из БД в обход кэша."""
+    return _load()
+
+
+def _load():
+    table = {}
+    rows = Tariff.objects.order_by('utility_id', 'valid_from', 'id').values_list('utility_id', 'valid_from', 'rate')
+    for utility_id, valid_from, rate in rows:
+        valid_froms, rates = table.setdefault(utility_id, ([], []))
+        valid_froms.append(valid_from)
+        rates.append(rate)
+    return table
+
+
+def get_tariff_table():
+    """Словарь utility_id -> ([valid_from...], [rate...]) по возрастанию valid_from."""
+    global _table, _loaded_at
+    table = _table
+    if table is not None and time.monotonic() - _loaded_at < settings.TARIFF_CACHE_TTL:
+        return table
+    with _lock:
+        generation = _generation
+        table = _load()
+        # Если кэш сбросили во время загрузки, результат может быть устаревшим — не сохраняем его
+        if generation == _generation:
+            _table = table
+            _loaded_at = time.monotonic()
+    return table
+
+
+def price_consumption(utility_id, consumption, period_start, period_end, table=None):
+    """Стоимость потребления за период или None, если на конец периода тарифа нет.
+
+    Если в течение периода тариф менялся, потребление делится между тарифами
+    пропорционально времени действия каждого. Часть периода до самого раннего
+    тарифа оплачивается по нему.
+    """
+    valid_froms, rates = (table if table is not None else get_tariff_table()).get(utility_id, ((), ()))
+    end = bisect.bisect_right(valid_froms, period_end)
+    if not end:
+        return None
+    start = max(bisect.bisect_right(valid_froms, period_start) - 1, 0)
+    if start == end - 1:
+        return (consumption * rates[start]).quantize(Decimal('0.01'))
+    total = (period_end - period_start) // _MICROSECOND
+    amount = Decimal('0')
+    for i in range(start, end):
+        segment_start = period_start if i == start else valid_froms[i]
+        segment_end = valid_froms[i + 1] if i + 1 < end else period_end
+        duration = (segment_end - segment_start) // _MICROSECOND
+        amount += consumption * rates[i] * duration / total
+    return amount.quantize(Decimal('0.01'))
+
+
+def latest_tariffs():
+    """Словарь utility_id -> (valid_from, rate) последнего тарифа каждой услуги."""
+    return {
+        utility_id: (valid_froms[-1], rates[-1])
+        for utility_id, (valid_froms, rates) in get_tariff_table().items()
+    }
+
+
+def invalidate():
+    global _table, _generation
+    with _lock:
+        _table = None
+        _generation += 1
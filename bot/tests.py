@@ -0,0 +1,507 @@
+# bot/tests.py
+# Запуск: python manage.py test bot
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.db import connection
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from telegram import Bot, Chat, Message, Update, User as TelegramUser
+
+from communal_bot.asgi import WEBHOOK_PATH, BotApplication
+
+from . import catalog, handlers, tariffs, users
+from .billing import close_period, current_month_start
+from .dispatch import PerUserUpdateProcessor
+from .db import run_in_db
+from .fakes import FakeBot, FakeContext, FakeDocument, FakeUpdate, seed_dataset
+from .fsm import FSM
+from .importer import import_readings
+from .metrics import QueryStats, query_stats
+from .ledger import verify_balances
+from .models import (
+    BillingPeriod, Charge, MeterReading, Payment, Tariff, User, Utility, UserBalance, UserUpdateLease,
+)
+from .recalc import recalculate_charges
+
+
+def _update(update_id, telegram_id):
+    return Update(update_id, message=Message(
+        message_id=update_id,
+        date=datetime.now(dt_timezone.utc),
+        chat=Chat(telegram_id, Chat.PRIVATE),
+        from_user=TelegramUser(telegram_id, "test", False),
+    ))
+
+
+# =============== ОЧЕРЕДЬ АПДЕЙТОВ ===============
+
+class PerUserUpdateProcessorTests(SimpleTestCase):
+    async def test_backlog_of_one_user_does_not_block_others(self):
+        processor = PerUserUpdateProcessor(2)
+        started = time.monotonic()
+        finished = {}
+
+        async def handle(name, seconds):
+            await asyncio.sleep(seconds)
+            finished[name] = time.monotonic() - started
+
+        tasks = [
+            asyncio.create_task(processor.process_update(_update(i, 1), handle(f"a{i}", 0.2)))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(_update(10, 2), handle("b", 0.01))))
+        await asyncio.gather(*tasks)
+
+        self.assertLess(finished["b"], 0.1)
+        # Апдейты одного пользователя — строго по очереди
+        order = sorted((n for n in finished if n.startswith("a")), key=finished.get)
+        self.assertEqual(order, ["a0", "a1", "a2", "a3", "a4"])
+        self.assertGreaterEqual(finished["a4"], 1.0)
+
+    async def test_limit_caps_concurrent_updates(self):
+        processor = PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*[processor.process_update(_update(i, i), handle()) for i in range(6)])
+        self.assertEqual(peak, 2)
+
+
+class SharedUserLeaseTests(TransactionTestCase):
+    # Два экземпляра очереди с общей БД — как два процесса бота
+    async def test_updates_of_one_user_are_serialized_across_processes(self):
+        processes = [PerUserUpdateProcessor(2, shared=True), PerUserUpdateProcessor(2, shared=True)]
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.1)
+            running -= 1
+
+        await asyncio.gather(*[
+            processes[i % 2].process_update(_update(i, 1), handle()) for i in range(4)
+        ])
+        self.assertEqual(peak, 1)
+        self.assertFalse(await run_in_db(UserUpdateLease.objects.exists))
+
+    async def test_expired_lease_is_taken_over(self):
+        # Аренда упавшего процесса: не снята, срок истёк
+        await run_in_db(lambda: UserUpdateLease.objects.create(
+            telegram_id=1, token="dead", lease_until=timezone.now() - timedelta(seconds=1)
+        ))
+        handled = []
+
+        async def handle():
+            handled.append(True)
+
+        await asyncio.wait_for(
+            PerUserUpdateProcessor(1, shared=True).process_update(_update(1, 1), handle()), timeout=5
+        )
+        self.assertEqual(handled, [True])
+
+
+# =============== ВЕБХУК ===============
+
+class WebhookTests(SimpleTestCase):
+    SECRET = "secret"
+
+    def setUp(self):
+        self.app = BotApplication()
+        self.app.secret = self.SECRET
+        self.app.bot_app = SimpleNamespace(running=True, update_queue=asyncio.Queue(), bot=Bot("1:test"))
+
+    async def _post(self, body, token=SECRET.encode()):
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': WEBHOOK_PATH,
+            'headers': [(b'x-telegram-bot-api-secret-token', token)],
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app.webhook(scope, receive, send)
+        return sent[0]['status']
+
+    async def test_update_is_queued(self):
+        self.assertEqual(await self._post(_update(1, 1).to_json().encode()), 200)
+        self.assertEqual(self.app.bot_app.update_queue.qsize(), 1)
+
+    async def test_non_ascii_secret_is_forbidden(self):
+        self.assertEqual(await self._post(b'{}', token="секрет".encode()), 403)
+
+    async def test_json_that_is_not_an_update_is_a_bad_request(self):
+        for body in (b'[]', b'{}', b'{"update_id": 1, "message": []}', b'"text"'):
+            with self.subTest(body=body):
+                self.assertEqual(await self._post(body), 400)
+        self.assertEqual(self.app.bot_app.update_queue.qsize(), 0)
+
+
+# =============== ИМПОРТ ВЕДОМОСТИ ===============
+
+class ImportValidationTests(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        tariffs.invalidate()
+        users.invalidate()
+        self.ids = seed_dataset(3, 1, 3)
+        self.next_value = 5000
+        self.day = 0
+
+    def _import(self, *values):
+        rows = []
+        for line, value in enumerate(values, start=2):
+            self.day += 1
+            rows.append((line, {
+                'telegram_id': str(self.ids['member']), 'utility': str(self.ids['utility']),
+                'value': value, 'timestamp': f"2099-01-{self.day:02d}",
+            }))
+        return import_readings(iter(rows))
+
+    def _assert_rejected(self, value):
+        # Вслед за ошибочной строкой — корректная: импорт не прерывается
+        before = MeterReading.objects.count()
+        self.next_value += 100
+        report = self._import(value, str(self.next_value))
+        self.assertEqual(report.error_count, 1)
+        self.assertEqual(report.errors[0][0], 2)
+        self.assertEqual(report.readings, 1)
+        self.assertEqual(MeterReading.objects.count(), before + 1)
+        self.assertEqual(verify_balances(), [])
+
+    def test_nan_is_a_line_error(self):
+        self._assert_rejected("nan")
+        self._assert_rejected("NaN")
+
+    def test_infinity_is_a_line_error(self):
+        self._assert_rejected("Infinity")
+        self._assert_rejected("-inf")
+
+    def test_overflowing_value_is_a_line_error(self):
+        self._assert_rejected("1e20")
+
+    def test_too_many_decimal_places_is_a_line_error(self):
+        self._assert_rejected("4000.0001")
+
+    def test_row_in_a_closed_period_is_a_line_error(self):
+        before = MeterReading.objects.count()
+        rows = [(2, {
+            'telegram_id': str(self.ids['member']), 'utility': str(self.ids['utility']),
+            'value': "9000", 'timestamp': (current_month_start() - timedelta(days=1)).date().isoformat(),
+        })]
+        report = import_readings(iter(rows))
+        self.assertEqual(report.error_count, 1)
+        self.assertIn("закрытом", report.errors[0][1])
+        self.assertEqual(MeterReading.objects.count(), before)
+
+    def test_conflicting_reading_is_a_chunk_error(self):
+        # Неподтверждённое показание с тем же временем не входит в базовые и ловится только уникальностью
+        MeterReading.objects.create(
+            user=User.objects.get(telegram_id=self.ids['member']), utility_id=self.ids['utility'],
+            value=Decimal('9000'), timestamp=timezone.make_aware(datetime(2099, 1, 2)),
+        )
+        before = MeterReading.objects.count()
+        report = self._import("5100", "5200")
+        self.assertEqual(report.error_count, 2)
+        self.assertEqual(report.readings, 0)
+        self.assertEqual(MeterReading.objects.count(), before)
+        self.assertEqual(verify_balances(), [])
+
+
+# =============== ПЕРЕСЧЁТ НАЧИСЛЕНИЙ ===============
+
+class RecalculateChargesTests(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        tariffs.invalidate()
+        users.invalidate()
+        self.ids = seed_dataset(3, 1, 4)
+        # Закрытые периоды не пересчитываются: здесь все периоды открыты, кроме закрытых в самом тесте
+        BillingPeriod.objects.all().delete()
+        self.utility = Utility.objects.get(id=self.ids['utility'])
+
+    def test_unpriced_periods_lose_their_charges(self):
+        # Без первого тарифа периоды, закончившиеся до второго, больше не оплачиваются
+        first, second = Tariff.objects.filter(utility=self.utility).order_by('valid_from')
+        first.delete()
+        stale = Charge.objects.filter(utility=self.utility, period_end__lt=second.valid_from)
+        self.assertEqual(stale.count(), 3)
+
+        report = recalculate_charges(self.utility)
+
+        self.assertEqual(report.deleted, 3)
+        self.assertFalse(stale.exists())
+        self.assertEqual(verify_balances(), [])
+
+    def test_zero_consumption_drops_the_charge(self):
+        charge = Charge.objects.filter(utility=self.utility).order_by('period_end').first()
+        MeterReading.objects.filter(
+            user_id=charge.user_id, utility=self.utility, timestamp=charge.period_end
+        ).update(value=MeterReading.objects.get(
+            user_id=charge.user_id, utility=self.utility, timestamp=charge.period_start
+        ).value)
+
+        report = recalculate_charges(self.utility)
+
+        self.assertFalse(Charge.objects.filter(pk=charge.pk).exists())
+        self.assertGreaterEqual(report.deleted, 1)
+        self.assertEqual(verify_balances(), [])
+
+    def test_balances_are_updated_in_one_query(self):
+        Tariff.objects.filter(utility=self.utility).update(rate=7)
+        tariffs.invalidate()
+
+        with CaptureQueriesContext(connection) as queries:
+            report = recalculate_charges(self.utility)
+
+        balance_updates = [
+            q for q in queries.captured_queries
+            if q['sql'].startswith('UPDATE') and UserBalance._meta.db_table in q['sql']
+        ]
+        self.assertEqual(report.updated, Charge.objects.filter(utility=self.utility).count())
+        self.assertEqual(len(balance_updates), 1)
+        self.assertEqual(verify_balances(), [])
+
+    def test_closed_periods_are_not_recalculated(self):
+        # Снимки Statement закрытого периода и UserBalance должны сходиться и после пересчёта
+        close_period(current_month_start())
+        Tariff.objects.filter(utility=self.utility).update(rate=7)
+        tariffs.invalidate()
+
+        report = recalculate_charges(self.utility)
+        period = close_period(current_month_start() + timedelta(days=40))
+
+        self.assertEqual(report.updated, 0)
+        self.assertIsNotNone(report.closed_until)
+        for balance in UserBalance.objects.all():
+            statement = period.statements.get(user_id=balance.user_id)
+            self.assertEqual(statement.closing_balance, balance.balance)
+
+    def test_users_are_locked_before_readings_are_read(self):
+        # Иначе показание, сохранённое ботом во время пересчёта, теряет своё начисление
+        with CaptureQueriesContext(connection) as queries:
+            recalculate_charges(self.utility)
+
+        def first(table, after=0):
+            return next((
+                i for i, q in enumerate(queries.captured_queries[after:], start=after)
+                if q['sql'].startswith('SELECT') and f'FROM "{table}"' in q['sql']
+            ), None)
+
+        readings_read = first(MeterReading._meta.db_table, after=first(MeterReading._meta.db_table) + 1)
+        users_locked = first(User._meta.db_table)
+        self.assertIsNotNone(users_locked, "users are not locked")
+        self.assertLess(users_locked, readings_read)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', queries.captured_queries[users_locked]['sql'])
+
+
+# =============== ПЛАНЫ ГОРЯЧИХ ЗАПРОСОВ ===============
+
+def hot_queries():
+    # (описание, запрос, индекс, который должен использоваться)
+    now = timezone.now()
+    return [
+        (
+            "last confirmed reading per (user, utility)",
+            MeterReading.objects.filter(user_id=1, utility_id=1, is_confirmed=True).order_by('-timestamp')[:1],
+            'reading_confirmed_last_idx',
+        ),
+        (
+            "current tariff per utility",
+            Tariff.objects.filter(utility_id=1, valid_from__lte=now).order_by('-valid_from')[:1],
+            'tariff_utility_valid_idx',
+        ),
+        (
+            "latest charges per user",
+            Charge.objects.filter(user_id=1).order_by('-period_end')[:5],
+            'charge_user_period_idx',
+        ),
+        (
+            "latest payments per user",
+            Payment.objects.filter(user_id=1).order_by('-timestamp')[:5],
+            'payment_user_ts_idx',
+        ),
+    ]
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_lookups_use_their_indexes(self):
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах планировщик предпочтёт seq scan — запрещаем его
+            # (до конца транзакции теста), чтобы проверить, что индекс вообще применим
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        for label, queryset, index_name in hot_queries():
+            with self.subTest(label):
+                self.assertIn(index_name, queryset.explain())
+
+
+# =============== БЮДЖЕТ ЗАПРОСОВ ОБРАБОТЧИКОВ ===============
+
+# Наборы данных: число участников, услуг и показаний на счётчик.
+# Число запросов обработчика не должно зависеть от размера данных
+SCALES = {
+    'small': (5, 2, 3),
+    'large': (60, 6, 12),
+}
+
+# Ведомость для импорта: участники, которые есть в обоих наборах данных
+IMPORT_CSV = "\n".join(
+    ["telegram_id,utility,value,timestamp"]
+    + [f"{1000 + i},Услуга 1,{5000 + i},2099-01-01" for i in range(SCALES['small'][0])]
+).encode()
+
+
+def _command(text):
+    return {'text': text}
+
+
+def _callback(data):
+    return {'data': data}
+
+
+def _state(name, **context):
+    return lambda ids: (name, {k: v(ids) if callable(v) else v for k, v in context.items()})
+
+
+# (название, обработчик, кто отправляет, апдейт по ids, состояние FSM по ids, бюджет запросов).
+# Кэши услуг, тарифов и пользователей перед каждым сценарием сбрасываются,
+# поэтому бюджет включает их загрузку.
+SCENARIOS = [
+    ("/start", handlers.start, 'member', lambda ids: _command("/start"), None, 1),
+    ("/submit_reading", handlers.submit_reading, 'member', lambda ids: _command("/submit_reading"), None, 5),
+    ("/add_payment", handlers.add_payment, 'member', lambda ids: _command("/add_payment"), None, 4),
+    ("/balance", handlers.balance, 'member', lambda ids: _command("/balance"), None, 2),
+    ("/statement", handlers.statement, 'member', lambda ids: _command("/statement"), None, 2),
+    ("/add_utility", handlers.add_utility, 'admin', lambda ids: _command("/add_utility"), None, 4),
+    ("/set_tariff", handlers.set_tariff, 'admin', lambda ids: _command("/set_tariff"), None, 5),
+    ("/delete_utility", handlers.delete_utility, 'admin', lambda ids: _command("/delete_utility"), None, 2),
+    ("/delete_tariff", handlers.delete_tariff, 'admin', lambda ids: _command("/delete_tariff"), None, 3),
+    ("/list_utilities", handlers.list_utilities, 'admin', lambda ids: _command("/list_utilities"), None, 2),
+    ("/list_tariffs", handlers.list_tariffs, 'admin', lambda ids: _command("/list_tariffs"), None, 3),
+    ("/list_users", handlers.list_users, 'admin', lambda ids: _command("/list_users"), None, 3),
+    ("/user_balance", handlers.user_balance, 'admin',
+     lambda ids: _command(f"/user_balance {ids['member']}"), None, 6),
+    ("/billing_report", handlers.billing_report, 'admin', lambda ids: _command("/billing_report"), None, 3),
+    ("/admin_submit_reading", handlers.admin_submit_reading, 'admin',
+     lambda ids: _command("/admin_submit_reading"), None, 5),
+    ("/admin_add_payment", handlers.admin_add_payment, 'admin',
+     lambda ids: _command("/admin_add_payment"), None, 5),
+    ("/broadcast", handlers.broadcast, 'admin', lambda ids: _command("/broadcast Проверка"), None, 2),
+    ("/remind", handlers.remind, 'admin', lambda ids: _command("/remind"), None, 2),
+    ("/stats", handlers.stats, 'admin', lambda ids: _command("/stats"), None, 3),
+    ("/export", handlers.export, 'admin',
+     lambda ids: _command(f"/export charges from=2000-01-01 utility={ids['utility']}"), None, 3),
+
+    ("del_util:", handlers.handle_callback, 'admin', lambda ids: _callback(f"del_util:{ids['utility']}"), None, 3),
+    ("del_t_util:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"del_t_util:{ids['utility']}"), None, 6),
+    ("del_t:", handlers.handle_callback, 'admin', lambda ids: _callback(f"del_t:{ids['tariff']}"), None, 5),
+    ("recalc:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"recalc:{ids['utility']}:{int(ids['since'].timestamp())}"), None, 11),
+    ("users_page:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"users_page:{ids['middle_pk']}"), None, 2),
+    ("users_pick:", handlers.handle_callback, 'admin', lambda ids: _callback("users_pick:read:0"), None, 2),
+    ("back_to_del_tariff_util", handlers.handle_callback, 'admin',
+     lambda ids: _callback("back_to_del_tariff_util"), None, 5),
+    ("tariff_util:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"tariff_util:{ids['utility']}"), None, 4),
+    ("admin_read_user:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"admin_read_user:{ids['member']}"), None, 2),
+    ("admin_read_util:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"admin_read_util:{ids['member']}:{ids['utility']}"), None, 4),
+    ("admin_pay_user:", handlers.handle_callback, 'admin',
+     lambda ids: _callback(f"admin_pay_user:{ids['member']}"), None, 4),
+    ("util:", handlers.handle_callback, 'member', lambda ids: _callback(f"util:{ids['utility']}"), None, 4),
+
+    ("text: new utility", handlers.handle_message, 'admin', lambda ids: _command("Газ"),
+     _state("admin_add_utility_name"), 6),
+    ("text: tariff", handlers.handle_message, 'admin', lambda ids: _command("7.50"),
+     _state("admin_awaiting_tariff_value", utility_id=lambda ids: ids['utility']), 5),
+    ("text: reading for user", handlers.handle_message, 'admin', lambda ids: _command("99999"),
+     _state("admin_awaiting_reading_value",
+            target_user_id=lambda ids: ids['member'], utility_id=lambda ids: ids['utility']), 13),
+    ("text: payment for user", handlers.handle_message, 'admin', lambda ids: _command("100"),
+     _state("admin_awaiting_payment_value", target_user_id=lambda ids: ids['member']), 8),
+    ("text: reading", handlers.handle_message, 'member', lambda ids: _command("99999"),
+     _state("awaiting_reading_value", utility_id=lambda ids: ids['utility']), 12),
+    ("text: payment", handlers.handle_message, 'member', lambda ids: _command("50"),
+     _state("awaiting_payment_amount"), 7),
+    ("text: no state", handlers.handle_message, 'member', lambda ids: _command("привет"), None, 1),
+
+    ("document: csv import", handlers.handle_document, 'admin',
+     lambda ids: {'document': FakeDocument("readings.csv", "import"), 'caption': None}, None, 12),
+]
+
+
+def _prepare(scale, actor, make_state):
+    # Холодные кэши процесса, новый набор данных и состояние FSM участника сценария
+    catalog.invalidate()
+    tariffs.invalidate()
+    users.invalidate()
+    ids = seed_dataset(*SCALES[scale])
+    user = User.objects.get(telegram_id=ids[actor])
+    if make_state is None:
+        FSM.clear_state(user)
+    else:
+        FSM.set_state(user, *make_state(ids))
+    users.invalidate()
+    return ids
+
+
+async def _count_queries(handler, telegram_id, update_kwargs):
+    """Запросы к БД, выполненные обработчиком (во всех потоках пула БД), и отправленные ответы."""
+    bot = FakeBot(files={'import': IMPORT_CSV})
+    update = FakeUpdate(bot, telegram_id, **update_kwargs)
+    args = update.message.text.split()[1:] if update.message and update.message.text else []
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    try:
+        await handler(update, FakeContext(bot, args=args))
+    finally:
+        query_stats.reset(token)
+    return stats.count, bot.sent
+
+
+class QueryBudgetTests(TransactionTestCase):
+    """Число запросов каждого обработчика в пределах бюджета и не растёт с объёмом данных.
+
+    Обработчики ходят в БД из пула потоков (bot/db.py), поэтому данные должны быть
+    закоммичены (TransactionTestCase), а запросы считаются QueryStats — тем же
+    счётчиком, что и метрики, — в каждом потоке, а не на соединении теста.
+    """
+
+    def _reset_database(self):
+        # Следующий масштаб — на чистой БД, как между тестами
+        self._fixture_teardown()
+        self._fixture_setup()
+
+    def test_handlers_stay_within_query_budgets(self):
+        for name, handler, actor, make_update, make_state, budget in SCENARIOS:
+            with self.subTest(name):
+                counts = {}
+                for scale in SCALES:
+                    self._reset_database()
+                    ids = asyncio.run(run_in_db(_prepare, scale, actor, make_state))
+                    counts[scale], sent = asyncio.run(_count_queries(handler, ids[actor], make_update(ids)))
+                    self.assertTrue(sent, f"{name}: handler sent no reply")
+                self.assertLessEqual(counts['large'], counts['small'], f"{name}: query count grows with data")
+                self.assertLessEqual(max(counts.values()), budget, f"{name}: over budget")
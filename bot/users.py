@@ -0,0 +1,111 @@
+# bot/users.py
+# Кэш пользователей по telegram_id: большинство апдейтов приходит от уже
+# известных пользователей, и повторный get_or_create для них не нужен.
+# Кэш ограничен по размеру (LRU) и времени жизни записи и полностью
+# сбрасывается при изменении settings.ADMIN_TELEGRAM_IDS.
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .db import run_in_db
+from .fsm import DjangoFSMStorage, get_storage
+from .models import FSMState, User
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+_admin_ids = None
+
+
+def get_cached_user(telegram_id):
+    global _admin_ids
+    with _lock:
+        admin_ids = frozenset(settings.ADMIN_TELEGRAM_IDS)
+        if admin_ids != _admin_ids:
+            _cache.clear()
+            _admin_ids = admin_ids
+            return None
+        item = _cache.get(telegram_id)
+        if item is None:
+            return None
+        user, expires_at = item
+        if expires_at <= time.monotonic():
+            del _cache[telegram_id]
+            return None
+        _cache.move_to_end(telegram_id)
+        return user
+
+
+def remember_user(user):
+    with _lock:
+        _cache[user.telegram_id] = (user, time.monotonic() + settings.USER_CACHE_TTL)
+        _cache.move_to_end(user.telegram_id)
+        while len(_cache) > settings.USER_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def forget_user(telegram_id):
+    with _lock:
+        _cache.pop(telegram_id, None)
+
+
+def invalidate():
+    with _lock:
+        _cache.clear()
+
+
+def _create_user(telegram_id):
+    user, _ = User.objects.get_or_create(
+        telegram_id=telegram_id,
+        defaults={'is_admin': telegram_id in settings.ADMIN_TELEGRAM_IDS}
+    )
+    return user
+
+
+def get_or_create_user(telegram_id):
+    user = get_cached_user(telegram_id)
+    if user is None:
+        user = _create_user(telegram_id)
+        remember_user(user)
+    return user
+
+
+def load_user_and_state(telegram_id):
+    """Пользователь и состояние его диалога: (user, (state_name, context)).
+
+    Для хранилища FSM в БД неизвестный кэшу пользователь загружается вместе
+    с FSMState одним запросом.
+    """
+    storage = get_storage()
+    user = get_cached_user(telegram_id)
+    if user is not None:
+        return user, storage.get(user.pk)
+
+    if isinstance(storage, DjangoFSMStorage):
+        user = User.objects.select_related('fsmstate').filter(telegram_id=telegram_id).first()
+        if user is not None:
+            try:
+                state = storage.state_from_record(user.fsmstate)
+            except FSMState.DoesNotExist:
+                state = (None, {})
+            remember_user(user)
+            return user, state
+
+    user = get_or_create_user(telegram_id)
+    return user, storage.get(user.pk)
+
+
+# Асинхронные варианты: при попадании в кэш обходятся без пула БД
+async def aget_or_create_user(telegram_id):
+    user = get_cached_user(telegram_id)
+    if user is not None:
+        return user
+    return await run_in_db(get_or_create_user, telegram_id)
+
+
+async def aload_user_and_state(telegram_id):
+    user = get_cached_user(telegram_id)
+    if user is not None and not get_storage().blocking:
+        return user, get_storage().get(user.pk)
+    return await run_in_db(load_user_and_state, telegram_id)
@@ -3,13 +3,189 @@ ASGI config for communal_bot project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
-For more details, see
-https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+Запуск: uvicorn communal_bot.asgi:application --host 0.0.0.0 --port $PORT
+
+- POST /webhook/ — апдейты Telegram: проверяется заголовок X-Telegram-Bot-Api-Secret-Token,
+  апдейт кладётся в очередь Application и сразу подтверждается ответом 200;
+- GET /healthz — процесс жив (отвечает сразу после старта);
+- GET /readyz — бот запущен и вебхук установлен;
+- GET /metrics — метрики процесса в формате Prometheus (bot/metrics.py);
+- остальные пути — Django.
+
+Django и python-telegram-bot импортируются в фоне после старта сервера,
+поэтому /healthz доступен до окончания инициализации бота.
 """
 
+import asyncio
+import hmac
+import json
+import logging
 import os
-from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'communal_bot.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+# Совпадает с bot.application.WEBHOOK_PATH (модуль не импортируется здесь ради быстрого старта)
+WEBHOOK_PATH = '/webhook/'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class BotApplication:
+    def __init__(self):
+        self.bot_app = None
+        self.secret = None
+        self.error = None
+        self._startup = None
+        self._django = None
+
+    @property
+    def ready(self):
+        return self.bot_app is not None and self.bot_app.running
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            self.ensure_started()
+            path = scope['path']
+            if path == '/healthz':
+                await self.respond(send, 200, b'ok')
+                return
+            if path == '/readyz':
+                if self.ready:
+                    await self.respond(send, 200, b'ready')
+                else:
+                    await self.respond(send, 503, f"not ready: {self.error or 'starting'}".encode())
+                return
+            if path == '/metrics':
+                from bot.metrics import render
+                await self.respond(send, 200, render().encode(), b'text/plain; version=0.0.4; charset=utf-8')
+                return
+            if path == WEBHOOK_PATH:
+                await self.webhook(scope, receive, send)
+                return
+        await self.django_app()(scope, receive, send)
+
+    # =============== ЗАПУСК И ОСТАНОВКА БОТА ===============
+
+    def ensure_started(self):
+        # Запуск по lifespan или, если сервер его не поддерживает, по первому запросу
+        if self._startup is None:
+            self._startup = asyncio.get_running_loop().create_task(self.start_bot())
+
+    async def start_bot(self):
+        import django
+        django.setup()
+        from bot.application import (
+            build_application, start_webhook_application, stop_webhook_application, webhook_secret
+        )
+        self.secret = webhook_secret()
+        delay = 1
+        while True:
+            app = build_application(updater=False)
+            try:
+                await start_webhook_application(app)
+            except Exception as exc:
+                # Например, Telegram API временно недоступен: /readyz отвечает 503, пробуем снова
+                self.error = repr(exc)
+                logger.exception(f"Failed to start Telegram application, retrying in {delay} s")
+                try:
+                    await stop_webhook_application(app)
+                except Exception:
+                    pass
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            self.bot_app = app
+            self.error = None
+            return
+
+    async def stop_bot(self):
+        if self._startup is not None and not self._startup.done():
+            self._startup.cancel()
+        if self.bot_app is not None:
+            from bot.application import stop_webhook_application
+            await stop_webhook_application(self.bot_app)
+            self.bot_app = None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await self.stop_bot()
+                finally:
+                    await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def django_app(self):
+        if self._django is None:
+            from django.core.asgi import get_asgi_application
+            self._django = get_asgi_application()
+        return self._django
+
+    # =============== ВЕБХУК ===============
+
+    async def webhook(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            await self.respond(send, 405, b'method not allowed')
+            return
+        if not self.ready:
+            # Telegram повторит доставку позже
+            await self.respond(send, 503, b'starting')
+            return
+        headers = dict(scope['headers'])
+        # Байты, а не str: compare_digest не принимает строки с не-ASCII символами
+        token = headers.get(b'x-telegram-bot-api-secret-token', b'')
+        if not hmac.compare_digest(token, self.secret.encode()):
+            await self.respond(send, 403, b'forbidden')
+            return
+        body = await self.read_body(receive)
+        if body is None:
+            await self.respond(send, 413, b'too large')
+            return
+        try:
+            data = json.loads(body)
+        except ValueError:
+            await self.respond(send, 400, b'bad request')
+            return
+        from telegram import Update
+        try:
+            update = Update.de_json(data, self.bot_app.bot) if isinstance(data, dict) else None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            update = None
+        if update is None:
+            # Валидный JSON, но не апдейт Telegram (например, [] или {})
+            await self.respond(send, 400, b'bad request')
+            return
+        # Обработка идёт в Application; HTTP-ответ не ждёт обработчиков
+        await self.bot_app.update_queue.put(update)
+        await self.respond(send, 200, b'ok')
+
+    @staticmethod
+    async def read_body(receive):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_SIZE:
+                return None
+            if not message.get('more_body'):
+                return bytes(body)
+
+    @staticmethod
+    async def respond(send, status, body, content_type=b'text/plain; charset=utf-8'):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+application = BotApplication()
@@ -24,10 +24,30 @@ MIDDLEWARE = ['django.middleware.common.CommonMiddleware']
 
 ROOT_URLCONF = 'communal_bot.urls'
 
+# Размер пула потоков, в котором обработчики бота выполняют запросы к БД
+DB_THREAD_POOL_SIZE = config('DB_THREAD_POOL_SIZE', default=8, cast=int)
+
+# Постоянные соединения: поток пула БД держит своё соединение до DB_CONN_MAX_AGE секунд
+# (0 — новое соединение на каждый вызов) и перед повторным использованием проверяет, что оно живо
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=600, cast=int)
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+
+# Пул соединений psycopg 3 (только PostgreSQL, нужен pip install "psycopg[binary,pool]"):
+# соединение берётся из пула на время вызова и возвращается после него.
+# По умолчанию пул на одно соединение больше пула потоков БД: каждому потоку — своё,
+# и ещё одно для вызовов вне пула потоков (команды, запуск бота)
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=DB_THREAD_POOL_SIZE + 1, cast=int)
+DB_POOL_MIN_SIZE = min(config('DB_POOL_MIN_SIZE', default=2, cast=int), DB_POOL_MAX_SIZE)
+# Сколько секунд ждать свободного соединения, прежде чем вызов завершится ошибкой
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10, cast=float)
+
 DATABASES = {}
 if config('DATABASE_URL', default=''):
     import dj_database_url
-    DATABASES['default'] = dj_database_url.parse(config('DATABASE_URL'))
+    DATABASES['default'] = dj_database_url.parse(
+        config('DATABASE_URL'), conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=DB_CONN_HEALTH_CHECKS
+    )
 else:
     # Для локальной разработки (SQLite)
     DATABASES['default'] = {
@@ -35,6 +55,26 @@ else:
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 
+if DB_POOL:
+    # Пул соединений появился в Django 5.1 и работает только с psycopg 3 — проверяем сразу,
+    # а не при первом запросе к БД
+    import importlib.util
+    import django
+    from django.core.exceptions import ImproperlyConfigured
+    if DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql':
+        raise ImproperlyConfigured("DB_POOL requires PostgreSQL (DATABASE_URL=postgres://...)")
+    if django.VERSION < (5, 1):
+        raise ImproperlyConfigured("DB_POOL requires Django >= 5.1")
+    if importlib.util.find_spec('psycopg') is None or importlib.util.find_spec('psycopg_pool') is None:
+        raise ImproperlyConfigured('DB_POOL requires psycopg 3 with the pool extra: pip install "psycopg[binary,pool]"')
+    # Пул не совместим с постоянными соединениями Django: живостью соединений управляет пул
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': DB_POOL_MIN_SIZE,
+        'max_size': DB_POOL_MAX_SIZE,
+        'timeout': DB_POOL_TIMEOUT,
+    }
+
 USE_TZ = True
 TIME_ZONE = 'UTC'
 USE_I18N = False
@@ -44,6 +84,54 @@ STATIC_URL = '/static/'
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN')
 ADMIN_TELEGRAM_IDS = set(int(x.strip()) for x in config('ADMIN_TELEGRAM_IDS', default='').split(',') if x.strip())
 
+# Публичный адрес сервиса (вебхук — <адрес>/webhook/) и секрет заголовка X-Telegram-Bot-Api-Secret-Token
+# (по умолчанию выводится из токена бота)
+WEBHOOK_BASE_URL = config('RENDER_EXTERNAL_URL', default='')
+TELEGRAM_WEBHOOK_SECRET = config('TELEGRAM_WEBHOOK_SECRET', default='')
+
+# Максимум одновременно обрабатываемых апдейтов (0 — последовательная обработка).
+# Апдейты одного пользователя всегда обрабатываются по очереди.
+BOT_CONCURRENT_UPDATES = config('BOT_CONCURRENT_UPDATES', default=0, cast=int)
+
+# Время жизни кэша тарифов в памяти процесса (секунды)
+TARIFF_CACHE_TTL = config('TARIFF_CACHE_TTL', default=300, cast=int)
+
+# Время жизни кэша каталога услуг и клавиатур (секунды)
+CATALOG_CACHE_TTL = config('CATALOG_CACHE_TTL', default=300, cast=int)
+
+# Хранилище состояний диалогов (FSM): 'django' (таблица FSMState), 'memory'
+# (LRU в памяти процесса, только для одного процесса), 'redis' (нужен пакет redis)
+# или путь к своему классу хранилища
+FSM_BACKEND = config('FSM_BACKEND', default='django')
+FSM_TTL = config('FSM_TTL', default=24 * 60 * 60, cast=int)
+FSM_MEMORY_MAXSIZE = config('FSM_MEMORY_MAXSIZE', default=10000, cast=int)
+FSM_REDIS_URL = config('FSM_REDIS_URL', default='redis://localhost:6379/0')
+
+# Кэш пользователей по telegram_id: максимум записей и время жизни записи (секунды)
+USER_CACHE_SIZE = config('USER_CACHE_SIZE', default=10000, cast=int)
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=600, cast=int)
+
+# Автоматически закрывать расчётный период 1-го числа каждого месяца (JobQueue бота)
+BILLING_AUTO_CLOSE = config('BILLING_AUTO_CLOSE', default=True, cast=bool)
+
+# Рассылки: сообщений в секунду суммарно (лимит Telegram ~30) и одновременных запросов к API
+BROADCAST_RATE = config('BROADCAST_RATE', default=25, cast=float)
+BROADCAST_CONCURRENCY = config('BROADCAST_CONCURRENCY', default=10, cast=int)
+
+# Очередь исходящих сообщений: воркеров (шардов по chat_id; 0 — отправлять прямо из обработчика)
+# и максимальная длина очереди одного шарда
+OUTBOX_WORKERS = config('OUTBOX_WORKERS', default=8, cast=int)
+OUTBOX_MAXSIZE = config('OUTBOX_MAXSIZE', default=500, cast=int)
+
+# Отбрасывать повторно доставленные апдейты (общая для всех процессов таблица ProcessedUpdate)
+# и сколько секунд хранить их update_id
+UPDATE_DEDUP = config('UPDATE_DEDUP', default=True, cast=bool)
+UPDATE_DEDUP_TTL = config('UPDATE_DEDUP_TTL', default=86400, cast=int)
+
+# Очередь апдейтов одного пользователя общая для всех процессов (аренда в таблице UserUpdateLease):
+# нужна, если несколько процессов бота получают апдейты без привязки пользователя к процессу
+UPDATE_USER_LEASE = config('UPDATE_USER_LEASE', default=False, cast=bool)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
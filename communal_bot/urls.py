@@ -3,5 +3,5 @@ from django.http import HttpResponse
 from django.urls import path
 
 urlpatterns = [
-    path('', lambda r: HttpResponse("Bot is running via telegram_bot command")),
+    path('', lambda r: HttpResponse("Bot is running, webhook: /webhook/")),
 ]
\ No newline at end of file